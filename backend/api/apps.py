@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Conecta a invalidação do cache das listagens
+        from . import signals  # noqa: F401
+        # Mede o SQL de toda conexão nova quando há um perfil ativo
+        from django.db.backends.signals import connection_created
+        from .profiling import instalar_medidor_sql
+        connection_created.connect(instalar_medidor_sql)
@@ -0,0 +1,60 @@
+# backend/api/arquivos.py
+"""
+Entrega protegida dos PDFs armazenados em MEDIA_ROOT.
+
+O Django autoriza o acesso (URL assinada com validade) e delega o envio do
+arquivo ao nginx via X-Accel-Redirect para uma location `internal`, que usa
+sendfile e atende Range e ETag sem passar os bytes pelo Python. Sem nginx
+(desenvolvimento), o arquivo é servido pelo próprio Django.
+"""
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse
+
+_SALT = 'api.fatura.arquivo'
+
+
+def _signer():
+    return signing.TimestampSigner(salt=_SALT)
+
+
+def assinar(identificador):
+    """Gera o token que autoriza o download de `identificador` por tempo limitado"""
+    signer = _signer()
+    # Mantém apenas "timestamp:assinatura"; o identificador já está na URL
+    return signer.sign(str(identificador)).split(signer.sep, 1)[1]
+
+
+def token_valido(identificador, token):
+    if not token:
+        return False
+    signer = _signer()
+    try:
+        signer.unsign(f"{identificador}{signer.sep}{token}", max_age=settings.MEDIA_URL_VALIDADE_SEGUNDOS)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def resposta_arquivo(nome, content_type, nome_download, anexo=False):
+    """
+    Resposta para o arquivo `nome` (relativo a MEDIA_ROOT). Com
+    MEDIA_X_ACCEL_REDIRECT ativo, apenas instrui o nginx a servi-lo.
+    """
+    disposicao = 'attachment' if anexo else 'inline'
+    if settings.MEDIA_X_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(f"{settings.MEDIA_X_ACCEL_PREFIX}{nome}")
+        response['Content-Disposition'] = f'{disposicao}; filename="{nome_download}"'
+        return response
+
+    caminho = os.path.join(settings.MEDIA_ROOT, nome)
+    return FileResponse(
+        open(caminho, 'rb'),
+        content_type=content_type,
+        as_attachment=anexo,
+        filename=nome_download
+    )
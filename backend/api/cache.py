@@ -0,0 +1,146 @@
+# backend/api/cache.py
+"""
+Cache das respostas serializadas das listagens (clientes, UCs e faturas).
+
+Cada lista tem uma versão própria, por cliente. Os sinais de post_save e
+post_delete (api/signals.py) incrementam a versão da lista afetada, então uma
+resposta calculada antes de uma alteração nunca volta a ser lida, mesmo que
+seja gravada no cache depois dela.
+
+Só o Redis tem add/incr atômicos. No cache em arquivo (padrão), a trava
+contra o cálculo simultâneo da mesma chave é aproximada (dois workers podem
+calcular juntos, sem prejuízo além do trabalho repetido) e os contadores de
+acertos e falhas ficam na memória de cada processo, para não gravar um
+arquivo a cada request.
+"""
+import logging
+import secrets
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLIENTES = 'clientes'
+CLIENTE = 'cliente'
+UCS = 'ucs'
+FATURAS = 'faturas'
+LISTAS = [CLIENTES, CLIENTE, UCS, FATURAS]
+
+PREFIXO = 'api'
+# Tempo máximo (segundos) que um request espera outro worker preencher a mesma chave
+ESPERA_TRAVA = 2.0
+
+# Contadores do processo, usados quando o cache não tem incr atômico
+_contadores = Counter()
+_contadores_lock = threading.Lock()
+
+
+def _atomico():
+    return bool(settings.CACHE_REDIS_URL)
+
+
+def _escopo(customer_id):
+    return '*' if customer_id is None else customer_id
+
+
+def _chave_versao(lista, customer_id):
+    return f"{PREFIXO}:versao:{lista}:{_escopo(customer_id)}"
+
+
+def _nova_versao():
+    # Única por chamada: nunca repete uma versão antiga se a chave for descartada pelo cache,
+    # e duas invalidações simultâneas não gravam o mesmo valor
+    return f"{time.time_ns():x}{secrets.token_hex(4)}"
+
+
+def _versao(lista, customer_id):
+    chave = _chave_versao(lista, customer_id)
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, _nova_versao(), timeout=None)
+        versao = cache.get(chave)
+    return versao
+
+
+def _incrementar(chave):
+    if not _atomico():
+        with _contadores_lock:
+            _contadores[chave] += 1
+        return
+    if cache.add(chave, 1, timeout=None):
+        return
+    try:
+        cache.incr(chave)
+    except ValueError:
+        # A chave expirou entre o add e o incr
+        cache.add(chave, 1, timeout=None)
+
+
+def _contador(chave):
+    if not _atomico():
+        with _contadores_lock:
+            return _contadores[chave]
+    return cache.get(chave, 0)
+
+
+def invalidar(lista, customer_id=None):
+    """Descarta a resposta em cache da lista (do cliente, quando informado)"""
+    # Um set de valor novo, e não incr: no cache em arquivo o incr é ler e gravar, e duas
+    # invalidações simultâneas poderiam chegar à mesma versão
+    cache.set(_chave_versao(lista, customer_id), _nova_versao(), timeout=None)
+
+
+def obter(lista, customer_id, calcular):
+    """
+    Lê a resposta da lista no cache ou a calcula com `calcular()`.
+
+    Só um worker calcula cada chave por vez (trava via cache.add; aproximada
+    no cache em arquivo); os demais aguardam o resultado por até ESPERA_TRAVA
+    segundos antes de calcular por conta própria.
+    """
+    chave = f"{PREFIXO}:{lista}:{_escopo(customer_id)}:v{_versao(lista, customer_id)}"
+    dados = cache.get(chave)
+    if dados is not None:
+        _incrementar(f"{PREFIXO}:metricas:{lista}:acertos")
+        return dados
+    _incrementar(f"{PREFIXO}:metricas:{lista}:falhas")
+
+    trava = f"{chave}:trava"
+    if not cache.add(trava, 1, timeout=ESPERA_TRAVA):
+        limite = time.monotonic() + ESPERA_TRAVA
+        while time.monotonic() < limite:
+            time.sleep(0.05)
+            dados = cache.get(chave)
+            if dados is not None:
+                return dados
+        logger.debug(f"Espera pela chave {chave} esgotada; calculando sem cache")
+        return calcular()
+
+    try:
+        dados = calcular()
+        cache.set(chave, dados, settings.API_CACHE_TTL)
+    finally:
+        cache.delete(trava)
+    return dados
+
+
+def estatisticas():
+    """
+    Acertos, falhas e taxa de acerto de cada lista desde o início do cache
+    (com Redis) ou do processo que atende o request (cache em arquivo)
+    """
+    resultado = {}
+    for lista in LISTAS:
+        acertos = _contador(f"{PREFIXO}:metricas:{lista}:acertos")
+        falhas = _contador(f"{PREFIXO}:metricas:{lista}:falhas")
+        total = acertos + falhas
+        resultado[lista] = {
+            'acertos': acertos,
+            'falhas': falhas,
+            'taxa_acerto': round(acertos / total, 3) if total else None,
+        }
+    return resultado
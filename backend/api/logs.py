@@ -0,0 +1,123 @@
+# backend/api/logs.py
+"""
+Logs estruturados (JSON) e não bloqueantes para o scraper e o task_processor.
+
+As threads de scraping apenas colocam os registros numa fila em memória
+(QueueHandler); um único QueueListener faz a escrita em disco, com rotação
+por tamanho. O contexto do job (job, cliente, UC) é guardado em contextvars
+e anexado a cada registro ainda na thread que o emitiu.
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+from contextlib import contextmanager
+from datetime import datetime
+
+_contexto = contextvars.ContextVar('contexto_log', default={})
+
+CAMPOS_CONTEXTO = ('job', 'customer', 'uc')
+
+
+@contextmanager
+def contexto_log(**campos):
+    """Acrescenta campos ao contexto dos logs emitidos dentro do bloco"""
+    token = _contexto.set({**_contexto.get(), **campos})
+    try:
+        yield
+    finally:
+        _contexto.reset(token)
+
+
+def contexto_atual():
+    """Campos de contexto da thread atual"""
+    return dict(_contexto.get())
+
+
+def copiar_contexto():
+    """
+    Cópia do contexto atual para rodar outra thread com os mesmos campos
+    (threads novas e ThreadPoolExecutor não herdam contextvars).
+    """
+    return contextvars.copy_context()
+
+
+class ContextoFilter(logging.Filter):
+    """Copia o contexto da thread emissora para o registro antes de ele entrar na fila"""
+
+    def filter(self, record):
+        for campo, valor in _contexto.get().items():
+            setattr(record, campo, valor)
+        return True
+
+
+class _FilaHandler(logging.handlers.QueueHandler):
+    """
+    Resolve a mensagem e o traceback antes de enfileirar (o registro não pode
+    carregar objetos da thread), mas mantém o traceback fora de `msg`.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for campo in CAMPOS_CONTEXTO:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                dados[campo] = valor
+        if record.exc_info:
+            dados['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            dados['exc'] = record.exc_text
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+def configurar_logs_assincronos(arquivo, max_bytes, backups, nivel=logging.INFO):
+    """
+    Direciona todos os logs do processo para uma fila consumida por um
+    QueueListener, que grava JSON em `arquivo` (com rotação) e texto no console.
+    Retorna o listener já iniciado.
+    """
+    # Fila sem limite: quem emite nunca espera pela escrita em disco
+    fila = queue.SimpleQueue()
+
+    em_arquivo = logging.handlers.RotatingFileHandler(
+        arquivo, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+    )
+    em_arquivo.setFormatter(JsonFormatter())
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    listener = logging.handlers.QueueListener(fila, em_arquivo, console, respect_handler_level=True)
+
+    em_fila = _FilaHandler(fila)
+    em_fila.addFilter(ContextoFilter())
+
+    raiz = logging.getLogger()
+    raiz.handlers = [em_fila]
+    raiz.setLevel(nivel)
+    # Os loggers configurados em settings.LOGGING passam a usar a fila pela raiz
+    for nome in ('django', 'api'):
+        logger = logging.getLogger(nome)
+        logger.handlers = []
+        logger.propagate = True
+
+    listener.start()
+    return listener
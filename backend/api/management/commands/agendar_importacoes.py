@@ -0,0 +1,128 @@
+# backend/api/management/commands/agendar_importacoes.py
+import logging
+import random
+import signal
+import threading
+import time
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, close_old_connections, transaction
+
+from api.models import Customer
+from api.services import importacao
+
+logger = logging.getLogger(__name__)
+
+
+def mes_esperado(hoje=None, meses_atras=None):
+    """Primeiro dia do mês de referência da fatura que já deveria estar disponível"""
+    hoje = hoje or date.today()
+    meses_atras = settings.AGENDADOR_MESES_ATRAS if meses_atras is None else meses_atras
+    indice = hoje.year * 12 + (hoje.month - 1) - meses_atras
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def distribuir(quantidade, janela, jitter):
+    """
+    Instantes (segundos a partir do início da varredura) espalhados por igual na
+    janela, cada um deslocado aleatoriamente em até ±jitter/2 do espaçamento.
+    """
+    if quantidade == 0:
+        return []
+    passo = janela / quantidade
+    return sorted(
+        max(0.0, min(janela, i * passo + random.uniform(-jitter / 2, jitter / 2) * passo))
+        for i in range(quantidade)
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Agendador periódico: a cada ciclo, enfileira uma importação incremental para cada "
+        "cliente com UCs ativas sem a fatura do mês esperado, espalhando os disparos na janela."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=settings.AGENDADOR_INTERVALO_SEGUNDOS,
+                            help="Segundos entre o início de duas varreduras")
+        parser.add_argument('--janela', type=float, default=settings.AGENDADOR_JANELA_SEGUNDOS,
+                            help="Segundos pelos quais os disparos de uma varredura são espalhados")
+        parser.add_argument('--jitter', type=float, default=settings.AGENDADOR_JITTER,
+                            help="Deslocamento aleatório de cada disparo, como fração do espaçamento (0 a 1)")
+        parser.add_argument('--uma-vez', action='store_true', help="Executa uma varredura e encerra")
+        parser.add_argument('--dry-run', action='store_true', help="Apenas lista o que seria enfileirado")
+
+    def handle(self, *args, **options):
+        self.parar = threading.Event()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sinal, lambda *_: self.parar.set())
+
+        while not self.parar.is_set():
+            inicio = time.monotonic()
+            self.varrer(options)
+            if options['uma_vez']:
+                break
+            # Próximo ciclo conta a partir do início desta varredura
+            self.parar.wait(max(0.0, inicio + options['intervalo'] - time.monotonic()))
+
+    def varrer(self, options):
+        mes = mes_esperado()
+        close_old_connections()
+        customer_ids = list(
+            Customer.objects.filter(
+                unidades_consumidoras__data_vigencia_fim__isnull=True,
+                data_nascimento__isnull=False
+            ).distinct().values_list('id', flat=True)
+        )
+        # Ordem aleatória a cada ciclo: nenhum cliente fica sempre no fim da janela
+        random.shuffle(customer_ids)
+        instantes = distribuir(len(customer_ids), options['janela'], options['jitter'])
+        self.stdout.write(
+            f"Varredura de {mes:%m/%Y}: {len(customer_ids)} clientes em {options['janela']:.0f}s"
+        )
+
+        inicio = time.monotonic()
+        enfileirados = 0
+        for customer_id, instante in zip(customer_ids, instantes):
+            if self.parar.wait(max(0.0, inicio + instante - time.monotonic())):
+                break
+            close_old_connections()
+            try:
+                enfileirados += self.enfileirar(customer_id, mes, options['dry_run'])
+            except Exception as e:
+                logger.error(f"Agendador: erro ao enfileirar o cliente {customer_id}: {e}", exc_info=True)
+        self.stdout.write(f"Varredura de {mes:%m/%Y} concluída: {enfileirados} importações enfileiradas")
+
+    def enfileirar(self, customer_id, mes, dry_run=False):
+        """Enfileira só as UCs ativas ainda sem a fatura do mês. Retorna 1 se algo foi enfileirado."""
+        customer = Customer.objects.filter(pk=customer_id).first()
+        if customer is None:
+            return 0
+        # Verificado na hora do disparo: o cliente pode ter importado durante a janela
+        pendentes = list(
+            customer.unidades_consumidoras
+            .filter(data_vigencia_fim__isnull=True)
+            .exclude(faturas__mes_referencia=mes)
+        )
+        if not pendentes:
+            return 0
+        if dry_run:
+            self.stdout.write(f"Cliente {customer_id}: {len(pendentes)} UCs sem a fatura de {mes:%m/%Y}")
+            return 1
+
+        try:
+            with transaction.atomic():
+                # Faixa de lote: disparos dos usuários passam à frente no task_processor
+                tasks = importacao.criar_tasks(customer, pendentes, prioridade='lote')
+        except (importacao.ImportacaoEmAndamento, IntegrityError):
+            logger.info(f"Agendador: cliente {customer_id} já possui importação em andamento")
+            return 0
+        try:
+            importacao.despachar(customer_id, tasks)
+        except importacao.ProcessadorIndisponivelError as e:
+            logger.error(f"Agendador: task_processor indisponível para o cliente {customer_id}: {e}")
+            return 0
+        logger.info(f"Agendador: {len(tasks)} UCs do cliente {customer_id} enfileiradas para {mes:%m/%Y}")
+        return 1
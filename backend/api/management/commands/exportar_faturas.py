@@ -0,0 +1,51 @@
+# backend/api/management/commands/exportar_faturas.py
+import sys
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Fatura
+from api.services import exportacao
+
+
+def _mes(valor):
+    try:
+        return datetime.strptime(valor, '%Y-%m').date()
+    except ValueError:
+        raise CommandError(f"Mês inválido: {valor} (use YYYY-MM)")
+
+
+class Command(BaseCommand):
+    help = "Exporta as faturas de todos os clientes (ou dos informados) para CSV ou XLSX, em streaming."
+
+    def add_arguments(self, parser):
+        parser.add_argument('saida', help="Arquivo de destino; '-' escreve na saída padrão")
+        parser.add_argument('--formato', choices=sorted(exportacao.FORMATOS), default=None,
+                            help="csv ou xlsx (padrão: pela extensão do arquivo, ou csv)")
+        parser.add_argument('--customers', type=int, nargs='+', help="IDs dos clientes")
+        parser.add_argument('--inicio', type=_mes, help="Primeiro mês de referência (YYYY-MM)")
+        parser.add_argument('--fim', type=_mes, help="Último mês de referência (YYYY-MM)")
+
+    def handle(self, *args, **options):
+        saida = options['saida']
+        formato = options['formato'] or ('xlsx' if saida.lower().endswith('.xlsx') else 'csv')
+
+        faturas = Fatura.objects.all()
+        if options['customers']:
+            faturas = faturas.filter(customer_id__in=options['customers'])
+        if options['inicio']:
+            faturas = faturas.filter(mes_referencia__gte=options['inicio'])
+        if options['fim']:
+            faturas = faturas.filter(mes_referencia__lte=options['fim'])
+
+        destino = sys.stdout.buffer if saida == '-' else open(saida, 'wb')
+        try:
+            tamanho = 0
+            for pedaco in exportacao.gerar(faturas, formato):
+                destino.write(pedaco)
+                tamanho += len(pedaco)
+        finally:
+            if destino is not sys.stdout.buffer:
+                destino.close()
+        if saida != '-':
+            self.stdout.write(f"Exportação {formato.upper()} gravada em {saida} ({tamanho} bytes)")
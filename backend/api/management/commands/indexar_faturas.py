@@ -0,0 +1,42 @@
+# backend/api/management/commands/indexar_faturas.py
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from api.services import busca
+
+
+class Command(BaseCommand):
+    help = (
+        "Extrai o texto dos PDFs das faturas ainda não indexadas, em um pool de processos, "
+        "e atualiza o índice de busca textual."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=None,
+                            help="Processos de extração (padrão: número de CPUs)")
+        parser.add_argument('--lote', type=int, default=100, help="Faturas gravadas por transação")
+        parser.add_argument('--limite', type=int, default=None, help="Máximo de faturas nesta execução")
+        parser.add_argument('--reindexar', action='store_true', help="Extrai de novo todas as faturas")
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help="Segundos entre execuções; 0 executa uma vez e encerra")
+
+    def handle(self, *args, **options):
+        parar = threading.Event()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sinal, lambda *_: parar.set())
+
+        while True:
+            indexadas, erros = busca.indexar(
+                processos=options['processos'],
+                lote=options['lote'],
+                limite=options['limite'],
+                reindexar=options['reindexar'],
+            )
+            if indexadas or erros or not options['intervalo']:
+                self.stdout.write(f"{indexadas} faturas indexadas, {erros} PDFs sem texto extraído")
+            # Só a primeira passada reindexa tudo; as seguintes pegam as faturas novas
+            options['reindexar'] = False
+            if not options['intervalo'] or parar.wait(options['intervalo']):
+                break
@@ -0,0 +1,121 @@
+# backend/api/management/commands/purgar_historico.py
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import FaturaTask, FaturaLog, FaturaResultado, IdempotencyKey
+from api.services import artefatos
+
+
+class Command(BaseCommand):
+    help = (
+        "Arquiva em JSONL comprimido e remove o histórico antigo de FaturaTask e FaturaLog "
+        "(com seus FaturaResultado), em lotes pequenos para não bloquear o scraper."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=settings.HISTORICO_RETENCAO_DIAS,
+                            help="Remove registros mais antigos que este número de dias")
+        parser.add_argument('--manter', type=int, default=settings.HISTORICO_MANTER_POR_CLIENTE,
+                            help="Sempre mantém os N registros mais recentes de cada cliente")
+        parser.add_argument('--lote', type=int, default=settings.HISTORICO_PURGA_LOTE,
+                            help="Quantidade de linhas removidas por transação")
+        parser.add_argument('--pausa', type=float, default=settings.HISTORICO_PURGA_PAUSA,
+                            help="Pausa (segundos) entre lotes")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Apenas conta o que seria removido")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.limite = timezone.now() - timedelta(days=options['dias'])
+        os.makedirs(settings.HISTORICO_ARQUIVO_DIR, exist_ok=True)
+        self.carimbo = datetime.now().strftime('%Y%m%d_%H%M%S')
+
+        # Tasks em aberto nunca são removidas
+        tasks = FaturaTask.objects.filter(status__in=['completed', 'failed', 'cancelled'])
+        total_tasks = self.purgar(FaturaTask, tasks)
+        total_logs = self.purgar(FaturaLog, FaturaLog.objects.all(), dependentes=FaturaResultado)
+
+        # Chaves de idempotência expiradas não têm valor histórico: são apenas removidas
+        chaves = IdempotencyKey.objects.filter(
+            created_at__lt=timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_VALIDADE_HORAS)
+        )
+        if not options['dry_run']:
+            chaves.delete()
+            artefatos.limpar_snapshots()
+
+        verbo = "seriam removidos" if options['dry_run'] else "removidos"
+        self.stdout.write(self.style.SUCCESS(
+            f"{total_tasks} FaturaTask e {total_logs} FaturaLog {verbo} (anteriores a {self.limite:%Y-%m-%d})"
+        ))
+
+    def candidatos(self, queryset, customer_id):
+        """IDs antigos do cliente, preservando os N mais recentes (usa o índice customer/-created_at)"""
+        do_cliente = queryset.filter(customer_id=customer_id)
+        manter = list(do_cliente.order_by('-created_at').values_list('id', flat=True)[:self.options['manter']])
+        return do_cliente.filter(created_at__lt=self.limite).exclude(id__in=manter).order_by('id')
+
+    def purgar(self, model, queryset, dependentes=None):
+        nome = model._meta.model_name
+        customer_ids = (
+            queryset.filter(created_at__lt=self.limite)
+            .order_by().values_list('customer_id', flat=True).distinct()
+        )
+        if self.options['dry_run']:
+            return sum(self.candidatos(queryset, customer_id).count() for customer_id in customer_ids)
+
+        caminho = os.path.join(settings.HISTORICO_ARQUIVO_DIR, f"{nome}_{self.carimbo}.jsonl.gz")
+        total = 0
+        with gzip.open(caminho, 'at', encoding='utf-8') as arquivo:
+            for customer_id in list(customer_ids):
+                candidatos = self.candidatos(queryset, customer_id)
+                while True:
+                    ids = list(candidatos.values_list('id', flat=True)[:self.options['lote']])
+                    if not ids:
+                        break
+                    # Exporta antes de apagar; cada lote é uma transação curta
+                    if dependentes is not None:
+                        self.purgar_dependentes(arquivo, dependentes, ids)
+                    for linha in model.objects.filter(id__in=ids).values().iterator():
+                        self.escrever(arquivo, nome, linha)
+                    arquivo.flush()
+                    with transaction.atomic():
+                        model.objects.filter(id__in=ids).delete()
+                    total += len(ids)
+                    time.sleep(self.options['pausa'])
+
+        if total == 0:
+            os.remove(caminho)
+        else:
+            self.stdout.write(f"{total} {nome} arquivados em {caminho}")
+        return total
+
+    def purgar_dependentes(self, arquivo, dependentes, fatura_log_ids):
+        """
+        Arquiva e remove os registros dependentes dos logs em lotes próprios de
+        no máximo `--lote` linhas: um log pode ter centenas de resultados.
+        """
+        nome = dependentes._meta.model_name
+        do_lote = dependentes.objects.filter(fatura_log_id__in=fatura_log_ids).order_by('id')
+        while True:
+            ids = list(do_lote.values_list('id', flat=True)[:self.options['lote']])
+            if not ids:
+                break
+            for linha in dependentes.objects.filter(id__in=ids).values().iterator():
+                self.escrever(arquivo, nome, linha)
+            arquivo.flush()
+            with transaction.atomic():
+                dependentes.objects.filter(id__in=ids).delete()
+            time.sleep(self.options['pausa'])
+
+    def escrever(self, arquivo, modelo, linha):
+        arquivo.write(json.dumps({'model': f"api.{modelo}", 'fields': linha}, cls=DjangoJSONEncoder))
+        arquivo.write('\n')
@@ -0,0 +1,39 @@
+# backend/api/management/commands/reconciliar_arquivos.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.services import armazenamento
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconcilia os PDFs em MEDIA_ROOT com as faturas do banco: migra o layout antigo, "
+        "remove arquivos órfãos e downloads abandonados e marca as faturas sem PDF."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=settings.RECONCILIACAO_LOTE,
+                            help="Arquivos (ou faturas) comparados por consulta ao banco")
+        parser.add_argument('--carencia', type=float, default=settings.RECONCILIACAO_CARENCIA_SEGUNDOS,
+                            help="Idade mínima (segundos) de um arquivo para ser removido")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Apenas relata o que seria feito")
+
+    def handle(self, *args, **options):
+        resumo = armazenamento.reconciliar(
+            lote=options['lote'], carencia=options['carencia'], dry_run=options['dry_run']
+        )
+        verbo = "seriam" if options['dry_run'] else "foram"
+        self.stdout.write(
+            f"{resumo['migradas']} PDFs do layout antigo {verbo} movidos para YYYY/MM\n"
+            f"{resumo['orfaos']} de {resumo['arquivos_verificados']} arquivos órfãos {verbo} removidos "
+            f"({resumo['bytes_orfaos'] / 1024 / 1024:.1f} MB)\n"
+            f"{resumo['temporarios']} downloads abandonados {verbo} removidos "
+            f"({resumo['bytes_temporarios'] / 1024 / 1024:.1f} MB)\n"
+            f"{resumo['relatorios']} pastas de relatórios de clientes removidos {verbo} apagadas"
+        )
+        estilo = self.style.WARNING if resumo['ausentes'] else self.style.SUCCESS
+        self.stdout.write(estilo(
+            f"{resumo['ausentes']} faturas sem PDF {verbo} marcadas como ausentes, "
+            f"{resumo['recuperadas']} recuperadas"
+        ))
@@ -0,0 +1,52 @@
+# backend/api/management/commands/verificar_faturas.py
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from api.services import integridade
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica, em um pool de processos, a integridade e o checksum dos PDFs das faturas, "
+        "marca as corrompidas e enfileira o novo download das corrompidas e ausentes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=None,
+                            help="Processos de verificação (padrão: número de CPUs)")
+        parser.add_argument('--lote', type=int, default=200, help="Faturas gravadas por transação")
+        parser.add_argument('--limite', type=int, default=None, help="Máximo de faturas nesta execução")
+        parser.add_argument('--reverificar', action='store_true',
+                            help="Verifica todas as faturas, mesmo as verificadas recentemente")
+        parser.add_argument('--sem-rebaixar', action='store_true',
+                            help="Apenas marca as faturas corrompidas, sem enfileirar o novo download")
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help="Segundos entre execuções; 0 executa uma vez e encerra")
+
+    def handle(self, *args, **options):
+        parar = threading.Event()
+        for sinal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sinal, lambda *_: parar.set())
+
+        while True:
+            verificadas, corrompidas = integridade.verificar(
+                processos=options['processos'],
+                lote=options['lote'],
+                limite=options['limite'],
+                reverificar=options['reverificar'],
+            )
+            # Inclui as marcadas em varreduras anteriores cujo novo download não chegou a acontecer
+            a_baixar = {**integridade.pendentes_de_download(), **corrompidas}
+            despachados = [] if options['sem_rebaixar'] else integridade.rebaixar(a_baixar)
+            if verificadas or a_baixar or not options['intervalo']:
+                estilo = self.style.WARNING if a_baixar else self.style.SUCCESS
+                self.stdout.write(estilo(
+                    f"{verificadas} faturas verificadas, {len(corrompidas)} corrompidas agora, "
+                    f"{len(a_baixar)} a baixar de novo, {len(despachados)} clientes enfileirados"
+                ))
+            # Só a primeira passada reverifica tudo; as seguintes pegam as faturas novas e as vencidas
+            options['reverificar'] = False
+            if not options['intervalo'] or parar.wait(options['intervalo']):
+                break
@@ -0,0 +1,82 @@
+# backend/api/middleware.py
+import random
+import sys
+import threading
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+from . import profiling
+
+
+class _ConteudoPerfilado:
+    """Corpo de uma resposta em streaming que encerra o perfil quando termina ou é fechado"""
+
+    def __init__(self, conteudo, encerrar):
+        self._conteudo = iter(conteudo)
+        self._encerrar = encerrar
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._conteudo)
+        except BaseException:
+            # StopIteration (fim do corpo) ou erro ao gerá-lo
+            self.close()
+            raise
+
+    def close(self):
+        encerrar, self._encerrar = self._encerrar, None
+        if encerrar is not None:
+            encerrar()
+
+
+class ProfilingMiddleware:
+    """
+    Perfila a requisição quando ela traz o header X-Profile (se permitido em
+    PROFILING_HEADER_HABILITADO) ou quando é sorteada por
+    PROFILING_TAXA_AMOSTRAGEM. O id do perfil volta no header X-Profile-Id.
+    Nas respostas em streaming (exportações, arquivos), o perfil só termina
+    quando o corpo acaba de ser gerado ou a conexão é fechada.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _deve_perfilar(self, request):
+        if settings.PROFILING_HEADER_HABILITADO and request.headers.get('X-Profile'):
+            return True
+        taxa = settings.PROFILING_TAXA_AMOSTRAGEM
+        return taxa > 0 and random.random() < taxa
+
+    def __call__(self, request):
+        if not self._deve_perfilar(request):
+            return self.get_response(request)
+
+        perfil_id = f"req-{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        ident = threading.get_ident()
+        contexto = profiling.perfilar(
+            perfil_id,
+            filtro_threads=lambda thread: thread.ident == ident,
+            metodo=request.method,
+            caminho=request.path,
+        )
+        perfil = contexto.__enter__()
+        try:
+            response = self.get_response(request)
+            perfil.dados['status'] = response.status_code
+        except BaseException:
+            if not contexto.__exit__(*sys.exc_info()):
+                raise
+        response['X-Profile-Id'] = perfil_id
+        if response.streaming and not response.is_async:
+            perfil.dados['streaming'] = True
+            response.streaming_content = _ConteudoPerfilado(
+                response.streaming_content, lambda: contexto.__exit__(None, None, None)
+            )
+        else:
+            contexto.__exit__(None, None, None)
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_fatura_options_alter_fatura_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faturatask',
+            name='meses_concluidos',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='proxima_tentativa_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='tentativas',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:50
+
+import django.db.models.deletion
+import django.utils.timezone
+from datetime import date, datetime
+from django.db import migrations, models
+
+MESES = {
+    'JAN': 1, 'FEV': 2, 'MAR': 3, 'ABR': 4, 'MAI': 5, 'JUN': 6,
+    'JUL': 7, 'AGO': 8, 'SET': 9, 'OUT': 10, 'NOV': 11, 'DEZ': 12
+}
+
+
+def parse_mes(texto):
+    """Aceita MM/YYYY ou MMM/YYYY, como o scraper"""
+    try:
+        return datetime.strptime(texto, '%m/%Y').date()
+    except (TypeError, ValueError):
+        pass
+    try:
+        mes, ano = texto.split('/')
+        return date(int(ano), MESES[mes.strip().upper()[:3]], 1)
+    except (AttributeError, ValueError, KeyError):
+        return None
+
+
+def backfill_resultados(apps, schema_editor):
+    """Converte o JSON faturas_encontradas dos logs existentes em linhas de FaturaResultado"""
+    FaturaLog = apps.get_model('api', 'FaturaLog')
+    FaturaResultado = apps.get_model('api', 'FaturaResultado')
+
+    lote = []
+    logs = FaturaLog.objects.exclude(faturas_encontradas={}).only(
+        'id', 'customer_id', 'faturas_encontradas', 'created_at'
+    )
+    for log in logs.iterator(chunk_size=200):
+        if not isinstance(log.faturas_encontradas, dict):
+            continue
+        for uc_codigo, itens in log.faturas_encontradas.items():
+            for item in itens or []:
+                if item.get('erro'):
+                    status = 'erro'
+                else:
+                    status = item.get('status') or ('criada' if item.get('baixada') else 'existente')
+                lote.append(FaturaResultado(
+                    fatura_log_id=log.id,
+                    customer_id=log.customer_id,
+                    uc_codigo=uc_codigo,
+                    mes_referencia=parse_mes(item.get('mes')),
+                    mes_texto=(item.get('mes') or '')[:20],
+                    status=status,
+                    erro=item.get('erro'),
+                    created_at=log.created_at,
+                ))
+                if len(lote) >= 1000:
+                    FaturaResultado.objects.bulk_create(lote)
+                    lote = []
+    if lote:
+        FaturaResultado.objects.bulk_create(lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_fatura_task_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaturaResultado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uc_codigo', models.CharField(max_length=50)),
+                ('mes_referencia', models.DateField(blank=True, null=True)),
+                ('mes_texto', models.CharField(blank=True, max_length=20)),
+                ('status', models.CharField(choices=[('criada', 'Baixada'), ('existente', 'Já existente'), ('sem_faturas', 'Sem faturas'), ('erro', 'Erro')], max_length=20)),
+                ('erro', models.TextField(blank=True, null=True)),
+                ('duracao_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('tamanho_bytes', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fatura_resultados', to='api.customer')),
+                ('fatura_log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resultados', to='api.faturalog')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', '-created_at'], name='resultado_status_idx'), models.Index(fields=['customer', '-created_at'], name='resultado_customer_idx'), models.Index(fields=['uc_codigo', 'mes_referencia'], name='resultado_uc_mes_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_resultados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_fatura_resultado'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='faturalog',
+            index=models.Index(fields=['customer', '-created_at'], name='log_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='faturatask',
+            index=models.Index(fields=['customer', '-created_at'], name='task_customer_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_historico_indices'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fatura',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='faturas', to='api.customer'),
+        ),
+        migrations.AlterField(
+            model_name='faturalog',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='fatura_logs', to='api.customer'),
+        ),
+        migrations.AlterField(
+            model_name='faturatask',
+            name='customer',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='fatura_tasks', to='api.customer'),
+        ),
+        migrations.AddIndex(
+            model_name='fatura',
+            index=models.Index(fields=['customer', '-mes_referencia'], name='fatura_customer_mes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='faturatask',
+            index=models.Index(fields=['customer', 'unidade_consumidora', 'status'], name='task_customer_uc_status_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:54
+
+from django.db import migrations, models
+
+STATUS_EM_ABERTO = ['pending', 'processing', 'failed']
+
+
+def deduplicar_tasks_abertas(apps, schema_editor):
+    """Mantém só a task em aberto mais recente de cada UC; as demais são canceladas"""
+    FaturaTask = apps.get_model('api', 'FaturaTask')
+
+    ultima_por_uc = {}
+    duplicadas = []
+    tasks = FaturaTask.objects.filter(status__in=STATUS_EM_ABERTO).order_by('-created_at', '-id')
+    for task_id, uc_id in tasks.values_list('id', 'unidade_consumidora_id').iterator():
+        if uc_id in ultima_por_uc:
+            duplicadas.append(task_id)
+        else:
+            ultima_por_uc[uc_id] = task_id
+    for inicio in range(0, len(duplicadas), 500):
+        FaturaTask.objects.filter(id__in=duplicadas[inicio:inicio + 500]).update(
+            status='cancelled', error_message='Task duplicada para a mesma UC'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicar_tasks_abertas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='faturatask',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'processing', 'failed'])), fields=('unidade_consumidora',), name='unique_open_task_per_uc'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='faturatask',
+            name='prioridade',
+            field=models.CharField(choices=[('interativa', 'Interativa'), ('lote', 'Lote')], default='interativa', max_length=20),
+        ),
+    ]
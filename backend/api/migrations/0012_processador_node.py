@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_task_prioridade'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessadorNode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=100, unique=True)),
+                ('url', models.CharField(max_length=255)),
+                ('capacidade', models.PositiveIntegerField(default=1)),
+                ('sessoes_em_uso', models.PositiveIntegerField(default=0)),
+                ('iniciado_em', models.DateTimeField(auto_now_add=True)),
+                ('ultimo_heartbeat', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='processador',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
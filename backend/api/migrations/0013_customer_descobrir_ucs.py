@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_processador_node'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='descobrir_ucs',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SQLITE_CRIAR = [
+    # Tabela FTS5 de conteúdo externo: guarda só o índice, o texto fica em api_faturatexto
+    "CREATE VIRTUAL TABLE api_faturatexto_fts USING fts5("
+    "conteudo, content='api_faturatexto', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER api_faturatexto_fts_ai AFTER INSERT ON api_faturatexto BEGIN "
+    "INSERT INTO api_faturatexto_fts(rowid, conteudo) VALUES (new.id, new.conteudo); END",
+    "CREATE TRIGGER api_faturatexto_fts_ad AFTER DELETE ON api_faturatexto BEGIN "
+    "INSERT INTO api_faturatexto_fts(api_faturatexto_fts, rowid, conteudo) VALUES ('delete', old.id, old.conteudo); END",
+    "CREATE TRIGGER api_faturatexto_fts_au AFTER UPDATE ON api_faturatexto BEGIN "
+    "INSERT INTO api_faturatexto_fts(api_faturatexto_fts, rowid, conteudo) VALUES ('delete', old.id, old.conteudo); "
+    "INSERT INTO api_faturatexto_fts(rowid, conteudo) VALUES (new.id, new.conteudo); END",
+]
+SQLITE_REMOVER = [
+    "DROP TRIGGER IF EXISTS api_faturatexto_fts_ai",
+    "DROP TRIGGER IF EXISTS api_faturatexto_fts_ad",
+    "DROP TRIGGER IF EXISTS api_faturatexto_fts_au",
+    "DROP TABLE IF EXISTS api_faturatexto_fts",
+]
+POSTGRES_CRIAR = [
+    "CREATE INDEX api_faturatexto_tsv_idx ON api_faturatexto "
+    "USING GIN (to_tsvector('portuguese', conteudo))",
+]
+POSTGRES_REMOVER = [
+    "DROP INDEX IF EXISTS api_faturatexto_tsv_idx",
+]
+
+
+def _executar(schema_editor, comandos):
+    for sql in comandos.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def criar_indice_busca(apps, schema_editor):
+    _executar(schema_editor, {'sqlite': SQLITE_CRIAR, 'postgresql': POSTGRES_CRIAR})
+
+
+def remover_indice_busca(apps, schema_editor):
+    _executar(schema_editor, {'sqlite': SQLITE_REMOVER, 'postgresql': POSTGRES_REMOVER})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_customer_descobrir_ucs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FaturaTexto',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conteudo', models.TextField(blank=True)),
+                ('erro', models.TextField(blank=True, null=True)),
+                ('extraido_em', models.DateTimeField(auto_now=True)),
+                ('fatura', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='texto', to='api.fatura')),
+            ],
+        ),
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
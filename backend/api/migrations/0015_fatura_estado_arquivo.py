@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_fatura_texto'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='estado_arquivo',
+            field=models.CharField(choices=[('ok', 'OK'), ('ausente', 'Arquivo ausente')], default='ok', max_length=20),
+        ),
+    ]
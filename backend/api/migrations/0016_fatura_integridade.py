@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_fatura_estado_arquivo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fatura',
+            name='checksum',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='fatura',
+            name='verificado_em',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='faturatask',
+            name='meses',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='fatura',
+            name='estado_arquivo',
+            field=models.CharField(choices=[('ok', 'OK'), ('ausente', 'Arquivo ausente'), ('corrompido', 'Arquivo corrompido')], default='ok', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_fatura_integridade'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processadornode',
+            name='url',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
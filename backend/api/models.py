@@ -4,6 +4,8 @@ from django.utils import timezone
 from django.utils.text import get_valid_filename
 import os
 
+# Layout antigo (faturas/JAN-2025/...): mantido porque a migração 0001 o referencia;
+# os arquivos existentes são movidos para o layout de upload_to pela reconciliação
 def fatura_upload_path(instance, filename):
     # Extrai o mês e ano da data de referência
     mes_ano_str = instance.mes_referencia.strftime('%b-%Y').upper() # ex: JAN-2025
@@ -37,6 +39,8 @@ class Customer(models.Model):
     endereco = models.CharField(max_length=200)
     telefone = models.CharField(max_length=15, blank=True, null=True)
     email = models.EmailField(max_length=254, blank=True, null=True)
+    # Cadastra automaticamente as UCs do titular encontradas no portal durante a importação
+    descobrir_ucs = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -88,20 +92,37 @@ class UnidadeConsumidora(models.Model):
 
 
 class Fatura(models.Model):
+    ESTADO_ARQUIVO_CHOICES = [
+        ('ok', 'OK'),
+        ('ausente', 'Arquivo ausente'),
+        ('corrompido', 'Arquivo corrompido'),
+    ]
+
     # ID customizado: UC_MES_ANO (ex: 12345678_01_2025)
     id = models.CharField(primary_key=True, max_length=255, editable=False)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='faturas')
+    # Sem índice próprio: coberto pelos índices compostos que começam por customer
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='faturas', db_index=False)
     unidade_consumidora = models.ForeignKey(UnidadeConsumidora, on_delete=models.CASCADE, related_name='faturas')
     mes_referencia = models.DateField()
     arquivo = models.FileField(upload_to=upload_to, max_length=500)
     valor = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     vencimento = models.DateField(null=True, blank=True)
     downloaded_at = models.DateTimeField(auto_now_add=True)
+    # Situação do PDF no armazenamento, atualizada pela reconciliação (manage.py reconciliar_arquivos)
+    # e pela verificação de integridade (manage.py verificar_faturas)
+    estado_arquivo = models.CharField(max_length=20, choices=ESTADO_ARQUIVO_CHOICES, default='ok')
+    # SHA-256 do PDF na última verificação; vazio enquanto não verificado
+    checksum = models.CharField(max_length=64, blank=True, default='')
+    verificado_em = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         # Garante que não haverá faturas duplicadas para a mesma UC no mesmo mês
         unique_together = ('unidade_consumidora', 'mes_referencia')
         ordering = ['-mes_referencia']
+        indexes = [
+            # Listagem de faturas do cliente (get_faturas) já na ordem de exibição
+            models.Index(fields=['customer', '-mes_referencia'], name='fatura_customer_mes_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.id:
@@ -121,26 +142,140 @@ class FaturaTask(models.Model):
         ('processing', 'Processando'),
         ('completed', 'Concluída'),
         ('failed', 'Falhou'),
+        ('cancelled', 'Cancelada'),
+    ]
+    # Status em que a task ainda pode ser executada; no máximo uma por UC
+    STATUS_EM_ABERTO = ['pending', 'processing', 'failed']
+    # Faixas do task_processor: disparos do usuário passam à frente das varreduras em lote
+    PRIORIDADE_CHOICES = [
+        ('interativa', 'Interativa'),
+        ('lote', 'Lote'),
     ]
     
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_tasks')
+    # Sem índice próprio: coberto pelos índices compostos que começam por customer
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_tasks', db_index=False)
     unidade_consumidora = models.ForeignKey(UnidadeConsumidora, on_delete=models.CASCADE, related_name='fatura_tasks')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    prioridade = models.CharField(max_length=20, choices=PRIORIDADE_CHOICES, default='interativa')
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(null=True, blank=True)  # Permitir que seja nulo
+    # Checkpoint: meses (YYYY-MM) já concluídos, para retomar a UC sem repetir downloads
+    meses_concluidos = models.JSONField(default=list, blank=True)
+    # Meses (YYYY-MM) a baixar, inclusive substituindo faturas corrompidas; vazia baixa todos
+    meses = models.JSONField(default=list, blank=True)
+    # Retentativas automáticas com backoff exponencial
+    tentativas = models.PositiveIntegerField(default=0)
+    proxima_tentativa_em = models.DateTimeField(null=True, blank=True)
+    # Nome do ProcessadorNode que recebeu o job; usado para cancelar e redistribuir
+    processador = models.CharField(max_length=100, null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Últimas tasks do cliente e varredura da purga do histórico
+            models.Index(fields=['customer', '-created_at'], name='task_customer_idx'),
+            # Task em aberto da UC (start_fatura_import e process_faturas)
+            models.Index(fields=['customer', 'unidade_consumidora', 'status'], name='task_customer_uc_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['unidade_consumidora'],
+                condition=models.Q(status__in=['pending', 'processing', 'failed']),
+                name='unique_open_task_per_uc'
+            )
+        ]
 
 
 class FaturaLog(models.Model):
     """Log de buscas de faturas por CPF"""
     cpf_titular = models.CharField(max_length=14)
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_logs')
+    # Sem índice próprio: coberto pelos índices compostos que começam por customer
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_logs', db_index=False)
     ucs_encontradas = models.JSONField(default=list)  # Lista de UCs encontradas
     faturas_encontradas = models.JSONField(default=dict)  # Dict com UC como chave e lista de faturas como valor
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', '-created_at'], name='log_customer_idx'),
+        ]
+
+
+class FaturaResultado(models.Model):
+    """Resultado de cada UC/mês processado em uma busca, gravado durante a execução"""
+    STATUS_CHOICES = [
+        ('criada', 'Baixada'),
+        ('existente', 'Já existente'),
+        ('sem_faturas', 'Sem faturas'),
+        ('erro', 'Erro'),
+    ]
+
+    fatura_log = models.ForeignKey(FaturaLog, on_delete=models.CASCADE, related_name='resultados')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='fatura_resultados')
+    uc_codigo = models.CharField(max_length=50)
+    # Nulo quando o resultado é da UC inteira ou o mês não pôde ser lido
+    mes_referencia = models.DateField(null=True, blank=True)
+    mes_texto = models.CharField(max_length=20, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    erro = models.TextField(null=True, blank=True)
+    duracao_ms = models.PositiveIntegerField(null=True, blank=True)
+    tamanho_bytes = models.PositiveBigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # "Todas as faturas com erro na última semana"
+            models.Index(fields=['status', '-created_at'], name='resultado_status_idx'),
+            models.Index(fields=['customer', '-created_at'], name='resultado_customer_idx'),
+            models.Index(fields=['uc_codigo', 'mes_referencia'], name='resultado_uc_mes_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """Resposta de uma requisição de importação, reaproveitada quando o cliente reenvia a mesma Idempotency-Key"""
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='idempotency_keys')
+    chave = models.CharField(max_length=255)
+    # Nulos enquanto a requisição original ainda está em processamento
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    resposta = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'chave'], name='unique_idempotency_key_per_customer')
+        ]
+        indexes = [
+            # Limpeza das chaves expiradas
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+
+class ProcessadorNode(models.Model):
+    """Instância do task_processor registrada por heartbeat"""
+    nome = models.CharField(max_length=100, unique=True)
+    # Vazia quando a instância é alcançada por TASK_PROCESSOR_URL
+    url = models.CharField(max_length=255, blank=True)
+    # Sessões de navegador que a instância aceita; define o peso no anel de hashing
+    capacidade = models.PositiveIntegerField(default=1)
+    sessoes_em_uso = models.PositiveIntegerField(default=0)
+    iniciado_em = models.DateTimeField(auto_now_add=True)
+    ultimo_heartbeat = models.DateTimeField()
+
+    class Meta:
+        ordering = ['nome']
+
+    def __str__(self):
+        return f"{self.nome} ({self.url})"
+
+
+class FaturaTexto(models.Model):
+    """Texto extraído do PDF da fatura, indexado para busca textual (api/services/busca.py)"""
+    # Chave inteira: o índice FTS5 do SQLite referencia as linhas por ela
+    fatura = models.OneToOneField(Fatura, on_delete=models.CASCADE, related_name='texto')
+    conteudo = models.TextField(blank=True)
+    # Preenchido quando o PDF não pôde ser lido; a fatura não volta a ser tentada
+    erro = models.TextField(null=True, blank=True)
+    extraido_em = models.DateTimeField(auto_now=True)
@@ -0,0 +1,166 @@
+# backend/api/profiling.py
+"""
+Profiling opcional de jobs de scraping e de requisições da API.
+
+Um amostrador lê periodicamente as pilhas das threads observadas
+(sys._current_frames) e acumula pilhas no formato "folded" (uma linha
+"f1;f2;f3 contagem"), aceito por flamegraph.pl e speedscope. As consultas SQL
+são contadas e cronometradas por um execute_wrapper instalado em todas as
+conexões; enquanto não há perfil ativo ele só consulta uma contextvar.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_perfil_atual = contextvars.ContextVar('perfil_atual', default=None)
+
+# Consultas SQL mais lentas guardadas no resumo
+MAX_CONSULTAS = 20
+
+
+class AmostradorPilhas(threading.Thread):
+    """Amostra, a cada `intervalo` segundos, as pilhas das threads aceitas por `filtro(thread)`"""
+
+    def __init__(self, filtro, intervalo):
+        super().__init__(name='profiling-amostrador', daemon=True)
+        self.filtro = filtro
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self.amostras = 0
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.intervalo):
+            threads = {thread.ident: thread for thread in threading.enumerate() if self.filtro(thread)}
+            for ident, frame in sys._current_frames().items():
+                thread = threads.get(ident)
+                if thread is not None:
+                    self.pilhas[_pilha(thread.name, frame)] += 1
+            self.amostras += 1
+
+    def parar(self):
+        self._parar.set()
+        self.join()
+
+
+def _pilha(nome_thread, frame):
+    funcoes = []
+    while frame is not None:
+        codigo = frame.f_code
+        funcoes.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}")
+        frame = frame.f_back
+    funcoes.append(nome_thread)
+    return ';'.join(reversed(funcoes))
+
+
+class Perfil:
+    def __init__(self, perfil_id, dados=None):
+        self.perfil_id = perfil_id
+        self.dados = dict(dados or {})
+        self.sql_total = 0
+        self.sql_segundos = 0.0
+        self.consultas = Counter()
+        self.consultas_segundos = Counter()
+        self._lock = threading.Lock()
+        self.amostrador = None
+        self.inicio = time.perf_counter()
+        self.duracao = None
+
+    def registrar_sql(self, sql, segundos):
+        with self._lock:
+            self.sql_total += 1
+            self.sql_segundos += segundos
+            self.consultas[sql] += 1
+            self.consultas_segundos[sql] += segundos
+
+    def resumo(self):
+        mais_lentas = self.consultas_segundos.most_common(MAX_CONSULTAS)
+        return {
+            'id': self.perfil_id,
+            **self.dados,
+            'criado_em': datetime.now().isoformat(timespec='seconds'),
+            'duracao_ms': round((self.duracao or 0) * 1000, 1),
+            'sql': {
+                'consultas': self.sql_total,
+                'tempo_ms': round(self.sql_segundos * 1000, 1),
+                'mais_lentas': [
+                    {'sql': sql, 'execucoes': self.consultas[sql], 'tempo_ms': round(segundos * 1000, 1)}
+                    for sql, segundos in mais_lentas
+                ],
+            },
+            'amostras': self.amostrador.amostras if self.amostrador else 0,
+        }
+
+    def salvar(self):
+        """Grava <id>.json (resumo e SQL) e <id>.folded (pilhas para flame graph)"""
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        base = os.path.join(settings.PROFILING_DIR, self.perfil_id)
+        with open(f"{base}.json", 'w', encoding='utf-8') as arquivo:
+            json.dump(self.resumo(), arquivo, ensure_ascii=False, indent=2)
+        if self.amostrador and self.amostrador.pilhas:
+            with open(f"{base}.folded", 'w', encoding='utf-8') as arquivo:
+                for pilha, contagem in self.amostrador.pilhas.most_common():
+                    arquivo.write(f"{pilha} {contagem}\n")
+        return base
+
+
+def _medir_sql(execute, sql, params, many, context):
+    perfil = _perfil_atual.get()
+    if perfil is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        perfil.registrar_sql(sql, time.perf_counter() - inicio)
+
+
+def instalar_medidor_sql(sender=None, connection=None, **kwargs):
+    """Receptor de connection_created: toda conexão nova passa pelo medidor de SQL"""
+    if connection is not None and _medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_medir_sql)
+
+
+@contextmanager
+def perfilar(perfil_id, filtro_threads=None, **dados):
+    """
+    Perfila o bloco: SQL de todas as threads que herdarem o contexto e, se
+    `filtro_threads` for informado, amostras das pilhas dessas threads.
+    O resultado é gravado em PROFILING_DIR ao final.
+    """
+    from django.db import connection
+    # A conexão desta thread pode ter sido aberta antes do perfil
+    instalar_medidor_sql(connection=connection)
+
+    perfil = Perfil(perfil_id, dados)
+    if filtro_threads is not None:
+        perfil.amostrador = AmostradorPilhas(filtro_threads, settings.PROFILING_INTERVALO)
+        perfil.amostrador.start()
+    token = _perfil_atual.set(perfil)
+    try:
+        yield perfil
+    finally:
+        try:
+            _perfil_atual.reset(token)
+        except ValueError:
+            # Encerrado em outro contexto (corpo em streaming consumido por outra thread)
+            _perfil_atual.set(None)
+        perfil.duracao = time.perf_counter() - perfil.inicio
+        if perfil.amostrador:
+            perfil.amostrador.parar()
+        try:
+            caminho = perfil.salvar()
+            logger.info(f"Perfil {perfil_id} salvo em {caminho}.json")
+        except OSError as e:
+            logger.warning(f"Não foi possível salvar o perfil {perfil_id}: {e}")
@@ -0,0 +1,118 @@
+# backend/api/relatorio_pdf.py
+"""
+Montagem do PDF do relatório consolidado do cliente: página de resumo
+(reportlab) seguida dos PDFs das faturas (pypdf), na ordem recebida.
+
+Roda nos processos do pool de api/services/relatorios.py: não importa o
+Django e recebe apenas dados simples.
+"""
+import io
+import os
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from pypdf import PdfReader, PdfWriter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+def _moeda(valor):
+    if valor is None:
+        return '-'
+    texto = f"{valor:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    return f"R$ {texto}"
+
+
+def _data(valor):
+    return valor.strftime('%d/%m/%Y') if valor else '-'
+
+
+def _resumo(titulo, subtitulo, faturas, ausentes):
+    """Página(s) de resumo: uma tabela por UC com valor e vencimento de cada mês"""
+    estilos = getSampleStyleSheet()
+    conteudo = [
+        Paragraph(escape(titulo), estilos['Title']),
+        Paragraph(escape(subtitulo), estilos['Normal']),
+        Spacer(1, 0.6 * cm),
+    ]
+
+    por_uc = {}
+    for fatura in faturas:
+        por_uc.setdefault(fatura['uc'], []).append(fatura)
+
+    estilo_tabela = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f4e79')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -2), [colors.white, colors.HexColor('#f2f2f2')]),
+    ])
+    total_geral = Decimal('0')
+    for uc, faturas_uc in por_uc.items():
+        total_uc = sum((fatura['valor'] or Decimal('0') for fatura in faturas_uc), Decimal('0'))
+        total_geral += total_uc
+        linhas = [['Mês de referência', 'Vencimento', 'Valor']]
+        linhas += [
+            [fatura['mes_referencia'].strftime('%m/%Y'), _data(fatura['vencimento']), _moeda(fatura['valor'])]
+            for fatura in faturas_uc
+        ]
+        linhas.append(['Total da UC', '', _moeda(total_uc)])
+        conteudo += [
+            Paragraph(f"UC {escape(uc)}", estilos['Heading3']),
+            Table(linhas, colWidths=[5 * cm, 4 * cm, 5 * cm], style=estilo_tabela, repeatRows=1),
+            Spacer(1, 0.4 * cm),
+        ]
+
+    conteudo.append(Paragraph(
+        f"<b>Total do período: {_moeda(total_geral)}</b> em {len(faturas)} faturas de {len(por_uc)} UCs",
+        estilos['Normal']
+    ))
+    if ausentes:
+        conteudo += [
+            Spacer(1, 0.4 * cm),
+            Paragraph(
+                "PDFs indisponíveis, não anexados: " + escape(', '.join(ausentes)),
+                estilos['Italic']
+            ),
+        ]
+
+    saida = io.BytesIO()
+    SimpleDocTemplate(
+        saida, pagesize=A4, title=titulo,
+        leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm
+    ).build(conteudo)
+    saida.seek(0)
+    return saida
+
+
+def gerar_relatorio(destino, titulo, subtitulo, faturas):
+    """
+    Grava em `destino` o resumo seguido dos PDFs das faturas. `faturas` é uma
+    lista de dicts com id, uc, mes_referencia, vencimento, valor e caminho.
+    O arquivo aparece de uma vez (os.replace), nunca pela metade.
+    """
+    ausentes = []
+    leitores = []
+    for fatura in faturas:
+        try:
+            leitores.append(PdfReader(fatura['caminho']))
+        except Exception:
+            ausentes.append(fatura['id'])
+
+    escritor = PdfWriter()
+    escritor.append(PdfReader(_resumo(titulo, subtitulo, faturas, ausentes)))
+    for leitor in leitores:
+        escritor.append(leitor)
+    escritor.add_metadata({'/Title': titulo, '/CreationDate': datetime.now().strftime("D:%Y%m%d%H%M%S")})
+
+    temporario = f"{destino}.{os.getpid()}.tmp"
+    with open(temporario, 'wb') as arquivo:
+        escritor.write(arquivo)
+    os.replace(temporario, destino)
+    return destino
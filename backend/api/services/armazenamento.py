@@ -0,0 +1,275 @@
+# backend/api/services/armazenamento.py
+"""
+Reconciliação entre os PDFs em MEDIA_ROOT e as linhas de Fatura.
+
+Percorre o disco com os.scandir, sem montar a lista completa de arquivos, e
+compara cada lote de nomes com Fatura.arquivo em uma única consulta. Remove
+os arquivos órfãos (de faturas apagadas ou de gravações interrompidas), os
+downloads abandonados em temp_faturas e os relatórios de clientes removidos;
+marca as faturas cujo PDF sumiu; e move os arquivos do layout antigo
+(faturas/JAN-2025/) para o atual (faturas/2025/01/).
+
+Arquivos modificados há menos de `carencia` segundos nunca são removidos:
+podem pertencer a um download ou a uma gravação em andamento.
+"""
+import logging
+import os
+import shutil
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from api import cache as cache_api
+from api.models import Customer, Fatura, upload_to
+from api.services.relatorios import PASTA as PASTA_RELATORIOS
+
+logger = logging.getLogger(__name__)
+
+PASTA_FATURAS = 'faturas'
+PASTA_TEMPORARIA = 'temp_faturas'
+# faturas/JAN-2025/<id>.pdf, gerado pelo antigo fatura_upload_path
+LAYOUT_LEGADO = r'^faturas/[A-Z]{3}-[0-9]{4}/'
+
+
+def _percorrer(raiz):
+    """Arquivos abaixo de `raiz` (DirEntry), em profundidade, sem seguir links"""
+    pendentes = [raiz]
+    while pendentes:
+        try:
+            with os.scandir(pendentes.pop()) as entradas:
+                for entrada in entradas:
+                    if entrada.is_dir(follow_symlinks=False):
+                        pendentes.append(entrada.path)
+                    elif entrada.is_file(follow_symlinks=False):
+                        yield entrada
+        except FileNotFoundError:
+            continue
+
+
+def _lotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while lote := list(islice(iterador, tamanho)):
+        yield lote
+
+
+def _nome_relativo(caminho):
+    return os.path.relpath(caminho, settings.MEDIA_ROOT).replace(os.sep, '/')
+
+
+def _remover_pastas_vazias(raiz):
+    for pasta, subpastas, arquivos in os.walk(raiz, topdown=False):
+        if pasta != raiz and not subpastas and not arquivos:
+            try:
+                os.rmdir(pasta)
+            except OSError:
+                pass
+
+
+def migrar_legado(lote=1000, dry_run=False):
+    """Move os PDFs do layout MON-YYYY para YYYY/MM e atualiza Fatura.arquivo. Retorna a quantidade movida."""
+    legadas = Fatura.objects.filter(arquivo__regex=LAYOUT_LEGADO).only('id', 'customer_id', 'mes_referencia', 'arquivo')
+    if dry_run:
+        return legadas.count()
+
+    movidas = 0
+    clientes = set()
+    ultimo = ''
+    while True:
+        faturas = list(legadas.filter(pk__gt=ultimo).order_by('pk')[:lote])
+        if not faturas:
+            break
+        ultimo = faturas[-1].pk
+        for fatura in faturas:
+            antigo = fatura.arquivo.name
+            origem = os.path.join(settings.MEDIA_ROOT, antigo)
+            if not os.path.isfile(origem):
+                # Fica para marcar_ausentes
+                continue
+            novo = default_storage.get_available_name(upload_to(fatura, antigo))
+            destino = os.path.join(settings.MEDIA_ROOT, novo)
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(origem, destino)
+            # Condicional: se a linha mudou nesse meio tempo, o arquivo volta ao lugar
+            if Fatura.objects.filter(pk=fatura.pk, arquivo=antigo).update(arquivo=novo):
+                movidas += 1
+                clientes.add(fatura.customer_id)
+            else:
+                os.replace(destino, origem)
+
+    for customer_id in clientes:
+        cache_api.invalidar(cache_api.FATURAS, customer_id)
+    if movidas:
+        logger.info(f"{movidas} PDFs movidos do layout antigo para {PASTA_FATURAS}/YYYY/MM")
+    return movidas
+
+
+def limpar_orfaos(lote=1000, carencia=None, dry_run=False):
+    """
+    Remove os PDFs de faturas/ sem Fatura correspondente. Cada lote de `lote`
+    arquivos custa uma consulta. Retorna (arquivos_verificados, orfaos, bytes).
+    """
+    carencia = settings.RECONCILIACAO_CARENCIA_SEGUNDOS if carencia is None else carencia
+    raiz = os.path.join(settings.MEDIA_ROOT, PASTA_FATURAS)
+    limite = time.time() - carencia
+    verificados = orfaos = liberados = 0
+
+    for entradas in _lotes(_percorrer(raiz), lote):
+        nomes = {_nome_relativo(entrada.path): entrada for entrada in entradas}
+        conhecidos = set(Fatura.objects.filter(arquivo__in=list(nomes)).values_list('arquivo', flat=True))
+        verificados += len(nomes)
+        for nome, entrada in nomes.items():
+            if nome in conhecidos:
+                continue
+            try:
+                estado = entrada.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            if estado.st_mtime > limite:
+                continue
+            orfaos += 1
+            liberados += estado.st_size
+            if dry_run:
+                logger.info(f"Arquivo órfão: {nome}")
+                continue
+            try:
+                os.remove(entrada.path)
+                logger.info(f"Arquivo órfão removido: {nome}")
+            except FileNotFoundError:
+                pass
+
+    if not dry_run and os.path.isdir(raiz):
+        _remover_pastas_vazias(raiz)
+    return verificados, orfaos, liberados
+
+
+def marcar_ausentes(lote=1000, dry_run=False):
+    """
+    Marca como 'ausente' as faturas cujo PDF não existe e volta para 'ok' as
+    que o recuperaram. Retorna (ausentes, recuperadas).
+    """
+    ausentes = recuperadas = 0
+    clientes = set()
+    ultimo = ''
+    consulta = Fatura.objects.order_by('pk').values_list('pk', 'customer_id', 'arquivo', 'estado_arquivo')
+    while True:
+        linhas = list(consulta.filter(pk__gt=ultimo)[:lote])
+        if not linhas:
+            break
+        ultimo = linhas[-1][0]
+
+        novas_ausentes, novas_recuperadas = [], []
+        for pk, customer_id, arquivo, estado in linhas:
+            existe = bool(arquivo) and os.path.isfile(os.path.join(settings.MEDIA_ROOT, arquivo))
+            if not existe and estado != 'ausente':
+                novas_ausentes.append(pk)
+                clientes.add(customer_id)
+                logger.warning(f"Fatura {pk}: PDF ausente ({arquivo or 'sem arquivo'})")
+            elif existe and estado == 'ausente':
+                novas_recuperadas.append(pk)
+                clientes.add(customer_id)
+
+        ausentes += len(novas_ausentes)
+        recuperadas += len(novas_recuperadas)
+        if dry_run:
+            continue
+        # Atualização em massa: não dispara os sinais de invalidação do cache
+        if novas_ausentes:
+            Fatura.objects.filter(pk__in=novas_ausentes).update(estado_arquivo='ausente')
+        if novas_recuperadas:
+            Fatura.objects.filter(pk__in=novas_recuperadas, estado_arquivo='ausente').update(estado_arquivo='ok')
+
+    if not dry_run:
+        for customer_id in clientes:
+            cache_api.invalidar(cache_api.FATURAS, customer_id)
+    return ausentes, recuperadas
+
+
+def _tamanho_e_modificacao(entrada):
+    """Bytes ocupados e modificação mais recente do arquivo ou da pasta (com o conteúdo)"""
+    estado = entrada.stat(follow_symlinks=False)
+    if not entrada.is_dir(follow_symlinks=False):
+        return estado.st_size, estado.st_mtime
+    tamanho, modificacao = 0, estado.st_mtime
+    for arquivo in _percorrer(entrada.path):
+        estado = arquivo.stat(follow_symlinks=False)
+        tamanho += estado.st_size
+        modificacao = max(modificacao, estado.st_mtime)
+    return tamanho, modificacao
+
+
+def _remover(entrada):
+    if entrada.is_dir(follow_symlinks=False):
+        shutil.rmtree(entrada.path, ignore_errors=True)
+    else:
+        os.remove(entrada.path)
+
+
+def limpar_temporarios(carencia=None, dry_run=False):
+    """
+    Remove de temp_faturas as pastas de download (uma por sessão do scraper)
+    e os arquivos soltos sem modificação há mais de `carencia` segundos.
+    Retorna (removidos, bytes).
+    """
+    carencia = settings.RECONCILIACAO_CARENCIA_SEGUNDOS if carencia is None else carencia
+    raiz = os.path.join(settings.MEDIA_ROOT, PASTA_TEMPORARIA)
+    if not os.path.isdir(raiz):
+        return 0, 0
+    limite = time.time() - carencia
+    removidos = liberados = 0
+    with os.scandir(raiz) as entradas:
+        for entrada in entradas:
+            try:
+                tamanho, modificacao = _tamanho_e_modificacao(entrada)
+                if modificacao > limite:
+                    continue
+                if not dry_run:
+                    _remover(entrada)
+            except FileNotFoundError:
+                continue
+            removidos += 1
+            liberados += tamanho
+            logger.info(f"Download abandonado {'encontrado' if dry_run else 'removido'}: {entrada.name}")
+    return removidos, liberados
+
+
+def limpar_relatorios(dry_run=False):
+    """Remove as pastas de relatórios de clientes que não existem mais. Retorna a quantidade removida."""
+    raiz = os.path.join(settings.MEDIA_ROOT, PASTA_RELATORIOS)
+    if not os.path.isdir(raiz):
+        return 0
+    with os.scandir(raiz) as entradas:
+        pastas = {int(e.name): e for e in entradas if e.is_dir(follow_symlinks=False) and e.name.isdigit()}
+    existentes = set(Customer.objects.filter(pk__in=list(pastas)).values_list('pk', flat=True))
+    removidas = 0
+    for customer_id, entrada in pastas.items():
+        if customer_id in existentes:
+            continue
+        removidas += 1
+        if not dry_run:
+            shutil.rmtree(entrada.path, ignore_errors=True)
+        logger.info(f"Relatórios do cliente {customer_id}, que não existe mais, {'encontrados' if dry_run else 'removidos'}")
+    return removidas
+
+
+def reconciliar(lote=None, carencia=None, dry_run=False):
+    """Executa todas as etapas, na ordem em que uma não atrapalha a outra, e devolve um resumo"""
+    lote = lote or settings.RECONCILIACAO_LOTE
+    # O legado é migrado primeiro: os arquivos movidos já contam como conhecidos na busca por órfãos
+    migradas = migrar_legado(lote, dry_run)
+    verificados, orfaos, bytes_orfaos = limpar_orfaos(lote, carencia, dry_run)
+    ausentes, recuperadas = marcar_ausentes(lote, dry_run)
+    temporarios, bytes_temporarios = limpar_temporarios(carencia, dry_run)
+    relatorios = limpar_relatorios(dry_run)
+    return {
+        'migradas': migradas,
+        'arquivos_verificados': verificados,
+        'orfaos': orfaos,
+        'bytes_orfaos': bytes_orfaos,
+        'ausentes': ausentes,
+        'recuperadas': recuperadas,
+        'temporarios': temporarios,
+        'bytes_temporarios': bytes_temporarios,
+        'relatorios': relatorios,
+    }
@@ -0,0 +1,195 @@
+# backend/api/services/artefatos.py
+"""
+Snapshots de falha do scraper: screenshot, DOM e logs do console do navegador,
+capturados somente quando uma etapa falha.
+
+Ficam em ARTEFATOS_DIR, fora de MEDIA_ROOT (nunca servidos pelo nginx), em
+<job>/<uc>/<etapa>-<data e hora>/, com DOM e console comprimidos (gzip). Os
+logs guardam apenas o id do snapshot. A limpeza remove os snapshots mais
+antigos que SNAPSHOTS_MAX_DIAS e, depois, os mais antigos até o total caber
+em SNAPSHOTS_MAX_BYTES.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Arquivos que podem existir em um snapshot
+ARQUIVOS = {
+    'screenshot.png': 'image/png',
+    'dom.html.gz': 'application/gzip',
+    'console.json.gz': 'application/gzip',
+}
+META = 'meta.json'
+# Intervalo mínimo (segundos) entre limpezas disparadas pelas próprias capturas
+INTERVALO_LIMPEZA = 600
+
+_ultima_limpeza = None
+_limpeza_lock = threading.Lock()
+
+
+def _seguro(texto):
+    """Trecho de caminho sem separadores nem caracteres especiais"""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(texto)).strip('._')[:60] or '_'
+
+
+def _raiz():
+    return os.path.join(settings.ARTEFATOS_DIR, 'snapshots')
+
+
+def _pasta(snapshot_id):
+    partes = snapshot_id.split('/')
+    # Sem ponto inicial: impede '..' e caminhos fora de ARTEFATOS_DIR
+    if len(partes) != 3 or not all(re.fullmatch(r'[A-Za-z0-9_-][A-Za-z0-9_.-]*', parte) for parte in partes):
+        raise ValueError(f"Id de snapshot inválido: {snapshot_id}")
+    return os.path.join(_raiz(), *partes)
+
+
+def capturar_snapshot(driver, job, uc, etapa, erro=None, task_ids=()):
+    """
+    Grava o estado atual do navegador e retorna o id do snapshot. Cada parte é
+    capturada de forma independente, pois o navegador pode estar meio quebrado.
+    """
+    snapshot_id = '/'.join([_seguro(job), _seguro(uc), f"{_seguro(etapa)}-{datetime.now():%Y%m%d%H%M%S%f}"])
+    pasta = _pasta(snapshot_id)
+    os.makedirs(pasta, exist_ok=True)
+
+    meta = {
+        'id': snapshot_id,
+        'job': job,
+        'uc': uc,
+        'etapa': etapa,
+        'erro': str(erro) if erro is not None else None,
+        'task_ids': list(task_ids),
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'url': None,
+        'arquivos': [],
+    }
+    try:
+        meta['url'] = driver.current_url
+    except Exception as e:
+        logger.debug(f"Snapshot {snapshot_id}: URL indisponível: {e}")
+    try:
+        with open(os.path.join(pasta, 'screenshot.png'), 'wb') as arquivo:
+            arquivo.write(driver.get_screenshot_as_png())
+        meta['arquivos'].append('screenshot.png')
+    except Exception as e:
+        logger.debug(f"Snapshot {snapshot_id}: screenshot indisponível: {e}")
+    try:
+        with gzip.open(os.path.join(pasta, 'dom.html.gz'), 'wt', encoding='utf-8') as arquivo:
+            arquivo.write(driver.page_source)
+        meta['arquivos'].append('dom.html.gz')
+    except Exception as e:
+        logger.debug(f"Snapshot {snapshot_id}: DOM indisponível: {e}")
+    try:
+        console = driver.get_log('browser')
+        with gzip.open(os.path.join(pasta, 'console.json.gz'), 'wt', encoding='utf-8') as arquivo:
+            json.dump(console, arquivo, ensure_ascii=False)
+        meta['arquivos'].append('console.json.gz')
+    except Exception as e:
+        logger.debug(f"Snapshot {snapshot_id}: console indisponível: {e}")
+
+    with open(os.path.join(pasta, META), 'w', encoding='utf-8') as arquivo:
+        json.dump(meta, arquivo, ensure_ascii=False)
+
+    _limpar_periodicamente()
+    return snapshot_id
+
+
+def _pastas_de_snapshot():
+    """Percorre <job>/<uc>/<snapshot>, retornando o caminho de cada snapshot"""
+    raiz = _raiz()
+    if not os.path.isdir(raiz):
+        return
+    for job in os.scandir(raiz):
+        if not job.is_dir():
+            continue
+        for uc in os.scandir(job.path):
+            if not uc.is_dir():
+                continue
+            for snapshot in os.scandir(uc.path):
+                if snapshot.is_dir():
+                    yield snapshot.path
+
+
+def listar_snapshots(task_id):
+    """Metadados dos snapshots associados a uma task, do mais recente ao mais antigo"""
+    snapshots = []
+    for pasta in _pastas_de_snapshot():
+        try:
+            with open(os.path.join(pasta, META), encoding='utf-8') as arquivo:
+                meta = json.load(arquivo)
+        except (OSError, ValueError):
+            continue
+        if task_id in meta.get('task_ids', []):
+            snapshots.append(meta)
+    return sorted(snapshots, key=lambda meta: meta['criado_em'], reverse=True)
+
+
+def caminho_arquivo(snapshot_id, nome):
+    """Caminho de um arquivo do snapshot; None se o id ou o nome forem inválidos ou não existirem"""
+    if nome not in ARQUIVOS:
+        return None
+    try:
+        caminho = os.path.join(_pasta(snapshot_id), nome)
+    except ValueError:
+        return None
+    return caminho if os.path.isfile(caminho) else None
+
+
+def limpar_snapshots(max_bytes=None, max_dias=None):
+    """Remove snapshots por idade e, em seguida, por tamanho total. Retorna quantos foram removidos."""
+    max_bytes = settings.SNAPSHOTS_MAX_BYTES if max_bytes is None else max_bytes
+    max_dias = settings.SNAPSHOTS_MAX_DIAS if max_dias is None else max_dias
+    limite_idade = time.time() - max_dias * 86400
+
+    snapshots = []
+    for pasta in _pastas_de_snapshot():
+        try:
+            arquivos = list(os.scandir(pasta))
+            tamanho = sum(arquivo.stat().st_size for arquivo in arquivos)
+            criado = max((arquivo.stat().st_mtime for arquivo in arquivos), default=0)
+        except OSError:
+            continue
+        snapshots.append((criado, tamanho, pasta))
+    snapshots.sort()
+
+    total = sum(tamanho for _, tamanho, _ in snapshots)
+    removidos = 0
+    for criado, tamanho, pasta in snapshots:
+        if criado >= limite_idade and total <= max_bytes:
+            break
+        shutil.rmtree(pasta, ignore_errors=True)
+        total -= tamanho
+        removidos += 1
+        # Remove as pastas de UC e de job que ficaram vazias
+        for pai in (os.path.dirname(pasta), os.path.dirname(os.path.dirname(pasta))):
+            try:
+                os.rmdir(pai)
+            except OSError:
+                break
+
+    if removidos:
+        logger.info(f"{removidos} snapshots de falha removidos pela política de retenção")
+    return removidos
+
+
+def _limpar_periodicamente():
+    global _ultima_limpeza
+    with _limpeza_lock:
+        if _ultima_limpeza is not None and time.monotonic() - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return
+        _ultima_limpeza = time.monotonic()
+    try:
+        limpar_snapshots()
+    except Exception as e:
+        logger.warning(f"Erro na limpeza dos snapshots de falha: {e}")
@@ -0,0 +1,166 @@
+# backend/api/services/busca.py
+"""
+Busca textual no conteúdo dos PDFs das faturas.
+
+O texto de cada PDF é extraído uma única vez (pypdf), em um pool de processos,
+e gravado em FaturaTexto. O índice fica no próprio banco: uma tabela FTS5 de
+conteúdo externo mantida por triggers no SQLite, ou um índice GIN sobre
+to_tsvector('portuguese', conteudo) no PostgreSQL (migração 0014).
+"""
+import html
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from api.models import Fatura, FaturaTexto
+
+logger = logging.getLogger(__name__)
+
+INICIO_DESTAQUE = '<mark>'
+FIM_DESTAQUE = '</mark>'
+# Marcadores pedidos ao banco no lugar das tags: o trecho é texto cru do PDF e só
+# recebe as tags depois de escapado (extrair_texto remove esses caracteres do texto)
+INICIO_SENTINELA = '\x02'
+FIM_SENTINELA = '\x03'
+# Palavras ao redor do trecho encontrado
+PALAVRAS_TRECHO = 16
+
+
+class BuscaIndisponivelError(Exception):
+    """O banco em uso não tem índice de busca textual"""
+
+
+def extrair_texto(caminho):
+    """
+    Texto de todas as páginas do PDF. Executado nos processos do pool: não
+    usa o Django. Retorna (texto, erro).
+    """
+    from pypdf import PdfReader
+
+    try:
+        leitor = PdfReader(caminho)
+        paginas = [pagina.extract_text() or '' for pagina in leitor.pages]
+    except Exception as e:
+        return '', f"{type(e).__name__}: {e}"
+    # Normaliza espaços: o extrator separa colunas com quebras e espaços repetidos
+    texto = ' '.join(' '.join(paginas).split())
+    return texto.replace(INICIO_SENTINELA, '').replace(FIM_SENTINELA, ''), None
+
+
+def _pendentes(reindexar=False):
+    faturas = Fatura.objects.exclude(arquivo='')
+    if not reindexar:
+        faturas = faturas.filter(texto__isnull=True)
+    return faturas.order_by('pk').values_list('pk', 'arquivo')
+
+
+def indexar(processos=None, lote=100, limite=None, reindexar=False):
+    """
+    Extrai e indexa o texto das faturas ainda sem FaturaTexto (todas, com
+    `reindexar`). Os PDFs são lidos em `processos` processos; o banco só é
+    acessado por este processo, em lotes de `lote` faturas.
+    Retorna (indexadas, erros).
+    """
+    indexadas = erros = 0
+    ultimo = None
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        while limite is None or indexadas + erros < limite:
+            tamanho = lote if limite is None else min(lote, limite - indexadas - erros)
+            # Paginação pela chave: memória constante e sem repetir faturas com erro
+            consulta = _pendentes(reindexar)
+            if ultimo is not None:
+                consulta = consulta.filter(pk__gt=ultimo)
+            faturas = list(consulta[:tamanho])
+            if not faturas:
+                break
+            ultimo = faturas[-1][0]
+
+            caminhos = [os.path.join(settings.MEDIA_ROOT, arquivo) for _, arquivo in faturas]
+            textos = []
+            for (fatura_id, _), (texto, erro) in zip(faturas, executor.map(extrair_texto, caminhos, chunksize=4)):
+                if erro:
+                    logger.warning(f"Fatura {fatura_id}: texto não extraído ({erro})")
+                    erros += 1
+                else:
+                    indexadas += 1
+                textos.append(FaturaTexto(fatura_id=fatura_id, conteudo=texto, erro=erro))
+
+            # Os triggers (SQLite) ou o índice GIN (PostgreSQL) acompanham as gravações
+            with transaction.atomic():
+                FaturaTexto.objects.filter(fatura_id__in=[fatura_id for fatura_id, _ in faturas]).delete()
+                FaturaTexto.objects.bulk_create(textos)
+            close_old_connections()
+    return indexadas, erros
+
+
+def _consulta_fts5(termo):
+    """Cada palavra vira uma frase entre aspas: o usuário não consegue injetar operadores do FTS5"""
+    return ' '.join('"' + palavra.replace('"', '""') + '"' for palavra in termo.split())
+
+
+SQL_SQLITE = f"""
+    SELECT t.fatura_id,
+           bm25(api_faturatexto_fts) AS relevancia,
+           snippet(api_faturatexto_fts, 0, %s, %s, '…', {PALAVRAS_TRECHO})
+    FROM api_faturatexto_fts
+    JOIN api_faturatexto t ON t.id = api_faturatexto_fts.rowid
+    WHERE api_faturatexto_fts MATCH %s
+    ORDER BY relevancia
+    LIMIT %s
+"""
+
+# O trecho (ts_headline, caro) só é calculado para as linhas já limitadas
+SQL_POSTGRES = """
+    SELECT r.fatura_id, r.relevancia,
+           ts_headline('portuguese', r.conteudo, r.consulta, %s)
+    FROM (
+        SELECT t.fatura_id, t.conteudo, q AS consulta,
+               ts_rank(to_tsvector('portuguese', t.conteudo), q) AS relevancia
+        FROM api_faturatexto t, websearch_to_tsquery('portuguese', %s) q
+        WHERE to_tsvector('portuguese', t.conteudo) @@ q
+        ORDER BY relevancia DESC
+        LIMIT %s
+    ) r
+    ORDER BY r.relevancia DESC
+"""
+
+
+def _destacar(trecho):
+    """Escapa o trecho para HTML e troca os marcadores do banco pelas tags de destaque"""
+    return html.escape(trecho).replace(INICIO_SENTINELA, INICIO_DESTAQUE).replace(FIM_SENTINELA, FIM_DESTAQUE)
+
+
+def buscar(termo, limite=20):
+    """
+    Faturas cujo PDF contém os termos, da mais relevante para a menos
+    relevante, com o trecho encontrado destacado. Retorna uma lista de
+    (fatura, relevancia, trecho); o trecho é HTML escapado, com os termos
+    entre INICIO_DESTAQUE e FIM_DESTAQUE.
+    """
+    termo = (termo or '').strip()
+    if not termo:
+        return []
+    if connection.vendor == 'sqlite':
+        sql, parametros = SQL_SQLITE, [INICIO_SENTINELA, FIM_SENTINELA, _consulta_fts5(termo), limite]
+    elif connection.vendor == 'postgresql':
+        opcoes = f"StartSel={INICIO_SENTINELA}, StopSel={FIM_SENTINELA}, MaxWords={PALAVRAS_TRECHO}, MinWords=5"
+        sql, parametros = SQL_POSTGRES, [opcoes, termo, limite]
+    else:
+        raise BuscaIndisponivelError(f"Busca textual não suportada no banco {connection.vendor}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        linhas = cursor.fetchall()
+
+    faturas = Fatura.objects.select_related('customer', 'unidade_consumidora').in_bulk(
+        [fatura_id for fatura_id, _, _ in linhas]
+    )
+    return [
+        # bm25 é negativo (menor é melhor); a relevância exposta cresce com a aderência
+        (faturas[fatura_id], abs(relevancia), _destacar(trecho))
+        for fatura_id, relevancia, trecho in linhas
+        if fatura_id in faturas
+    ]
@@ -0,0 +1,123 @@
+# backend/api/services/cancelamento.py
+"""
+Cancelamento cooperativo e prazos dos jobs de importação de faturas.
+
+Cada job em execução no task_processor tem um TokenCancelamento. O serviço da
+Equatorial consulta o token entre as etapas (UC, fatura, esperas) e, quando o
+job é cancelado ou estoura o prazo, os navegadores registrados no token são
+fechados na hora para liberar a vaga de sessão.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ImportacaoCancelada(BaseException):
+    """
+    O job foi cancelado pelo usuário ou excedeu o tempo limite.
+
+    Herda de BaseException (como asyncio.CancelledError) para atravessar os
+    vários `except Exception` do scraper sem ser tratada como erro comum.
+    """
+
+    def __init__(self, motivo, status='cancelled'):
+        super().__init__(motivo)
+        # Status final das tasks que ainda não terminaram ('cancelled' ou 'failed')
+        self.status = status
+
+
+class TokenCancelamento:
+    def __init__(self, customer_id=None, prazo=None):
+        self.customer_id = customer_id
+        self._evento = threading.Event()
+        self._lock = threading.Lock()
+        self._drivers = set()
+        self.motivo = None
+        self.status = 'cancelled'
+        self._timer = None
+        if prazo:
+            # Prazo rígido do job: ao expirar, o job é interrompido como falha
+            self._timer = threading.Timer(
+                prazo, self.cancelar,
+                kwargs={'motivo': f"Tempo limite do job esgotado ({prazo:.0f}s)", 'status': 'failed'}
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelado(self):
+        return self._evento.is_set()
+
+    def cancelar(self, motivo="Cancelada pelo usuário", status='cancelled'):
+        with self._lock:
+            if self._evento.is_set():
+                return
+            self.motivo = motivo
+            self.status = status
+            self._evento.set()
+            drivers = list(self._drivers)
+        logger.warning(f"Job do cliente {self.customer_id} interrompido: {motivo}")
+        # Fecha os navegadores imediatamente; as chamadas bloqueadas do Selenium falham em seguida
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.debug(f"Erro ao fechar navegador cancelado: {e}")
+
+    def verificar(self):
+        """Ponto de verificação entre etapas: levanta ImportacaoCancelada se necessário"""
+        if self._evento.is_set():
+            raise ImportacaoCancelada(self.motivo, self.status)
+
+    def aguardar(self, segundos):
+        """time.sleep interrompível pelo cancelamento"""
+        if self._evento.wait(segundos):
+            raise ImportacaoCancelada(self.motivo, self.status)
+
+    def registrar_driver(self, driver):
+        with self._lock:
+            self._drivers.add(driver)
+            cancelado = self._evento.is_set()
+        if cancelado:
+            driver.quit()
+            self.verificar()
+
+    def remover_driver(self, driver):
+        with self._lock:
+            self._drivers.discard(driver)
+
+    def encerrar(self):
+        """Libera o timer do prazo quando o job termina"""
+        if self._timer:
+            self._timer.cancel()
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def registrar_job(customer_id, prazo=None):
+    token = TokenCancelamento(customer_id=customer_id, prazo=prazo)
+    with _jobs_lock:
+        _jobs.setdefault(customer_id, set()).add(token)
+    return token
+
+
+def encerrar_job(customer_id, token):
+    token.encerrar()
+    with _jobs_lock:
+        tokens = _jobs.get(customer_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del _jobs[customer_id]
+
+
+def cancelar_jobs(customer_id, motivo="Cancelada pelo usuário"):
+    """Cancela todos os jobs em execução do cliente neste processo. Retorna quantos foram cancelados."""
+    with _jobs_lock:
+        tokens = list(_jobs.get(customer_id, ()))
+    for token in tokens:
+        token.cancelar(motivo=motivo)
+    return len(tokens)
@@ -0,0 +1,419 @@
+# backend/api/services/controle_portal.py
+"""
+Controle de tráfego para o portal da Equatorial (goias.equatorialenergia.com.br).
+
+O portal fica atrás do Incapsula e passa a bloquear quando recebe muitas
+requisições. Este módulo mantém, para todo o processo, um limitador de taxa
+(token bucket) para navegações e downloads, um limite adaptativo (AIMD) de
+sessões simultâneas do navegador e um circuit breaker que pausa a fila de
+jobs enquanto o portal estiver recusando acessos.
+
+As vagas de sessão são disputadas por duas faixas: a interativa (disparos do
+usuário) fica com a próxima vaga livre e tem vagas reservadas; a de lote
+(varreduras do agendador) só ocupa as demais e nunca passa à frente de uma
+sessão interativa que esteja esperando.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from selenium.common.exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)
+
+FAIXA_INTERATIVA = 'interativa'
+FAIXA_LOTE = 'lote'
+FAIXAS = (FAIXA_INTERATIVA, FAIXA_LOTE)
+
+
+class PortalIndisponivelError(Exception):
+    """O circuito está aberto: o portal está bloqueando ou fora do ar"""
+
+
+class PortalBloqueadoError(PortalIndisponivelError):
+    """A página retornada é um bloqueio do Incapsula em vez do conteúdo esperado"""
+
+
+# Erros que indicam o portal lento ou recusando acessos
+FALHAS_DO_PORTAL = (TimeoutException, PortalBloqueadoError)
+
+
+class TokenBucket:
+    """Limitador de taxa: `taxa` tokens por segundo com rajada de até `capacidade`"""
+
+    def __init__(self, taxa, capacidade):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reabastecer(self):
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def consumir(self, tokens=1, timeout=None):
+        """Bloqueia até haver tokens disponíveis. Retorna False se o timeout expirar."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._reabastecer()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                espera = (tokens - self._tokens) / self.taxa
+            if limite is not None:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return False
+                espera = min(espera, restante)
+            time.sleep(espera)
+
+
+class ConcorrenciaAdaptativa:
+    """
+    Limite de sessões simultâneas ajustado por AIMD: cresce de 1 em 1 após uma
+    sequência de requisições rápidas e bem-sucedidas e cai pela metade quando
+    há erro ou latência acima do alvo.
+    """
+
+    def __init__(self, inicial, minimo, maximo, latencia_alvo, sucessos_para_aumentar=20, intervalo_reducao=30,
+                 reservadas_interativas=1):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.latencia_alvo = latencia_alvo
+        self.sucessos_para_aumentar = sucessos_para_aumentar
+        self.intervalo_reducao = intervalo_reducao
+        self.reservadas_interativas = reservadas_interativas
+        self._limite = max(minimo, min(inicial, maximo))
+        self._em_uso = 0
+        self._em_uso_faixa = Counter()
+        self._esperando_faixa = Counter()
+        self._sucessos = 0
+        self._ultima_reducao = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limite(self):
+        return self._limite
+
+    @property
+    def em_uso(self):
+        return self._em_uso
+
+    def em_uso_por_faixa(self):
+        with self._cond:
+            return {faixa: self._em_uso_faixa[faixa] for faixa in FAIXAS}
+
+    def esperando_por_faixa(self):
+        with self._cond:
+            return {faixa: self._esperando_faixa[faixa] for faixa in FAIXAS}
+
+    def _vaga_livre(self, faixa):
+        if self._em_uso >= self._limite:
+            return False
+        if faixa == FAIXA_INTERATIVA:
+            return True
+        # Lote não passa à frente de uma sessão interativa que esteja esperando
+        if self._esperando_faixa[FAIXA_INTERATIVA]:
+            return False
+        # e deixa as vagas reservadas livres, mas mantém ao menos uma para não parar de vez
+        return self._em_uso_faixa[FAIXA_LOTE] < max(1, self._limite - self.reservadas_interativas)
+
+    def adquirir(self, timeout=None, faixa=FAIXA_INTERATIVA):
+        with self._cond:
+            self._esperando_faixa[faixa] += 1
+            try:
+                if not self._cond.wait_for(lambda: self._vaga_livre(faixa), timeout=timeout):
+                    return False
+            finally:
+                self._esperando_faixa[faixa] -= 1
+                if faixa == FAIXA_INTERATIVA:
+                    # Sessões em lote bloqueadas por esta espera reavaliam a vaga
+                    self._cond.notify_all()
+            self._em_uso += 1
+            self._em_uso_faixa[faixa] += 1
+            return True
+
+    def liberar(self, faixa=FAIXA_INTERATIVA):
+        with self._cond:
+            self._em_uso = max(0, self._em_uso - 1)
+            self._em_uso_faixa[faixa] = max(0, self._em_uso_faixa[faixa] - 1)
+            self._cond.notify_all()
+
+    def registrar_sucesso(self, latencia=None):
+        if latencia is not None and latencia > self.latencia_alvo:
+            self.registrar_erro(motivo=f"latência de {latencia:.1f}s")
+            return
+        with self._cond:
+            self._sucessos += 1
+            if self._sucessos >= self.sucessos_para_aumentar and self._limite < self.maximo:
+                self._limite += 1
+                self._sucessos = 0
+                logger.info(f"Limite de sessões no portal aumentado para {self._limite}")
+                self._cond.notify_all()
+
+    def registrar_erro(self, motivo='erro'):
+        with self._cond:
+            self._sucessos = 0
+            agora = time.monotonic()
+            # Evita reduzir várias vezes pela mesma onda de erros
+            if agora - self._ultima_reducao < self.intervalo_reducao:
+                return
+            novo_limite = max(self.minimo, self._limite // 2)
+            if novo_limite < self._limite:
+                logger.warning(f"Limite de sessões no portal reduzido de {self._limite} para {novo_limite} ({motivo})")
+                self._limite = novo_limite
+            self._ultima_reducao = agora
+
+
+class EsperaPorFaixa:
+    """Tempo de espera por uma vaga de sessão, acumulado por faixa"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contagem = Counter()
+        self._total = Counter()
+        self._maxima = Counter()
+        self._ultima = {}
+
+    def registrar(self, faixa, segundos):
+        with self._lock:
+            self._contagem[faixa] += 1
+            self._total[faixa] += segundos
+            self._maxima[faixa] = max(self._maxima[faixa], segundos)
+            self._ultima[faixa] = segundos
+
+    def status(self):
+        with self._lock:
+            return {
+                faixa: {
+                    'sessoes': self._contagem[faixa],
+                    'espera_media_s': round(self._total[faixa] / self._contagem[faixa], 1) if self._contagem[faixa] else None,
+                    'espera_maxima_s': round(self._maxima[faixa], 1) if self._contagem[faixa] else None,
+                    'ultima_espera_s': round(self._ultima[faixa], 1) if faixa in self._ultima else None,
+                }
+                for faixa in FAIXAS
+            }
+
+
+class CircuitBreaker:
+    """
+    Abre após `limiar_falhas` falhas consecutivas e permanece aberto por
+    `pausa` segundos. Depois disso deixa passar uma requisição de teste
+    (meio-aberto): se ela falhar, reabre com o dobro da pausa.
+    """
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+
+    def __init__(self, limiar_falhas, pausa, pausa_maxima):
+        self.limiar_falhas = limiar_falhas
+        self.pausa_inicial = pausa
+        self.pausa_maxima = pausa_maxima
+        self._pausa = pausa
+        self._estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_ate = 0.0
+        self._teste_em_andamento = False
+        self._cond = threading.Condition()
+
+    @property
+    def estado(self):
+        with self._cond:
+            self._atualizar_estado()
+            return self._estado
+
+    def _atualizar_estado(self):
+        if self._estado == self.ABERTO and time.monotonic() >= self._aberto_ate:
+            self._estado = self.MEIO_ABERTO
+            self._teste_em_andamento = False
+
+    def permite(self):
+        """Indica se uma requisição pode seguir agora"""
+        with self._cond:
+            self._atualizar_estado()
+            if self._estado == self.FECHADO:
+                return True
+            if self._estado == self.MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def aguardar_fechamento(self, timeout=None):
+        """Bloqueia enquanto o circuito estiver aberto. Retorna False se o timeout expirar."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._atualizar_estado()
+                if self._estado == self.FECHADO:
+                    return True
+                if self._estado == self.MEIO_ABERTO:
+                    if not self._teste_em_andamento:
+                        return True
+                    # Aguarda o resultado da requisição de teste
+                    espera = 1.0
+                else:
+                    espera = self._aberto_ate - time.monotonic()
+                if limite is not None:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        return False
+                    espera = min(espera, restante)
+                self._cond.wait(max(espera, 0.1))
+
+    def registrar_sucesso(self):
+        with self._cond:
+            if self._estado != self.FECHADO:
+                logger.info("Circuito do portal fechado: acessos normalizados")
+            self._estado = self.FECHADO
+            self._falhas = 0
+            self._pausa = self.pausa_inicial
+            self._teste_em_andamento = False
+            self._cond.notify_all()
+
+    def registrar_falha(self):
+        with self._cond:
+            self._atualizar_estado()
+            self._falhas += 1
+            if self._estado == self.MEIO_ABERTO:
+                self._pausa = min(self._pausa * 2, self.pausa_maxima)
+                self._abrir()
+            elif self._estado == self.FECHADO and self._falhas >= self.limiar_falhas:
+                self._abrir()
+
+    def liberar_teste(self):
+        """
+        Devolve a vaga da requisição de teste que terminou sem resultado (erro
+        nosso, navegador fechado de propósito ou job cancelado): a próxima
+        requisição vira o novo teste.
+        """
+        with self._cond:
+            if self._estado == self.MEIO_ABERTO and self._teste_em_andamento:
+                self._teste_em_andamento = False
+                self._cond.notify_all()
+
+    def _abrir(self):
+        self._estado = self.ABERTO
+        self._aberto_ate = time.monotonic() + self._pausa
+        self._teste_em_andamento = False
+        logger.error(f"Circuito do portal aberto após {self._falhas} falhas; fila pausada por {self._pausa:.0f}s")
+
+
+class ControlePortal:
+    """Combina limitador de taxa, concorrência adaptativa e circuit breaker"""
+
+    def __init__(self, taxa, rajada, sessoes_inicial, sessoes_min, sessoes_max,
+                 latencia_alvo, limiar_falhas, pausa, pausa_maxima, reservadas_interativas=1):
+        self.bucket = TokenBucket(taxa, rajada)
+        self.concorrencia = ConcorrenciaAdaptativa(
+            sessoes_inicial, sessoes_min, sessoes_max, latencia_alvo,
+            reservadas_interativas=reservadas_interativas
+        )
+        self.circuito = CircuitBreaker(limiar_falhas, pausa, pausa_maxima)
+        self.espera = EsperaPorFaixa()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            taxa=settings.EQUATORIAL_REQUISICOES_POR_SEGUNDO,
+            rajada=settings.EQUATORIAL_RAJADA_REQUISICOES,
+            sessoes_inicial=settings.EQUATORIAL_SESSOES_INICIAL,
+            sessoes_min=settings.EQUATORIAL_SESSOES_MIN,
+            sessoes_max=settings.EQUATORIAL_SESSOES_MAX,
+            latencia_alvo=settings.EQUATORIAL_LATENCIA_ALVO,
+            limiar_falhas=settings.EQUATORIAL_CIRCUITO_LIMIAR_FALHAS,
+            pausa=settings.EQUATORIAL_CIRCUITO_PAUSA,
+            pausa_maxima=settings.EQUATORIAL_CIRCUITO_PAUSA_MAXIMA,
+            reservadas_interativas=settings.EQUATORIAL_SESSOES_RESERVADAS_INTERATIVAS,
+        )
+
+    def aguardar_portal(self, timeout=None):
+        """Pausa o chamador enquanto o circuito estiver aberto"""
+        return self.circuito.aguardar_fechamento(timeout=timeout)
+
+    @contextmanager
+    def sessao(self, faixa=FAIXA_INTERATIVA):
+        """
+        Reserva uma vaga de sessão do navegador, aguardando o circuito fechar.
+        `faixa` pode ser uma função: ela é reavaliada a cada volta da espera, de
+        modo que um job promovido para a faixa interativa passe à frente.
+        """
+        obter_faixa = faixa if callable(faixa) else (lambda: faixa)
+        inicio = time.monotonic()
+        while True:
+            self.aguardar_portal()
+            faixa_atual = obter_faixa()
+            if self.concorrencia.adquirir(timeout=5, faixa=faixa_atual):
+                break
+        espera = time.monotonic() - inicio
+        self.espera.registrar(faixa_atual, espera)
+        logger.info(f"Vaga de sessão obtida na faixa {faixa_atual} após {espera:.1f}s de espera")
+        try:
+            yield
+        finally:
+            self.concorrencia.liberar(faixa_atual)
+
+    @contextmanager
+    def requisicao(self, tipo='navegacao', medir_latencia=True, interrompida=None):
+        """
+        Envolve uma navegação ou download: aplica a taxa e registra o resultado.
+        Só timeouts e bloqueios contam como falha do portal; outros erros são
+        nossos e não mexem no circuito nem no limite de sessões. `interrompida`
+        é uma função que diz se o navegador foi fechado de propósito
+        (cancelamento ou prazo da UC): nesse caso o erro não é contabilizado.
+        """
+        if not self.circuito.permite():
+            raise PortalIndisponivelError(f"Portal indisponível; {tipo} cancelada com o circuito aberto")
+        self.bucket.consumir()
+        inicio = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            if isinstance(e, FALHAS_DO_PORTAL) and not (interrompida and interrompida()):
+                self.concorrencia.registrar_erro(motivo=f"falha em {tipo}")
+                self.circuito.registrar_falha()
+            else:
+                # Inclui ImportacaoCancelada e JobAssumidoError (BaseException): sem isso, uma
+                # requisição de teste interrompida deixaria o circuito meio-aberto para sempre
+                self.circuito.liberar_teste()
+            raise
+        latencia = time.monotonic() - inicio
+        self.concorrencia.registrar_sucesso(latencia if medir_latencia else None)
+        self.circuito.registrar_sucesso()
+
+    def status(self):
+        em_uso = self.concorrencia.em_uso_por_faixa()
+        esperando = self.concorrencia.esperando_por_faixa()
+        return {
+            'circuito': self.circuito.estado,
+            'limite_sessoes': self.concorrencia.limite,
+            'sessoes_em_uso': self.concorrencia.em_uso,
+            'sessoes_reservadas_interativas': self.concorrencia.reservadas_interativas,
+            'faixas': {
+                faixa: {
+                    'em_uso': em_uso[faixa],
+                    'esperando': esperando[faixa],
+                    **espera,
+                }
+                for faixa, espera in self.espera.status().items()
+            },
+        }
+
+
+_controle = None
+_controle_lock = threading.Lock()
+
+
+def get_controle_portal():
+    """Instância única por processo, compartilhada entre todas as threads de scraping"""
+    global _controle
+    if _controle is None:
+        with _controle_lock:
+            if _controle is None:
+                _controle = ControlePortal.from_settings()
+    return _controle
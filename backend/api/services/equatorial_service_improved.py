@@ -2,7 +2,13 @@
 import os
 import json
 import logging
+import math
+import random
+import shutil
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.common.by import By
@@ -13,21 +19,149 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
-from api.models import Customer, UnidadeConsumidora, Fatura, FaturaTask, FaturaLog
+from django.db import connection
+from django.utils import timezone
+from api.models import Customer, UnidadeConsumidora, Fatura, FaturaTask, FaturaLog, FaturaResultado, FaturaTexto
 from . import setup_chromedriver
+from .controle_portal import get_controle_portal, PortalIndisponivelError, PortalBloqueadoError
+from .cancelamento import TokenCancelamento, ImportacaoCancelada
+from .seletores import get_registro_seletores
+from . import artefatos, importacao, integridade, processadores
+from api.logs import contexto_atual, contexto_log, copiar_contexto
 
 logger = logging.getLogger(__name__)
 
 
+class PrazoUcEsgotado(Exception):
+    """O prazo da UC estourou e o navegador da sessão foi fechado"""
+
+
 class EquatorialService:
-    def __init__(self, customer_id):
+    def __init__(self, customer_id, uc_codes=None, fatura_log=None, cancelamento=None, descobrir_ucs=None):
         self.customer = Customer.objects.get(id=customer_id)
         self.driver = None
         self.wait = None
         self.base_url = "https://goias.equatorialenergia.com.br"
         self.login_url = f"{self.base_url}/LoginGO.aspx"
         self.target_ucs = []  # Lista de UCs que devem ser baixadas
+        # Quando informado, restringe a sessão a este subconjunto de UCs (sessões paralelas)
+        self.uc_codes = list(uc_codes) if uc_codes is not None else None
+        # Log compartilhado entre sessões paralelas; se None, a sessão cria o seu próprio
+        self.fatura_log = fatura_log
+        # Log em uso na execução (o compartilhado ou o criado pela própria sessão)
+        self._log_ativo = fatura_log
+        self.ucs_encontradas = []
+        # Cada sessão baixa em um diretório próprio para não disputar o PDF mais recente
+        self.download_dir = os.path.join(settings.MEDIA_ROOT, 'temp_faturas', uuid.uuid4().hex)
+        # Limitador de taxa e circuit breaker compartilhados por todas as sessões do processo
+        self.controle = get_controle_portal()
+        # Seletores dos elementos do portal, com o último vencedor de cada um tentado primeiro
+        self.seletores = get_registro_seletores()
+        # Cancelamento cooperativo e prazo do job (compartilhado entre as sessões do mesmo job)
+        self.cancelamento = cancelamento or TokenCancelamento(customer_id=customer_id)
+        self._inicio = datetime.now()
+        self._prazo_uc_esgotado = False
+        # Cadastra as UCs novas do dropdown; por padrão segue a opção do cliente.
+        # Em execuções paralelas só uma sessão faz a descoberta.
+        self.descobrir_ucs = self.customer.descobrir_ucs if descobrir_ucs is None else descobrir_ucs
+
+    def _ucs_ativas(self):
+        """UCs ativas do cliente, restritas ao subconjunto da sessão quando houver"""
+        ucs = self.customer.unidades_consumidoras.filter(data_vigencia_fim__isnull=True)
+        if self.uc_codes is not None:
+            ucs = ucs.filter(codigo__in=self.uc_codes)
+        return ucs
+
+    def _tasks_da_sessao(self, status):
+        """Tasks do cliente no status informado, restritas às UCs da sessão quando houver"""
+        tasks = FaturaTask.objects.filter(customer=self.customer, status=status)
+        if self.uc_codes is not None:
+            # Não interfere nas tasks das outras sessões paralelas do mesmo cliente
+            tasks = tasks.filter(unidade_consumidora__codigo__in=self.uc_codes)
+        return tasks
+
+    def _verificar_cancelamento(self):
+        """
+        Ponto de cancelamento que também consulta o banco: a view marca as tasks
+        como canceladas antes de avisar o task_processor, e o aviso pode não chegar.
+        """
+        if self._tasks_da_sessao('cancelled').filter(completed_at__gte=self._inicio).exists():
+            self.cancelamento.cancelar()
+        self.cancelamento.verificar()
+
+    def _verificar_posse(self):
+        """Para a sessão se outra instância do task_processor assumiu as tasks dela"""
+        tasks = FaturaTask.objects.filter(customer=self.customer)
+        if self.uc_codes is not None:
+            tasks = tasks.filter(unidade_consumidora__codigo__in=self.uc_codes)
+        processadores.verificar_posse(tasks, settings.PROCESSADOR_NOME)
+
+    def _faixa(self):
+        """Faixa da sessão no controle do portal: interativa se alguma task pendente dela for interativa"""
+        interativa = self._tasks_da_sessao('pending').filter(prioridade='interativa').exists()
+        return 'interativa' if interativa else 'lote'
+
+    def _aguardar(self, segundos):
+        """Pausa interrompível: levanta ImportacaoCancelada se o job for cancelado"""
+        self.cancelamento.aguardar(segundos)
+
+    def _iniciar_prazo_uc(self, uc_code):
+        """Inicia o prazo rígido da UC: se estourar, o navegador da sessão é fechado"""
+        self._prazo_uc_esgotado = False
+        timer = threading.Timer(settings.FATURA_UC_TIMEOUT_SEGUNDOS, self._esgotar_prazo_uc, args=(uc_code,))
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def _verificar_prazo_uc(self):
+        """Levanta PrazoUcEsgotado se o prazo da UC estourou: os meses restantes não foram baixados"""
+        if self._prazo_uc_esgotado:
+            raise PrazoUcEsgotado(f"Tempo limite da UC esgotado ({settings.FATURA_UC_TIMEOUT_SEGUNDOS}s)")
+
+    def _esgotar_prazo_uc(self, uc_code):
+        logger.error(f"Tempo limite da UC {uc_code} esgotado; encerrando o navegador da sessão")
+        self._prazo_uc_esgotado = True
+        self._encerrar_driver()
+
+    def _encerrar_driver(self):
+        driver, self.driver = self.driver, None
+        if driver:
+            self.cancelamento.remover_driver(driver)
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.debug(f"Erro ao fechar o navegador: {e}")
+
+    def _navegador_interrompido(self):
+        """O navegador foi fechado de propósito (cancelamento ou prazo da UC)"""
+        return self.cancelamento.cancelado or self._prazo_uc_esgotado
+
+    def _capturar_falha(self, etapa, erro, uc_codigo='sessao', task_ids=()):
+        """Guarda screenshot, DOM e console da falha no repositório de snapshots e registra só o id no log"""
+        # Navegador fechado de propósito (cancelamento ou prazo): não há o que capturar
+        if self.driver is None or self._navegador_interrompido():
+            return
+        try:
+            snapshot_id = artefatos.capturar_snapshot(
+                self.driver,
+                job=contexto_atual().get('job', 'avulso'),
+                uc=uc_codigo,
+                etapa=etapa,
+                erro=erro,
+                task_ids=task_ids
+            )
+            logger.info(f"Snapshot da falha em '{etapa}' salvo: {snapshot_id}")
+        except Exception as e:
+            logger.warning(f"Não foi possível salvar o snapshot da falha em '{etapa}': {e}")
+
+    def _navegar(self, url):
+        """Navega respeitando o limitador de taxa e o circuit breaker do portal"""
+        with self.controle.requisicao('navegacao', interrompida=self._navegador_interrompido):
+            self.driver.get(url)
+            if 'Incapsula incident' in self.driver.page_source:
+                raise PortalBloqueadoError(f"Acesso bloqueado pelo Incapsula ao abrir {url}")
         
     def setup_driver(self):
         """Configura o driver do Chrome para rodar no servidor"""
@@ -57,9 +191,11 @@ class EquatorialService:
             chrome_options.add_argument("--ignore-ssl-errors")
             chrome_options.add_argument("--disable-popup-blocking")
             chrome_options.add_argument("--start-maximized")
+            # Logs do console do navegador, anexados aos snapshots de falha
+            chrome_options.set_capability('goog:loggingPrefs', {'browser': 'ALL'})
             
             # Configuração de download
-            download_dir = os.path.join(settings.MEDIA_ROOT, 'temp_faturas')
+            download_dir = self.download_dir
             os.makedirs(download_dir, exist_ok=True)
             
             prefs = {
@@ -85,6 +221,8 @@ class EquatorialService:
             # Inicializar o driver
             logger.info("Inicializando o driver do Chrome...")
             self.driver = webdriver.Chrome(options=chrome_options)
+            # Permite que um cancelamento feche este navegador imediatamente
+            self.cancelamento.registrar_driver(self.driver)
               # Injetar script para enganar detecção de automação - versão mais simples
             logger.info("Aplicando scripts para evasão de detecção...")
             
@@ -149,7 +287,7 @@ class EquatorialService:
             for attempt in range(max_retries):
                 logger.info(f"Tentativa {attempt+1} de acessar página de login")
                 
-                self.driver.get(self.login_url)
+                self._navegar(self.login_url)
                 logger.info(f"Acessando página de login: {self.login_url}")
                 logger.info(f"URL atual: {self.driver.current_url}")
                 logger.info(f"Título da página: {self.driver.title}")
@@ -157,21 +295,10 @@ class EquatorialService:
                 # Adiciona cookies para evitar detecção
                 self.driver.add_cookie({"name": "incap_ses_", "value": "accept"})
                 
-                # Captura screenshot para debug
-                try:
-                    screenshot_path = os.path.join(settings.MEDIA_ROOT, f'debug_login_{attempt}.png')
-                    self.driver.save_screenshot(screenshot_path)
-                    logger.info(f"Screenshot salvo em: {screenshot_path}")
-                except Exception as e:
-                    logger.warning(f"Erro ao salvar screenshot: {e}")
-                
-                # Log HTML para debug
-                logger.info(f"HTML da página (primeiros 2000 caracteres): {self.driver.page_source[:2000]}")
-                
                 # Tenta encontrar algum elemento na página para verificar se carregou
                 try:
                     self.wait.until(EC.presence_of_element_located((By.TAG_NAME, "body")))
-                    time.sleep(5)  # Aguarda mais tempo para carregamento completo
+                    self._aguardar(5)  # Aguarda mais tempo para carregamento completo
                     
                     # Verifica redirecionamentos contínuos
                     if self.driver.current_url != self.login_url:
@@ -179,90 +306,44 @@ class EquatorialService:
                     
                     # Tenta encontrar campos de login
                     try:
-                        uc_field = self.driver.find_element(By.CSS_SELECTOR, "input[name*='UC' i], input[id*='UC' i], input[placeholder*='Unidade' i]")
+                        self.seletores.localizar(self.driver, 'login.uc')
                         logger.info("Campo UC encontrado com sucesso!")
                         break  # Sucesso, sai do loop
                     except Exception as e:
                         logger.warning(f"Não encontrou campo UC: {e}")
                         if attempt == max_retries - 1:  # Última tentativa
-                            logger.error("HTML da página de login:")
-                            logger.error(self.driver.page_source[:5000])
                             raise Exception("Falha ao encontrar campo UC após múltiplas tentativas")
-                        time.sleep(5)  # Aguarda antes da próxima tentativa
+                        self._aguardar(5)  # Aguarda antes da próxima tentativa
                         
                 except Exception as e:
                     logger.warning(f"Erro ao aguardar carregamento da página: {e}")
                     if attempt == max_retries - 1:  # Última tentativa
                         raise
-                    time.sleep(5)  # Aguarda antes da próxima tentativa
+                    self._aguardar(5)  # Aguarda antes da próxima tentativa
             
             # Preenche UC e CPF
             cpf_titular = self.customer.cpf_titular or self.customer.cpf
             logger.info(f"CPF titular a ser usado: {cpf_titular}")
             
-            # Busca primeira UC ativa do cliente
-            uc_ativa = self.customer.unidades_consumidoras.filter(
-                data_vigencia_fim__isnull=True
-            ).first()
+            # Busca primeira UC ativa do cliente (da própria sessão, se particionada)
+            uc_ativa = self._ucs_ativas().first()
             
             if not uc_ativa:
                 raise Exception("Cliente não possui UC ativa")
             
             logger.info(f"UC ativa encontrada: {uc_ativa.codigo}")
             
-            # Preenche campos com retry
+            # Preenche campos; o registro tenta primeiro o seletor que funcionou da última vez
             try:
-                # Tenta diferentes seletores para o campo UC
-                selectors = [
-                    "input[name*='UC' i]",
-                    "input[id*='UC' i]",
-                    "input[placeholder*='Unidade' i]",
-                    "input[class*='UC' i]"
-                ]
-                
-                uc_field = None
-                for selector in selectors:
-                    try:
-                        uc_field = self.driver.find_element(By.CSS_SELECTOR, selector)
-                        logger.info(f"Campo UC encontrado com seletor: {selector}")
-                        break
-                    except:
-                        continue
-                
-                if uc_field:
-                    uc_field.clear()
-                    uc_field.send_keys(uc_ativa.codigo)
-                    logger.info(f"UC preenchida: {uc_ativa.codigo}")
-                else:
-                    logger.error("Campo UC não encontrado após tentar múltiplos seletores")
-                    logger.info(f"HTML da página: {self.driver.page_source[:5000]}")
-                    raise Exception("Campo UC não encontrado")
-                
-                # Tenta diferentes seletores para o campo CPF
-                selectors = [
-                    "input[name*='CPF' i]",
-                    "input[id*='CPF' i]",
-                    "input[placeholder*='CPF' i]",
-                    "input[class*='CPF' i]"
-                ]
-                
-                cpf_field = None
-                for selector in selectors:
-                    try:
-                        cpf_field = self.driver.find_element(By.CSS_SELECTOR, selector)
-                        logger.info(f"Campo CPF encontrado com seletor: {selector}")
-                        break
-                    except:
-                        continue
+                uc_field = self.seletores.localizar(self.driver, 'login.uc')
+                uc_field.clear()
+                uc_field.send_keys(uc_ativa.codigo)
+                logger.info(f"UC preenchida: {uc_ativa.codigo}")
                 
-                if cpf_field:
-                    cpf_field.clear()
-                    cpf_field.send_keys(cpf_titular)
-                    logger.info(f"CPF preenchido: {cpf_titular}")
-                else:
-                    logger.error("Campo CPF não encontrado após tentar múltiplos seletores")
-                    logger.info(f"HTML da página: {self.driver.page_source[:5000]}")
-                    raise Exception("Campo CPF não encontrado")
+                cpf_field = self.seletores.localizar(self.driver, 'login.cpf')
+                cpf_field.clear()
+                cpf_field.send_keys(cpf_titular)
+                logger.info(f"CPF preenchido: {cpf_titular}")
                 
             except Exception as e:
                 logger.error(f"Erro ao preencher campos: {e}")
@@ -270,39 +351,17 @@ class EquatorialService:
             
             # Clica em entrar
             try:
-                # Tenta diferentes seletores para o botão Entrar
-                selectors = [
-                    "button.button",
-                    "button[type='submit']",
-                    "input[type='submit']",
-                    "button:contains('Entrar')",
-                    "button",
-                    "input[value*='Entrar' i]"
-                ]
-                
-                submit_button = None
-                for selector in selectors:
-                    try:
-                        submit_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                        logger.info(f"Botão Entrar encontrado com seletor: {selector}")
-                        break
-                    except:
-                        continue
-                
-                if submit_button:
-                    submit_button.click()
-                    logger.info("Botão Entrar clicado")
-                else:
-                    # Tenta usar JavaScript para clicar em qualquer botão
-                    self.driver.execute_script("document.querySelector('button').click();")
-                    logger.info("Tentativa de clicar no botão via JavaScript")
-                
+                self.seletores.localizar(self.driver, 'login.entrar').click()
+                logger.info("Botão Entrar clicado")
+            except NoSuchElementException:
+                # Tenta usar JavaScript para clicar em qualquer botão
+                self.driver.execute_script("document.querySelector('button').click();")
+                logger.info("Tentativa de clicar no botão via JavaScript")
             except Exception as e:
                 logger.error(f"Erro ao clicar no botão Entrar: {e}")
-                logger.info(f"HTML da página: {self.driver.page_source[:5000]}")
                 raise
             
-            time.sleep(5)  # Aguarda mais tempo para processamento
+            self._aguardar(5)  # Aguarda mais tempo para processamento
             
             # Preenche data de nascimento
             if self.customer.data_nascimento:
@@ -310,57 +369,19 @@ class EquatorialService:
                 logger.info(f"Data de nascimento a ser usada: {data_nascimento}")
                 
                 try:
-                    # Tenta diferentes seletores para o campo de data
-                    selectors = [
-                        "input[name*='txtData']",
-                        "input[id*='txtData']", 
-                        "input[placeholder*='Data' i]",
-                        "input[class*='data' i]"
-                    ]
-                    
-                    data_field = None
-                    for selector in selectors:
-                        try:
-                            data_field = self.driver.find_element(By.CSS_SELECTOR, selector)
-                            logger.info(f"Campo de data encontrado com seletor: {selector}")
-                            break
-                        except:
-                            continue
-                    
-                    if data_field:
-                        data_field.clear()
-                        data_field.send_keys(data_nascimento)
-                        logger.info(f"Data de nascimento preenchida: {data_nascimento}")
-                    else:
-                        logger.error("Campo de data não encontrado após tentar múltiplos seletores")
+                    try:
+                        data_field = self.seletores.localizar(self.driver, 'login.data_nascimento')
+                    except NoSuchElementException:
                         logger.info(f"URL atual: {self.driver.current_url}")
-                        logger.info(f"HTML da página: {self.driver.page_source[:5000]}")
                         raise Exception("Campo de data de nascimento não encontrado")
+                    data_field.clear()
+                    data_field.send_keys(data_nascimento)
+                    logger.info(f"Data de nascimento preenchida: {data_nascimento}")
                     
-                    # Tenta diferentes seletores para o botão Validar
-                    selectors = [
-                        "input[name*='btnValidar']",
-                        "input[id*='btnValidar']",
-                        "button[type='submit']",
-                        "input[type='submit']",
-                        "button:contains('Validar')",
-                        "button",
-                        "input[value*='Validar' i]"
-                    ]
-                    
-                    validate_button = None
-                    for selector in selectors:
-                        try:
-                            validate_button = self.driver.find_element(By.CSS_SELECTOR, selector)
-                            logger.info(f"Botão Validar encontrado com seletor: {selector}")
-                            break
-                        except:
-                            continue
-                    
-                    if validate_button:
-                        validate_button.click()
+                    try:
+                        self.seletores.localizar(self.driver, 'login.validar').click()
                         logger.info("Botão Validar clicado")
-                    else:
+                    except NoSuchElementException:
                         # Tenta usar JavaScript para clicar em qualquer botão ou input submit
                         self.driver.execute_script("document.querySelector('input[type=\"submit\"]').click();")
                         logger.info("Tentativa de clicar no botão via JavaScript")
@@ -369,25 +390,30 @@ class EquatorialService:
                     logger.error(f"Erro ao preencher data de nascimento: {e}")
                     raise
                 
-                time.sleep(5)  # Aguarda mais tempo para processamento
+                self._aguardar(5)  # Aguarda mais tempo para processamento
             
             # Navega para Segunda Via
             logger.info("Navegando para página de Segunda Via")
             segunda_via_url = f"{self.base_url}/AgenciaGO/Servi%C3%A7os/aberto/SegundaVia.aspx"
-            self.driver.get(segunda_via_url)
+            self._navegar(segunda_via_url)
             logger.info(f"URL atual após navegar para Segunda Via: {self.driver.current_url}")
-            time.sleep(5)  # Aguarda mais tempo para carregamento
+            self._aguardar(5)  # Aguarda mais tempo para carregamento
             
             return True
             
+        except PortalIndisponivelError:
+            raise
         except Exception as e:
             logger.error(f"Erro no login: {e}")
+            # A falha no login derruba todas as UCs da sessão
+            task_ids = list(self._tasks_da_sessao('pending').values_list('id', flat=True))
+            self._capturar_falha('login', e, task_ids=task_ids)
             return False
     
     def get_all_ucs_from_dropdown(self):
         """Extrai todas as UCs disponíveis no dropdown"""
         try:
-            dropdown = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_comboBoxUC")
+            dropdown = self.seletores.localizar(self.driver, 'segunda_via.uc')
             select = Select(dropdown)
             
             ucs_list = []
@@ -402,104 +428,155 @@ class EquatorialService:
             logger.error(f"Erro ao extrair UCs: {e}")
             return []
     
+    def _ucs_do_portal(self):
+        """
+        UCs do titular no portal, em cache por EQUATORIAL_UCS_PORTAL_TTL. O
+        dropdown só é lido quando o cache expira ou não contém alguma UC ativa
+        da sessão; as UCs que o cliente ainda não tem são cadastradas (se a
+        descoberta estiver ativa) com a lista do cache ou a recém-lida.
+        """
+        chave = f"equatorial:ucs_portal:{self.customer.cpf_titular or self.customer.cpf}"
+        em_cache = cache.get(chave)
+        ativas = set(self._ucs_ativas().values_list('codigo', flat=True))
+        if em_cache is not None and ativas <= set(em_cache):
+            all_ucs = list(em_cache)
+        else:
+            all_ucs = self.get_all_ucs_from_dropdown()
+            if all_ucs:
+                cache.set(chave, all_ucs, settings.EQUATORIAL_UCS_PORTAL_TTL)
+        if self.descobrir_ucs and all_ucs:
+            novas = importacao.incorporar_ucs(self.customer, all_ucs, prioridade=self._faixa())
+            if novas and self.uc_codes is not None:
+                # As UCs cadastradas ficam com esta sessão
+                self.uc_codes.extend(novas)
+        return all_ucs
+
     def process_faturas(self):
         """Processa o download das faturas"""
         try:
-            # Obtém todas as UCs disponíveis
-            all_ucs = self.get_all_ucs_from_dropdown()
+            # Obtém todas as UCs disponíveis. Ao retomar um job, reaproveita as UCs
+            # já descobertas no log em vez de ler o dropdown de novo.
+            if self.fatura_log is not None and self.fatura_log.ucs_encontradas:
+                all_ucs = list(self.fatura_log.ucs_encontradas)
+            else:
+                all_ucs = self._ucs_do_portal()
+            
+            self.ucs_encontradas = all_ucs
             
             # Filtra apenas as UCs ativas do cliente
-            active_ucs = self.customer.unidades_consumidoras.filter(
-                data_vigencia_fim__isnull=True
-            ).values_list('codigo', flat=True)
+            active_ucs = set(self._ucs_ativas().values_list('codigo', flat=True))
             
             # Define quais UCs devem ser processadas
             self.target_ucs = [uc for uc in all_ucs if uc in active_ucs]
             
-            # Cria log de busca
-            fatura_log = FaturaLog.objects.create(
-                customer=self.customer,
-                cpf_titular=self.customer.cpf_titular or self.customer.cpf,
-                ucs_encontradas=all_ucs
-            )
-            
-            faturas_encontradas = {}
+            # Cria log de busca, a menos que a sessão faça parte de uma execução paralela
+            fatura_log = self.fatura_log
+            if fatura_log is None:
+                fatura_log = FaturaLog.objects.create(
+                    customer=self.customer,
+                    cpf_titular=self.customer.cpf_titular or self.customer.cpf,
+                    ucs_encontradas=all_ucs
+                )
+            self._log_ativo = fatura_log
             
             # Processa cada UC
             for uc_code in self.target_ucs:
-                try:
-                    # Encontra a UC no banco
-                    uc_obj = self.customer.unidades_consumidoras.filter(
-                        codigo=uc_code,
-                        data_vigencia_fim__isnull=True
-                    ).first()
+                # Ponto de cancelamento entre UCs
+                self._verificar_cancelamento()
+                self._verificar_posse()
+                with contexto_log(uc=uc_code):
+                    prazo_uc = None
+                    task = None
+                    inicio_uc = time.monotonic()
+                    try:
+                        # Encontra a UC no banco
+                        uc_obj = self.customer.unidades_consumidoras.filter(
+                            codigo=uc_code,
+                            data_vigencia_fim__isnull=True
+                        ).first()
                     
-                    if not uc_obj:
-                        continue
+                        if not uc_obj:
+                            continue
                     
-                    # Atualiza task para processando
-                    # Alterado de .filter() para .get() para garantir que apenas uma task seja atualizada
-                    task = FaturaTask.objects.get(
-                        customer=self.customer,
-                        unidade_consumidora=uc_obj,
-                        status='pending'  # Busca a task que está pronta para ser processada
-                    )
+                        # Atualiza task para processando
+                        # A restrição unique_open_task_per_uc garante no máximo uma task em aberto por UC
+                        task = FaturaTask.objects.get(
+                            customer=self.customer,
+                            unidade_consumidora=uc_obj,
+                            status='pending'  # Busca a task que está pronta para ser processada
+                        )
                     
-                    task.status = 'processing'
-                    task.save()
+                        # As gravações da task são condicionais ao status: não desfazem um cancelamento
+                        if not FaturaTask.objects.filter(pk=task.pk, status='pending').update(status='processing'):
+                            raise FaturaTask.DoesNotExist
+                        task.status = 'processing'
+                        prazo_uc = self._iniciar_prazo_uc(uc_code)
                     
-                    # Seleciona a UC
-                    dropdown = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_comboBoxUC")
-                    select = Select(dropdown)
-                    select.select_by_value(uc_code)
-                    time.sleep(2)
+                        # Seleciona a UC
+                        dropdown = self.seletores.localizar(self.driver, 'segunda_via.uc')
+                        select = Select(dropdown)
+                        select.select_by_value(uc_code)
+                        self._aguardar(2)
                     
-                    # Configura opções
-                    self.set_emission_type("completa")
-                    self.set_emission_reason("ESV05")
+                        # Configura opções
+                        self.set_emission_type("completa")
+                        self.set_emission_reason("ESV05")
                     
-                    # Clica em emitir
-                    emit_button = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_btEnviar")
-                    emit_button.click()
-                    time.sleep(4)
+                        # Clica em emitir
+                        emit_button = self.seletores.localizar(self.driver, 'segunda_via.emitir')
+                        emit_button.click()
+                        self._aguardar(4)
                     
-                    # Processa faturas da UC
-                    faturas_da_uc = self.extract_and_download_invoices(uc_obj)
-                    faturas_encontradas[uc_code] = faturas_da_uc
+                        # Processa faturas da UC, retomando a partir do checkpoint da task.
+                        # Cada mês é gravado em FaturaResultado à medida que é processado.
+                        self.extract_and_download_invoices(uc_obj, task=task)
+                        # Com o navegador fechado pelo prazo, a UC não pode ser dada como concluída.
+                        # O timer é cancelado antes da checagem para não estourar depois dela.
+                        prazo_uc.cancel()
+                        self._verificar_prazo_uc()
                     
-                    # Atualiza task
-                    task.status = 'completed'
-                    task.completed_at = datetime.now()
-                    task.save()
+                        # Atualiza task
+                        if not FaturaTask.objects.filter(pk=task.pk, status='processing').update(
+                            status='completed', completed_at=datetime.now()
+                        ):
+                            logger.warning(f"Task da UC {uc_code} alterada durante o processamento; não marcada como concluída")
+                            self._verificar_cancelamento()
+                            self._verificar_posse()
                     
-                    # Volta para Segunda Via
-                    self.driver.get(f"{self.base_url}/AgenciaGO/Servi%C3%A7os/aberto/SegundaVia.aspx")
-                    time.sleep(3)
+                        # Volta para Segunda Via
+                        self._navegar(f"{self.base_url}/AgenciaGO/Servi%C3%A7os/aberto/SegundaVia.aspx")
+                        self._aguardar(3)
                     
-                except FaturaTask.DoesNotExist:
-                    logger.warning(f"Nenhuma tarefa pendente encontrada para a UC {uc_code}. Pulando.")
-                    continue
-                except FaturaTask.MultipleObjectsReturned:
-                    logger.error(f"Múltiplas tarefas pendentes encontradas para a UC {uc_code}. Limpando e continuando.")
-                    # Lógica para lidar com múltiplas tarefas (opcional, mas recomendado)
-                    FaturaTask.objects.filter(customer=self.customer, unidade_consumidora=uc_obj, status='pending').delete()
-                    continue # Pula esta UC nesta execução
-                except Exception as e:
-                    logger.error(f"Erro ao processar UC {uc_code}: {e}")
-                    # A busca pela task pode falhar, então precisamos garantir que a task seja atualizada se ela existir
-                    task_to_fail = FaturaTask.objects.filter(customer=self.customer, unidade_consumidora=uc_obj, status='processing').first()
-                    if task_to_fail:
-                        task_to_fail.status = 'failed'
-                        task_to_fail.error_message = str(e)
-                        task_to_fail.save()
-                    continue
-            
-            # Atualiza log
-            fatura_log.faturas_encontradas = faturas_encontradas
-            fatura_log.save()
+                    except FaturaTask.DoesNotExist:
+                        logger.warning(f"Nenhuma tarefa pendente encontrada para a UC {uc_code}. Pulando.")
+                        continue
+                    except PortalIndisponivelError:
+                        # Portal bloqueando: interrompe a sessão; as tasks voltam para a fila
+                        raise
+                    except Exception as e:
+                        if self._prazo_uc_esgotado and not isinstance(e, PrazoUcEsgotado):
+                            e = PrazoUcEsgotado(f"Tempo limite da UC esgotado ({settings.FATURA_UC_TIMEOUT_SEGUNDOS}s)")
+                        logger.error(f"Erro ao processar UC {uc_code}: {e}")
+                        if task is not None:
+                            self._capturar_falha('uc', e, uc_codigo=uc_code, task_ids=[task.id])
+                        self._registrar_resultado(uc_code, {'status': 'erro', 'erro': str(e)}, inicio=inicio_uc)
+                        # Só a task ainda em processamento vira falha; uma cancelada continua cancelada
+                        if task is not None:
+                            FaturaTask.objects.filter(pk=task.pk, status='processing').update(
+                                status='failed', error_message=str(e)
+                            )
+                        if self._prazo_uc_esgotado:
+                            # O navegador foi fechado; as UCs restantes ficam pendentes para a próxima rodada
+                            break
+                        continue
+                    finally:
+                        if prazo_uc:
+                            prazo_uc.cancel()
             
             return True
             
+        except PortalIndisponivelError:
+            raise
         except Exception as e:
             logger.error(f"Erro no processamento de faturas: {e}")
             return False
@@ -507,10 +584,10 @@ class EquatorialService:
     def set_emission_type(self, emission_type="completa"):
         """Configura o tipo de emissão"""
         try:
-            dropdown = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_cbTipoEmissao")
+            dropdown = self.seletores.localizar(self.driver, 'segunda_via.tipo_emissao')
             select = Select(dropdown)
             select.select_by_value(emission_type)
-            time.sleep(1)
+            self._aguardar(1)
             return True
         except Exception as e:
             logger.error(f"Erro ao configurar tipo de emissão: {e}")
@@ -519,10 +596,10 @@ class EquatorialService:
     def set_emission_reason(self, reason_code="ESV05"):
         """Configura o motivo da emissão"""
         try:
-            dropdown = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_cbMotivo")
+            dropdown = self.seletores.localizar(self.driver, 'segunda_via.motivo')
             select = Select(dropdown)
             select.select_by_value(reason_code)
-            time.sleep(1)
+            self._aguardar(1)
             return True
         except Exception as e:
             logger.error(f"Erro ao configurar motivo: {e}")
@@ -538,11 +615,11 @@ class EquatorialService:
             if not crdownload_files:
                 logger.info("Download complete. No .crdownload files found.")
                 # Optional: wait a tiny bit more for file system to be ready
-                time.sleep(1) 
+                self._aguardar(1) 
                 return True
             
             logger.info(f"Download in progress... ({len(crdownload_files)} .crdownload file(s) found)")
-            time.sleep(1)
+            self._aguardar(1)
             seconds += 1
             
         logger.error(f"Download timed out after {timeout} seconds.")
@@ -554,20 +631,56 @@ class EquatorialService:
                 logger.warning(f"Could not remove crdownload file {f}: {e}")
         raise TimeoutException(f"Download did not complete within {timeout} seconds.")
     
-    def extract_and_download_invoices(self, uc_obj):
+    def _registrar_checkpoint(self, task, mes_chave):
+        """Persiste imediatamente que o mês foi concluído para a task"""
+        if task is None or mes_chave in task.meses_concluidos:
+            return
+        task.meses_concluidos = task.meses_concluidos + [mes_chave]
+        task.save(update_fields=['meses_concluidos'])
+
+    def _registrar_resultado(self, uc_codigo, info, mes_referencia=None, inicio=None, tamanho=None):
+        """Grava na hora o resultado de um mês (ou da UC inteira) em FaturaResultado"""
+        if self._log_ativo is None:
+            return
+        try:
+            FaturaResultado.objects.create(
+                fatura_log=self._log_ativo,
+                customer=self.customer,
+                uc_codigo=uc_codigo,
+                mes_referencia=mes_referencia,
+                mes_texto=info.get('mes') or '',
+                status=info.get('status', 'erro'),
+                erro=info.get('erro'),
+                duracao_ms=int((time.monotonic() - inicio) * 1000) if inicio is not None else None,
+                tamanho_bytes=tamanho
+            )
+        except Exception as e:
+            logger.warning(f"Não foi possível registrar o resultado da UC {uc_codigo}: {e}")
+
+    def extract_and_download_invoices(self, uc_obj, task=None):
         """Extrai e baixa as faturas de uma UC específica"""
         faturas_info = []
-        download_dir = os.path.join(settings.MEDIA_ROOT, 'temp_faturas')
+        download_dir = self.download_dir
+
+        def registrar(info, mes_referencia=None, inicio=None, tamanho=None):
+            faturas_info.append(info)
+            self._registrar_resultado(uc_obj.codigo, info, mes_referencia, inicio, tamanho)
         
         try:
             # Encontra todas as faturas disponíveis
-            rows = self.driver.find_elements(By.XPATH, "//tr[.//a[contains(text(), 'Download')]]")
+            rows = self.seletores.localizar_todos(self.driver, 'segunda_via.faturas')
             
             if not rows:
                 logger.warning(f"Nenhuma fatura com link de download encontrada para a UC {uc_obj.codigo}")
+                self._registrar_resultado(uc_obj.codigo, {'status': 'sem_faturas'})
 
             for row in rows:
+                # Ponto de cancelamento entre faturas
+                self.cancelamento.verificar()
+                self._verificar_prazo_uc()
                 month_text = ""
+                mes_referencia_date = None
+                inicio = time.monotonic()
                 try:
                     # Extrai informações
                     month_element = row.find_element(By.XPATH, "./td[1]")
@@ -603,35 +716,56 @@ class EquatorialService:
                     # --- VERIFICAÇÃO DE EXISTÊNCIA ---
                     # Gera o ID que a fatura TERIA se já existisse
                     fatura_id = f"{uc_obj.codigo}_{mes_referencia_date.strftime('%m_%Y')}"
+                    mes_chave = mes_referencia_date.strftime('%Y-%m')
+
+                    # Task restrita a alguns meses (novo download de faturas corrompidas)
+                    if task is not None and task.meses and mes_chave not in task.meses:
+                        continue
+
+                    # Mês já concluído em uma execução anterior desta task
+                    if task is not None and mes_chave in task.meses_concluidos:
+                        logger.info(f"Fatura {fatura_id} já concluída no checkpoint. Pulando.")
+                        registrar({
+                            'mes': month_text,
+                            'arquivo': f"{fatura_id}.pdf",
+                            'baixada': False,
+                            'status': 'existente'
+                        }, mes_referencia_date, inicio)
+                        continue
                     
-                    # Verifica no banco de dados se uma fatura com esse ID já existe
-                    if Fatura.objects.filter(id=fatura_id).exists():
+                    # Verifica no banco de dados se uma fatura com esse ID já existe.
+                    # Faturas com o PDF corrompido ou ausente são baixadas de novo.
+                    existente = Fatura.objects.filter(id=fatura_id).first()
+                    if existente is not None and existente.estado_arquivo not in integridade.ESTADOS_REBAIXAR:
                         logger.info(f"Fatura {fatura_id} já existe. Pulando download.")
-                        faturas_info.append({
+                        self._registrar_checkpoint(task, mes_chave)
+                        registrar({
                             'mes': month_text,
                             'arquivo': f"{fatura_id}.pdf",
                             'baixada': False, # False porque não baixamos de novo
                             'status': 'existente'
-                        })
+                        }, mes_referencia_date, inicio)
                         continue # Pula para a próxima fatura da lista
                     # --- FIM DA VERIFICAÇÃO ---
 
-                    # Clica no download
-                    download_link = row.find_element(By.XPATH, ".//a[contains(text(), 'Download')]")
-                    download_link.click()
-                    
-                    # Aguarda e trata popup
-                    time.sleep(2)
-                    try:
-                        ok_button = self.driver.find_element(By.CSS_SELECTOR, "#CONTENT_btnModal")
-                        if ok_button.is_displayed():
-                            ok_button.click()
-                            time.sleep(1)
-                    except NoSuchElementException:
-                        pass
-                    
-                    # Aguarda download usando o novo método robusto
-                    self.wait_for_download_complete(download_dir)
+                    # Clica no download, respeitando o limitador de taxa do portal
+                    with self.controle.requisicao('download', medir_latencia=False,
+                                                  interrompida=self._navegador_interrompido):
+                        download_link = row.find_element(By.XPATH, ".//a[contains(text(), 'Download')]")
+                        download_link.click()
+                        
+                        # Aguarda e trata popup
+                        self._aguardar(2)
+                        try:
+                            ok_button = self.seletores.localizar(self.driver, 'segunda_via.modal_ok')
+                            if ok_button.is_displayed():
+                                ok_button.click()
+                                self._aguardar(1)
+                        except NoSuchElementException:
+                            pass
+                        
+                        # Aguarda download usando o novo método robusto
+                        self.wait_for_download_complete(download_dir)
                     
                     # Procura arquivo baixado
                     files = sorted(
@@ -642,84 +776,248 @@ class EquatorialService:
                     if files:
                         # Pega o arquivo mais recente
                         latest_file_path = files[-1]
+
+                        # Um download interrompido deixa um PDF truncado: não é gravado como fatura
+                        checksum, erro_pdf = integridade.verificar_arquivo(latest_file_path)
+                        if erro_pdf:
+                            os.remove(latest_file_path)
+                            raise ValueError(f"PDF baixado inválido: {erro_pdf}")
                         
                         # Lê o arquivo
                         with open(latest_file_path, 'rb') as f:
                             file_content = f.read()
                         
-                        # Cria a fatura no banco de dados, passando o ID manualmente
-                        fatura = Fatura(
-                            id=fatura_id,
-                            customer=self.customer,
-                            unidade_consumidora=uc_obj,
-                            mes_referencia=mes_referencia_date,
-                        )
+                        if existente is None:
+                            # Cria a fatura no banco de dados, passando o ID manualmente
+                            fatura = Fatura(
+                                id=fatura_id,
+                                customer=self.customer,
+                                unidade_consumidora=uc_obj,
+                                mes_referencia=mes_referencia_date,
+                            )
+                        else:
+                            # Substitui o PDF corrompido ou ausente, mantendo a fatura
+                            logger.warning(f"Fatura {fatura_id} ({existente.estado_arquivo}) baixada novamente.")
+                            fatura = existente
+                            fatura.arquivo.delete(save=False)
+                            fatura.downloaded_at = timezone.now()
+                            FaturaTexto.objects.filter(fatura=fatura).delete()
+                        fatura.checksum = checksum
+                        fatura.estado_arquivo = 'ok'
+                        fatura.verificado_em = timezone.now()
                         # Anexa o conteúdo do arquivo. O nome do arquivo não é mais tão importante aqui,
                         # pois o `upload_to` cuidará do caminho e nome final.
                         fatura.arquivo.save(f"{fatura.id}.pdf", ContentFile(file_content), save=True)
                         
                         # Remove arquivo temporário
                         os.remove(latest_file_path)
+                        self._registrar_checkpoint(task, mes_chave)
                         
                         logger.info(f"Fatura {fatura.id} criada com sucesso.")
-                        faturas_info.append({
+                        registrar({
                             'mes': month_text,
                             'arquivo': fatura.arquivo.name,
                             'baixada': True,
                             'status': 'criada'
-                        })
+                        }, mes_referencia_date, inicio, tamanho=len(file_content))
                     else:
                         logger.error(f"Download concluído, mas PDF não encontrado para fatura {month_text}")
-                        faturas_info.append({
+                        registrar({
                             'mes': month_text,
                             'arquivo': None,
                             'baixada': False,
+                            'status': 'erro',
                             'erro': 'Arquivo PDF não encontrado após download.'
-                        })
+                        }, mes_referencia_date, inicio)
 
+                except (PortalIndisponivelError, PrazoUcEsgotado):
+                    raise
                 except Exception as e:
+                    # Erro causado pelo fechamento do navegador no estouro do prazo
+                    self._verificar_prazo_uc()
                     logger.error(f"Erro ao baixar fatura {month_text}: {e}")
-                    faturas_info.append({
+                    self._capturar_falha(
+                        f"download_{month_text or 'fatura'}", e,
+                        uc_codigo=uc_obj.codigo, task_ids=[task.id] if task else []
+                    )
+                    registrar({
                         'mes': month_text,
                         'arquivo': None,
                         'baixada': False,
+                        'status': 'erro',
                         'erro': str(e)
-                    })
+                    }, mes_referencia_date, inicio)
                     continue
             
+        except (PortalIndisponivelError, PrazoUcEsgotado):
+            raise
         except Exception as e:
+            self._verificar_prazo_uc()
             logger.error(f"Erro ao processar faturas: {e}")
         
         return faturas_info
     
     def close(self):
         """Fecha o navegador"""
-        if self.driver:
-            self.driver.quit()
+        self._encerrar_driver()
+        # Remove o diretório temporário de download da sessão
+        shutil.rmtree(self.download_dir, ignore_errors=True)
 
     def processar_todas_faturas(self):
         """Método principal para orquestrar todo o processo de scraping."""
         logger.info(f"Iniciando processo completo de faturas para o cliente ID: {self.customer.id}")
         try:
-            if not self.setup_driver():
-                raise Exception("Falha ao configurar o WebDriver.")
+            # Reserva uma vaga de sessão do navegador; aguarda enquanto o circuito do portal estiver aberto.
+            # A faixa é reavaliada durante a espera: o job pode ser promovido pelo usuário.
+            with self.controle.sessao(faixa=self._faixa):
+                try:
+                    # O job pode ter sido cancelado enquanto aguardava a vaga
+                    self._verificar_cancelamento()
+                    if not self.setup_driver():
+                        raise Exception("Falha ao configurar o WebDriver.")
 
-            if not self.login():
-                raise Exception("Falha no processo de login.")
+                    if not self.login():
+                        raise Exception("Falha no processo de login.")
 
-            # O método process_faturas já contém a lógica de iterar sobre as UCs
-            if not self.process_faturas():
-                raise Exception("Falha ao processar as faturas.")
+                    # O método process_faturas já contém a lógica de iterar sobre as UCs
+                    if not self.process_faturas():
+                        raise Exception("Falha ao processar as faturas.")
+                finally:
+                    self.close()
 
             logger.info(f"Processo de faturas para o cliente ID: {self.customer.id} concluído com sucesso.")
             return True
+        except ImportacaoCancelada as e:
+            logger.warning(f"Processamento do cliente {self.customer.id} interrompido: {e}")
+            for status_atual in ('processing', 'pending'):
+                self._tasks_da_sessao(status_atual).update(
+                    status=e.status,
+                    error_message=str(e),
+                    completed_at=datetime.now()
+                )
+            raise
+        except PortalIndisponivelError as e:
+            logger.warning(f"Portal indisponível durante o processamento do cliente {self.customer.id}: {e}")
+            # Devolve as tasks para a fila em vez de marcá-las como falha
+            self._tasks_da_sessao('processing').update(status='pending')
+            raise
         except Exception as e:
             logger.error(f"Erro geral no processamento de faturas para o cliente {self.customer.id}: {e}", exc_info=True)
             # Garante que as tasks sejam marcadas como falha em caso de erro geral
-            FaturaTask.objects.filter(customer=self.customer, status='processing').update(
+            self._tasks_da_sessao('processing').update(
                 status='failed',
                 error_message=str(e)
             )
             return False
+
+
+def calcular_numero_sessoes(total_ucs, max_sessoes=None):
+    """Define quantas sessões paralelas usar para um cliente com `total_ucs` UCs"""
+    if max_sessoes is None:
+        max_sessoes = settings.EQUATORIAL_MAX_SESSOES_POR_CLIENTE
+    min_ucs = max(1, settings.EQUATORIAL_MIN_UCS_POR_SESSAO)
+    return max(1, min(max_sessoes, math.ceil(total_ucs / min_ucs)))
+
+
+def particionar_ucs(uc_codes, num_particoes):
+    """Distribui as UCs em round-robin para equilibrar as sessões"""
+    particoes = [uc_codes[i::num_particoes] for i in range(num_particoes)]
+    return [particao for particao in particoes if particao]
+
+
+def calcular_backoff(tentativa):
+    """Atraso exponencial com jitter antes de repetir as UCs que falharam"""
+    atraso = min(settings.FATURA_RETRY_MAX_SEGUNDOS, settings.FATURA_RETRY_BASE_SEGUNDOS * (2 ** tentativa))
+    return random.uniform(atraso / 2, atraso)
+
+
+def criar_fatura_log(customer):
+    """Cria o log de busca que acompanha um job de importação, inclusive as retomadas"""
+    return FaturaLog.objects.create(
+        customer=customer,
+        cpf_titular=customer.cpf_titular or customer.cpf,
+        ucs_encontradas=[]
+    )
+
+
+def processar_faturas_em_paralelo(customer_id, max_sessoes=None, fatura_log=None, cancelamento=None):
+    """
+    Divide as UCs com tasks pendentes do cliente entre várias sessões do navegador,
+    cada uma com login próprio no mesmo titular, todas registrando no mesmo
+    FaturaLog. UCs já concluídas não entram na divisão, o que permite retomar um job.
+    """
+    customer = Customer.objects.get(id=customer_id)
+    uc_codes = list(
+        FaturaTask.objects.filter(
+            customer=customer,
+            status='pending',
+            unidade_consumidora__data_vigencia_fim__isnull=True
+        )
+        .order_by('unidade_consumidora__codigo')
+        .values_list('unidade_consumidora__codigo', flat=True)
+        .distinct()
+    )
+    if not uc_codes:
+        logger.info(f"Cliente {customer_id}: nenhuma task pendente para processar")
+        return True
+
+    if fatura_log is None:
+        fatura_log = criar_fatura_log(customer)
+
+    num_sessoes = calcular_numero_sessoes(len(uc_codes), max_sessoes)
+    particoes = particionar_ucs(uc_codes, num_sessoes)
+    if len(particoes) > 1:
+        logger.info(f"Cliente {customer_id}: {len(uc_codes)} UCs divididas em {len(particoes)} sessões paralelas")
+
+    intervalo = settings.EQUATORIAL_INTERVALO_ENTRE_SESSOES
+    cancelamento = cancelamento or TokenCancelamento(customer_id=customer_id)
+
+    def executar_sessao(indice, particao):
+        try:
+            # Escalona os logins para não disparar todas as sessões no mesmo instante
+            cancelamento.aguardar(indice * intervalo)
+        except ImportacaoCancelada as e:
+            EquatorialService(customer_id=customer_id, uc_codes=particao)._tasks_da_sessao('pending').update(
+                status=e.status, error_message=str(e), completed_at=datetime.now()
+            )
+            connection.close()
+            raise
+        service = EquatorialService(
+            customer_id=customer_id, uc_codes=particao, fatura_log=fatura_log, cancelamento=cancelamento,
+            descobrir_ucs=customer.descobrir_ucs and indice == 0
+        )
+        try:
+            sucesso = service.processar_todas_faturas()
+            return sucesso, service.ucs_encontradas
         finally:
-            self.close()
+            # Cada thread abre a sua própria conexão com o banco
+            connection.close()
+
+    resultados = []
+    interrupcao = None
+    with ThreadPoolExecutor(max_workers=len(particoes), thread_name_prefix=f"equatorial-{customer_id}") as executor:
+        # Cada sessão roda numa cópia do contexto de log do job (job e cliente)
+        futures = [
+            executor.submit(copiar_contexto().run, executar_sessao, i, particao)
+            for i, particao in enumerate(particoes)
+        ]
+        for future in futures:
+            try:
+                resultados.append(future.result())
+            except (PortalIndisponivelError, ImportacaoCancelada) as e:
+                # Consolida o que as demais sessões concluíram antes de repassar a interrupção
+                if not isinstance(interrupcao, ImportacaoCancelada):
+                    interrupcao = e
+
+    # Mescla com as UCs que o log já tinha de execuções anteriores do mesmo job.
+    # O resultado de cada mês já foi gravado em FaturaResultado durante a execução.
+    ucs_encontradas = list(fatura_log.ucs_encontradas)
+    for _, ucs in resultados:
+        ucs_encontradas.extend(uc for uc in ucs if uc not in ucs_encontradas)
+
+    fatura_log.ucs_encontradas = ucs_encontradas
+    fatura_log.save(update_fields=['ucs_encontradas'])
+
+    if interrupcao is not None:
+        raise interrupcao
+    return all(sucesso for sucesso, _ in resultados)
@@ -0,0 +1,46 @@
+# backend/api/services/exportacao.py
+"""
+Exportação das faturas de toda a base em planilha (CSV ou XLSX).
+
+As linhas vêm de um único SELECT com cliente e UC, lido do cursor em blocos
+(iterator), e são entregues a um gerador de api/streaming.py: a memória não
+cresce com o número de faturas.
+"""
+from functools import partial
+
+from api.models import Fatura
+from api.streaming import gerar_csv, gerar_xlsx
+
+CABECALHO = [
+    'Cliente ID', 'Cliente', 'CPF', 'UC', 'Mês de referência', 'Valor', 'Vencimento', 'Fatura',
+]
+CAMPOS = [
+    'customer_id', 'customer__nome', 'customer__cpf', 'unidade_consumidora__codigo',
+    'mes_referencia', 'valor', 'vencimento', 'id',
+]
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', gerar_csv),
+    'xlsx': (
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        partial(gerar_xlsx, nome_planilha='Faturas'),
+    ),
+}
+# Linhas lidas do cursor por vez
+BLOCO = 2000
+
+
+def consulta(faturas=None):
+    """Faturas na ordem da planilha: cliente, UC e mês"""
+    faturas = Fatura.objects.all() if faturas is None else faturas
+    return faturas.order_by('customer_id', 'unidade_consumidora__codigo', 'mes_referencia')
+
+
+def linhas(faturas):
+    """Tuplas com as colunas de CABECALHO, sem instanciar modelos"""
+    return consulta(faturas).values_list(*CAMPOS).iterator(chunk_size=BLOCO)
+
+
+def gerar(faturas, formato):
+    """Pedaços (bytes) do arquivo no formato pedido ('csv' ou 'xlsx')"""
+    _, gerador = FORMATOS[formato]
+    return gerador(CABECALHO, linhas(faturas))
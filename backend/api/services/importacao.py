@@ -0,0 +1,151 @@
+# backend/api/services/importacao.py
+"""
+Criação das tasks de importação e despacho do job para o task_processor,
+compartilhados pela view de importação e pelo agendador periódico, e
+cadastro das UCs descobertas no portal durante um job.
+"""
+import logging
+
+import requests
+
+from api import cache as cache_api
+from api.models import Customer, FaturaTask, UnidadeConsumidora
+from api.services import processadores
+
+logger = logging.getLogger(__name__)
+
+
+class ImportacaoEmAndamento(Exception):
+    """O cliente já tem um job na fila ou em execução"""
+
+
+class ProcessadorIndisponivelError(Exception):
+    """O task_processor não aceitou o job"""
+
+
+def criar_tasks(customer, ucs, prioridade='interativa', meses=None):
+    """
+    Cria ou reutiliza uma task pendente para cada UC em um número constante de
+    consultas: uma leitura das tasks em aberto, um bulk_update e um bulk_create.
+    Deve rodar dentro de transaction.atomic(); o cliente fica travado até o fim
+    da transação para serializar disparos simultâneos entre workers (no SQLite,
+    que ignora SELECT FOR UPDATE, a trava é a da transação IMMEDIATE).
+    `prioridade` define a faixa do job no task_processor ('interativa' ou 'lote').
+    `meses` ({uc_id: ['YYYY-MM', ...]}) restringe o download de cada UC a esses
+    meses, baixando-os de novo mesmo se já concluídos; sem ele, a UC baixa todos.
+    """
+    meses = meses or {}
+    Customer.objects.select_for_update().get(pk=customer.pk)
+    if FaturaTask.objects.filter(customer=customer, status__in=['pending', 'processing']).exists():
+        raise ImportacaoEmAndamento(f"Cliente {customer.pk} já possui importação em andamento")
+
+    ucs = list(ucs)
+    abertas = {
+        task.unidade_consumidora_id: task
+        for task in FaturaTask.objects.filter(
+            customer=customer,
+            unidade_consumidora__in=ucs,
+            status__in=FaturaTask.STATUS_EM_ABERTO
+        )
+    }
+    tasks, reutilizadas, novas = [], [], []
+    for uc in ucs:
+        task = abertas.get(uc.id)
+        if task is None:
+            task = FaturaTask(
+                customer=customer, unidade_consumidora=uc, status='pending', prioridade=prioridade,
+                meses=meses.get(uc.id, [])
+            )
+            novas.append(task)
+        else:
+            # Reseta a task com falha para ser executada novamente.
+            # O checkpoint (meses_concluidos) é mantido para retomar de onde parou.
+            task.status = 'pending'
+            task.error_message = None
+            task.completed_at = None
+            task.tentativas = 0
+            task.proxima_tentativa_em = None
+            task.prioridade = prioridade
+            task.meses = meses.get(uc.id, [])
+            task.meses_concluidos = [mes for mes in task.meses_concluidos if mes not in task.meses]
+            reutilizadas.append(task)
+        tasks.append(task)
+
+    FaturaTask.objects.bulk_update(
+        reutilizadas,
+        ['status', 'error_message', 'completed_at', 'tentativas', 'proxima_tentativa_em', 'prioridade',
+         'meses', 'meses_concluidos']
+    )
+    FaturaTask.objects.bulk_create(novas)
+    return tasks
+
+
+def incorporar_ucs(customer, codigos, prioridade='interativa'):
+    """
+    Cadastra em massa as UCs do portal que o cliente nunca teve cadastradas e
+    cria uma task pendente para cada uma. UCs encerradas não são reativadas.
+    Retorna os códigos das UCs cadastradas.
+    """
+    conhecidas = set(customer.unidades_consumidoras.values_list('codigo', flat=True))
+    novos = [codigo for codigo in dict.fromkeys(codigos) if codigo not in conhecidas]
+    if not novos:
+        return []
+
+    # ignore_conflicts: outra sessão do mesmo job pode cadastrar a mesma UC ao mesmo tempo
+    UnidadeConsumidora.objects.bulk_create(
+        [UnidadeConsumidora(customer=customer, codigo=codigo, endereco='') for codigo in novos],
+        ignore_conflicts=True
+    )
+    ucs = list(customer.unidades_consumidoras.filter(codigo__in=novos, data_vigencia_fim__isnull=True))
+    FaturaTask.objects.bulk_create(
+        [
+            FaturaTask(customer=customer, unidade_consumidora=uc, status='pending', prioridade=prioridade)
+            for uc in ucs
+        ],
+        ignore_conflicts=True
+    )
+    # bulk_create não dispara os sinais de invalidação do cache das listagens
+    cache_api.invalidar(cache_api.UCS, customer.pk)
+    cache_api.invalidar(cache_api.FATURAS, customer.pk)
+    logger.info(f"Cliente {customer.pk}: {len(ucs)} UCs descobertas no portal cadastradas: {', '.join(novos)}")
+    cadastrados = {uc.codigo for uc in ucs}
+    return [codigo for codigo in novos if codigo in cadastrados]
+
+
+def promover(customer):
+    """
+    Passa o job em andamento do cliente para a faixa interativa: um usuário que
+    dispara a importação não espera atrás da varredura em lote que já o incluía.
+    As sessões que ainda aguardam vaga passam a concorrer como interativas.
+    """
+    return FaturaTask.objects.filter(
+        customer=customer, status__in=['pending', 'processing'], prioridade='lote'
+    ).update(prioridade='interativa')
+
+
+def despachar(customer_id, tasks, perfilar=False):
+    """
+    Entrega o job à instância do task_processor responsável pelo cliente (ou a
+    TASK_PROCESSOR_URL, se nenhuma estiver registrada). Se ela não aceitar, as
+    tasks são marcadas como falhas e ProcessadorIndisponivelError é levantada.
+    """
+    no = processadores.no_responsavel(Customer.objects.get(pk=customer_id))
+    url = processadores.url(no)
+    task_ids = [task.id for task in tasks]
+    try:
+        response = requests.post(f"{url}/process-task", json={
+            'customer_id': customer_id,
+            # Perfila o job (pilhas e SQL), gravando o resultado em PROFILING_DIR
+            'profile': perfilar,
+        }, timeout=10)
+        if response.status_code != 202:
+            raise requests.exceptions.RequestException(f"Serviço de automação respondeu com status {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        FaturaTask.objects.filter(id__in=task_ids).update(
+            status='failed',
+            error_message=f"Não foi possível conectar ao serviço de automação: {e}"
+        )
+        raise ProcessadorIndisponivelError(str(e)) from e
+    if no is not None:
+        # Se a instância parar de enviar heartbeat, outra assume o job
+        FaturaTask.objects.filter(id__in=task_ids).update(processador=no.nome)
@@ -0,0 +1,220 @@
+# backend/api/services/integridade.py
+"""
+Verificação de integridade dos PDFs das faturas.
+
+Cada PDF é lido uma vez por verificação, em um pool de processos: tamanho
+dentro dos limites, cabeçalho %PDF-, marcador %%EOF no final (um download
+interrompido corta o arquivo antes dele) e leitura da estrutura pelo pypdf.
+O SHA-256 fica em Fatura.checksum; nas verificações seguintes, um checksum
+diferente denuncia um arquivo alterado no disco.
+
+As faturas corrompidas são marcadas e os meses delas voltam para a fila do
+task_processor em tasks restritas a esses meses (FaturaTask.meses). Enquanto
+continuarem corrompidas ou ausentes, cada varredura as enfileira de novo.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from api import cache as cache_api
+from api.models import Customer, Fatura, FaturaTask
+from api.services import importacao
+
+logger = logging.getLogger(__name__)
+
+# Bytes lidos por vez no cálculo do checksum
+BLOCO = 1024 * 1024
+# O %%EOF final tem de estar nestes últimos bytes (pode haver quebras de linha ou lixo depois)
+CAUDA = 1024
+# Estados que fazem a fatura ser baixada de novo
+ESTADOS_REBAIXAR = ['corrompido', 'ausente']
+
+
+def verificar_pdf(caminho, tamanho_minimo=0, tamanho_maximo=None):
+    """
+    Verifica o PDF em `caminho`. Executado nos processos do pool e pelo scraper
+    antes de gravar a fatura: não usa o Django. Retorna (checksum, erro); o
+    checksum é None se o arquivo não pôde ser lido.
+    """
+    from pypdf import PdfReader
+
+    digest = hashlib.sha256()
+    try:
+        with open(caminho, 'rb') as arquivo:
+            cabecalho = arquivo.read(5)
+            digest.update(cabecalho)
+            for bloco in iter(partial(arquivo.read, BLOCO), b''):
+                digest.update(bloco)
+            tamanho = arquivo.tell()
+            arquivo.seek(max(0, tamanho - CAUDA))
+            cauda = arquivo.read()
+    except FileNotFoundError:
+        return None, 'ausente'
+    except OSError as e:
+        return None, f"{type(e).__name__}: {e}"
+    checksum = digest.hexdigest()
+
+    if tamanho < tamanho_minimo:
+        return checksum, f"Arquivo pequeno demais ({tamanho} bytes)"
+    if tamanho_maximo and tamanho > tamanho_maximo:
+        return checksum, f"Arquivo grande demais ({tamanho} bytes)"
+    if cabecalho != b'%PDF-':
+        return checksum, "Cabeçalho %PDF- ausente"
+    if b'%%EOF' not in cauda:
+        return checksum, "Marcador %%EOF ausente (arquivo truncado)"
+    try:
+        leitor = PdfReader(caminho, strict=False)
+        if not leitor.pages:
+            return checksum, "PDF sem páginas"
+        # Carrega a primeira página: falha se o xref aponta para objetos que não existem
+        leitor.pages[0].get_contents()
+    except Exception as e:
+        return checksum, f"Estrutura inválida ({type(e).__name__}: {e})"
+    return checksum, None
+
+
+def _verificador():
+    return partial(
+        verificar_pdf,
+        tamanho_minimo=settings.INTEGRIDADE_TAMANHO_MINIMO,
+        tamanho_maximo=settings.INTEGRIDADE_TAMANHO_MAXIMO,
+    )
+
+
+def verificar_arquivo(caminho):
+    """Verificação síncrona de um arquivo com os limites configurados (usada antes de gravar a fatura)"""
+    return _verificador()(caminho)
+
+
+def _pendentes(reverificar=False):
+    faturas = Fatura.objects.exclude(arquivo='')
+    if not reverificar:
+        limite = timezone.now() - timedelta(days=settings.INTEGRIDADE_REVERIFICAR_DIAS)
+        # As ausentes são relidas a cada execução: o arquivo pode ter voltado (volume remontado, backup)
+        faturas = faturas.filter(
+            Q(verificado_em__isnull=True) | Q(verificado_em__lt=limite) | Q(estado_arquivo='ausente')
+        )
+    return faturas.order_by('pk').values_list('pk', 'customer_id', 'unidade_consumidora_id',
+                                              'mes_referencia', 'arquivo', 'checksum', 'estado_arquivo')
+
+
+def verificar(processos=None, lote=200, limite=None, reverificar=False):
+    """
+    Verifica as faturas nunca verificadas ou verificadas há mais de
+    INTEGRIDADE_REVERIFICAR_DIAS (todas, com `reverificar`). Os PDFs são lidos
+    em `processos` processos; o banco só é acessado por este processo, em lotes
+    de `lote` faturas. Retorna (verificadas, corrompidas), com corrompidas
+    sendo as faturas que passaram a um estado que exige novo download nesta
+    execução: {fatura_id: (customer_id, uc_id, mes_referencia)}.
+    """
+    verificadas = 0
+    corrompidas = {}
+    ultimo = ''
+    verificador = _verificador()
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        while limite is None or verificadas < limite:
+            tamanho = lote if limite is None else min(lote, limite - verificadas)
+            # Paginação pela chave: memória constante, cada fatura verificada uma vez por execução
+            faturas = list(_pendentes(reverificar).filter(pk__gt=ultimo)[:tamanho])
+            if not faturas:
+                break
+            ultimo = faturas[-1][0]
+
+            caminhos = [os.path.join(settings.MEDIA_ROOT, fatura[4]) for fatura in faturas]
+            agora = timezone.now()
+            atualizadas = []
+            clientes = set()
+            for fatura, (checksum, erro) in zip(faturas, executor.map(verificador, caminhos, chunksize=8)):
+                pk, customer_id, uc_id, mes_referencia, arquivo, checksum_anterior, estado_anterior = fatura
+                if erro is None and checksum_anterior and checksum != checksum_anterior:
+                    erro = "Checksum diferente do registrado na verificação anterior"
+                if erro == 'ausente':
+                    estado = 'ausente'
+                elif erro:
+                    estado = 'corrompido'
+                    logger.warning(f"Fatura {pk}: PDF corrompido ({erro})")
+                else:
+                    estado = 'ok'
+                if estado != 'ok' and estado_anterior == 'ok':
+                    corrompidas[pk] = (customer_id, uc_id, mes_referencia)
+                if estado != estado_anterior:
+                    clientes.add(customer_id)
+                atualizadas.append(Fatura(
+                    pk=pk,
+                    estado_arquivo=estado,
+                    # O checksum registrado é o do arquivo íntegro; um arquivo alterado não o substitui
+                    checksum=checksum if estado == 'ok' else checksum_anterior,
+                    verificado_em=agora,
+                ))
+
+            # bulk_update não dispara os sinais de invalidação do cache das listagens
+            with transaction.atomic():
+                Fatura.objects.bulk_update(atualizadas, ['estado_arquivo', 'checksum', 'verificado_em'])
+            for customer_id in clientes:
+                cache_api.invalidar(cache_api.FATURAS, customer_id)
+            verificadas += len(faturas)
+            close_old_connections()
+    return verificadas, corrompidas
+
+
+def rebaixar(faturas):
+    """
+    Enfileira o novo download dos meses das faturas, agrupados por cliente, em
+    tasks da faixa de lote restritas a esses meses. `faturas` é um dict
+    {fatura_id: (customer_id, uc_id, mes_referencia)}. Clientes com importação
+    em andamento ficam de fora. Retorna os ids dos clientes despachados.
+    """
+    por_cliente = {}
+    for customer_id, uc_id, mes_referencia in faturas.values():
+        meses = por_cliente.setdefault(customer_id, {}).setdefault(uc_id, [])
+        meses.append(mes_referencia.strftime('%Y-%m'))
+
+    despachados = []
+    for customer_id, meses in por_cliente.items():
+        try:
+            with transaction.atomic():
+                customer = Customer.objects.get(pk=customer_id)
+                # O scraper só percorre as UCs ativas
+                ucs = list(customer.unidades_consumidoras.filter(pk__in=list(meses), data_vigencia_fim__isnull=True))
+                if not ucs:
+                    continue
+                tasks = importacao.criar_tasks(customer, ucs, prioridade='lote', meses=meses)
+        except importacao.ImportacaoEmAndamento:
+            logger.info(f"Cliente {customer_id} com importação em andamento; novo download fica para a próxima verificação")
+            continue
+        try:
+            importacao.despachar(customer_id, tasks)
+        except importacao.ProcessadorIndisponivelError as e:
+            logger.error(f"Novo download das faturas corrompidas do cliente {customer_id} não despachado: {e}")
+            continue
+        logger.info(f"Cliente {customer_id}: novo download de {sum(len(m) for m in meses.values())} faturas enfileirado")
+        despachados.append(customer_id)
+    return despachados
+
+
+def pendentes_de_download():
+    """
+    Faturas marcadas como corrompidas ou ausentes cuja UC não tem task na fila
+    ou em execução, no formato aceito por rebaixar(). Um novo download que não
+    pôde ser enfileirado (importação em andamento, task_processor fora do ar)
+    ou que falhou volta a aparecer na varredura seguinte.
+    """
+    task_aberta = FaturaTask.objects.filter(
+        unidade_consumidora=OuterRef('unidade_consumidora'), status__in=['pending', 'processing']
+    )
+    return {
+        pk: (customer_id, uc_id, mes_referencia)
+        for pk, customer_id, uc_id, mes_referencia in Fatura.objects.filter(
+            estado_arquivo__in=ESTADOS_REBAIXAR
+        ).exclude(Exists(task_aberta)).values_list(
+            'pk', 'customer_id', 'unidade_consumidora_id', 'mes_referencia'
+        ).iterator()
+    }
@@ -0,0 +1,153 @@
+# backend/api/services/processadores.py
+"""
+Coordenação de várias instâncias do task_processor pelo banco de dados.
+
+Cada instância se registra em ProcessadorNode e renova um heartbeat
+periódico, anunciando quantas sessões de navegador aceita. Os clientes são
+distribuídos por hashing consistente sobre o cpf_titular: o mesmo titular cai
+sempre na mesma instância (onde a sessão do portal já está aquecida) e a
+entrada ou saída de uma instância só remaneja os clientes dela. Cada instância
+tem no anel um número de pontos proporcional à sua capacidade.
+"""
+import bisect
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from api.models import FaturaTask, ProcessadorNode
+
+logger = logging.getLogger(__name__)
+
+# Pontos no anel por sessão de capacidade anunciada
+PONTOS_POR_SESSAO = 32
+
+
+class JobAssumidoError(BaseException):
+    """
+    Outra instância assumiu o job (esta ficou tempo demais sem heartbeat).
+    Herda de BaseException para atravessar os tratamentos genéricos de erro:
+    a instância antiga apenas para, sem alterar as tasks, que já são da nova.
+    """
+
+
+def _hash(chave):
+    return int(hashlib.sha1(chave.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class AnelConsistente:
+    """Anel de hashing consistente com pontos virtuais proporcionais à capacidade"""
+
+    def __init__(self, nos):
+        self.nos = {no.nome: no for no in nos}
+        pontos = sorted(
+            (_hash(f"{no.nome}#{i}"), no.nome)
+            for no in nos
+            for i in range(max(1, no.capacidade) * PONTOS_POR_SESSAO)
+        )
+        self._chaves = [chave for chave, _ in pontos]
+        self._nomes = [nome for _, nome in pontos]
+
+    def no_para(self, chave):
+        """Instância responsável pela chave; None se o anel estiver vazio"""
+        if not self._chaves:
+            return None
+        indice = bisect.bisect(self._chaves, _hash(chave)) % len(self._chaves)
+        return self.nos[self._nomes[indice]]
+
+
+def nos_ativos():
+    """Instâncias com heartbeat dentro do prazo"""
+    limite = timezone.now() - timedelta(seconds=settings.PROCESSADOR_HEARTBEAT_TIMEOUT)
+    return list(ProcessadorNode.objects.filter(ultimo_heartbeat__gte=limite))
+
+
+def chave_cliente(customer):
+    """Chave de distribuição do cliente: o titular do login no portal"""
+    return customer.cpf_titular or customer.cpf
+
+
+def no_responsavel(customer, nos=None):
+    """Instância ativa responsável pelo cliente; None se nenhuma estiver registrada"""
+    return AnelConsistente(nos_ativos() if nos is None else nos).no_para(chave_cliente(customer))
+
+
+def url(no):
+    """URL da instância; TASK_PROCESSOR_URL se ela não estiver registrada ou não anunciar URL"""
+    return no.url if no is not None and no.url else settings.TASK_PROCESSOR_URL
+
+
+def url_do_no(nome):
+    """URL da instância pelo nome; TASK_PROCESSOR_URL se ela não estiver registrada ou não anunciar URL"""
+    return url(ProcessadorNode.objects.filter(nome=nome).first() if nome else None)
+
+
+def verificar_posse(tasks, nome):
+    """
+    Levanta JobAssumidoError se alguma das tasks em aberto passou para outra
+    instância. Chamado antes de cada UC e de cada nova rodada do job, para que
+    duas instâncias nunca raspem o mesmo cliente ao mesmo tempo.
+    """
+    outra = (
+        tasks.filter(status__in=['pending', 'processing'])
+        .exclude(processador__isnull=True)
+        .exclude(processador=nome)
+        .values_list('processador', flat=True)
+        .first()
+    )
+    if outra:
+        raise JobAssumidoError(f"Job assumido pela instância {outra}")
+
+
+def registrar_heartbeat(nome, url, capacidade, sessoes_em_uso=0):
+    no, _ = ProcessadorNode.objects.update_or_create(nome=nome, defaults={
+        'url': url,
+        'capacidade': capacidade,
+        'sessoes_em_uso': sessoes_em_uso,
+        'ultimo_heartbeat': timezone.now(),
+    })
+    return no
+
+
+def assumir_jobs_orfaos(nome):
+    """
+    Redistribui os jobs em aberto de instâncias sem heartbeat. Cada instância
+    assume só os clientes que o anel das instâncias ativas atribui a ela; a
+    atualização condicional garante que um job seja assumido por uma só.
+    Retorna os ids dos clientes assumidos, com as tasks de volta a 'pending'.
+    """
+    ativos = nos_ativos()
+    nomes_ativos = {no.nome for no in ativos}
+    if nome not in nomes_ativos:
+        # Esta instância ainda não aparece como ativa (heartbeat atrasado)
+        return []
+    orfas = (
+        FaturaTask.objects
+        .filter(status__in=['pending', 'processing'], processador__isnull=False)
+        .exclude(processador__in=nomes_ativos)
+    )
+    anel = AnelConsistente(ativos)
+    assumidos = []
+    for customer_id, cpf_titular, cpf, mortos in _clientes_orfaos(orfas):
+        if anel.no_para(cpf_titular or cpf).nome != nome:
+            continue
+        atualizadas = orfas.filter(customer_id=customer_id, processador__in=mortos).update(
+            processador=nome, status='pending'
+        )
+        if atualizadas:
+            logger.warning(
+                f"Job do cliente {customer_id} assumido de {', '.join(sorted(mortos))} ({atualizadas} tasks)"
+            )
+            assumidos.append(customer_id)
+    return assumidos
+
+
+def _clientes_orfaos(orfas):
+    clientes = {}
+    for customer_id, cpf_titular, cpf, processador in orfas.values_list(
+        'customer_id', 'customer__cpf_titular', 'customer__cpf', 'processador'
+    ):
+        clientes.setdefault(customer_id, (cpf_titular, cpf, set()))[2].add(processador)
+    return [(customer_id, *dados) for customer_id, dados in clientes.items()]
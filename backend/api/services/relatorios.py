@@ -0,0 +1,147 @@
+# backend/api/services/relatorios.py
+"""
+Relatório consolidado do cliente em PDF (resumo + faturas do período).
+
+A montagem roda em um pool de processos (api/relatorio_pdf.py). O resultado
+fica em MEDIA_ROOT/relatorios/<cliente>/, com nome derivado de uma impressão
+digital das faturas envolvidas (id, checksum, tamanho e data de modificação
+do PDF, valor e vencimento): enquanto nenhuma fatura do período mudar, o mesmo
+arquivo é servido sem gerar nada. Pedidos simultâneos do mesmo relatório
+aguardam a mesma geração.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from django.conf import settings
+
+from api.relatorio_pdf import gerar_relatorio
+
+logger = logging.getLogger(__name__)
+
+PASTA = 'relatorios'
+# Incrementar quando o layout mudar, para não servir relatórios antigos do cache
+VERSAO = 1
+
+_pool = None
+_em_andamento = {}
+_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # spawn: os processos não herdam as threads nem as conexões do servidor
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.RELATORIOS_PROCESSOS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _pool
+
+
+def _periodo(inicio, fim):
+    """Trecho do nome do arquivo e descrição legível do período"""
+    chave = f"{inicio:%Y%m}" if inicio else 'inicio'
+    chave += f"-{fim:%Y%m}" if fim else '-fim'
+    descricao = (
+        f"{inicio:%m/%Y} a {fim:%m/%Y}" if inicio and fim
+        else f"a partir de {inicio:%m/%Y}" if inicio
+        else f"até {fim:%m/%Y}" if fim
+        else "todas as faturas"
+    )
+    return chave, descricao
+
+
+def _dados_faturas(faturas):
+    return [
+        {
+            'id': fatura.id,
+            'uc': fatura.unidade_consumidora.codigo,
+            'mes_referencia': fatura.mes_referencia,
+            'vencimento': fatura.vencimento,
+            'valor': fatura.valor,
+            'checksum': fatura.checksum,
+            'caminho': os.path.join(settings.MEDIA_ROOT, fatura.arquivo.name),
+        }
+        for fatura in faturas
+        if fatura.arquivo
+    ]
+
+
+def _impressao_digital(dados):
+    """Hash do conjunto de faturas: muda quando uma fatura entra, sai ou tem o PDF ou os dados alterados"""
+    digest = hashlib.sha256(f"v{VERSAO}".encode())
+    for fatura in dados:
+        try:
+            estado = os.stat(fatura['caminho'])
+            arquivo = f"{estado.st_size}:{estado.st_mtime_ns}"
+        except OSError:
+            arquivo = 'ausente'
+        digest.update(
+            f"{fatura['id']}|{fatura['checksum']}|{arquivo}|{fatura['valor']}|{fatura['vencimento']}\n".encode()
+        )
+    return digest.hexdigest()[:32]
+
+
+def _concluir(nome, chave_periodo, future):
+    with _lock:
+        _em_andamento.pop(nome, None)
+    if future.exception() is not None:
+        logger.error(f"Falha ao gerar o relatório {nome}: {future.exception()}")
+        return
+    # Versões anteriores do mesmo período deixam de valer
+    pasta = os.path.join(settings.MEDIA_ROOT, os.path.dirname(nome))
+    atual = os.path.basename(nome)
+    for entrada in os.scandir(pasta):
+        if entrada.name.startswith(f"{chave_periodo}_") and entrada.name != atual:
+            try:
+                os.remove(entrada.path)
+            except OSError:
+                pass
+    logger.info(f"Relatório {nome} gerado")
+
+
+def obter_relatorio(customer, faturas, inicio=None, fim=None, espera=None):
+    """
+    Nome (relativo a MEDIA_ROOT) do relatório do cliente com as faturas
+    informadas, gerando-o se preciso. Aguarda até `espera` segundos
+    (RELATORIO_ESPERA_SEGUNDOS por padrão); se a geração não terminar a tempo,
+    retorna None e ela continua no pool, de modo que um novo pedido encontra o
+    arquivo pronto ou aguarda a mesma geração.
+    """
+    espera = settings.RELATORIO_ESPERA_SEGUNDOS if espera is None else espera
+    dados = _dados_faturas(
+        faturas.select_related('unidade_consumidora').order_by('unidade_consumidora__codigo', 'mes_referencia')
+    )
+    chave_periodo, descricao = _periodo(inicio, fim)
+    nome = os.path.join(PASTA, str(customer.pk), f"{chave_periodo}_{_impressao_digital(dados)}.pdf")
+    destino = os.path.join(settings.MEDIA_ROOT, nome)
+    if os.path.isfile(destino):
+        return nome
+
+    with _lock:
+        future = _em_andamento.get(nome)
+        nova = future is None
+        if nova:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            logger.info(f"Gerando o relatório {nome} ({len(dados)} faturas)")
+            future = _get_pool().submit(
+                gerar_relatorio,
+                destino,
+                f"Relatório consolidado - {customer.nome}",
+                f"Período: {descricao} · {len(dados)} faturas",
+                dados,
+            )
+            _em_andamento[nome] = future
+    if nova:
+        # Fora da trava: se a geração já terminou, o callback roda nesta thread e precisa dela
+        future.add_done_callback(lambda f: _concluir(nome, chave_periodo, f))
+
+    try:
+        future.result(timeout=espera)
+    except TimeoutError:
+        return None
+    return nome
@@ -0,0 +1,220 @@
+# backend/api/services/seletores.py
+"""
+Registro dos seletores dos elementos do portal da Equatorial.
+
+Cada elemento lógico tem uma lista ordenada de seletores: o primeiro é o
+primário e os demais são alternativas para quando o HTML do portal muda. O
+registro lembra qual seletor encontrou o elemento da última vez (no processo
+e no cache do Django, compartilhado entre processadores) e o tenta primeiro,
+de modo que uma mudança no portal só custa as buscas frustradas uma vez.
+Também acumula a latência das buscas e avisa quando o seletor primário deixa
+de encontrar o elemento. Seletores genéricos (GENERICOS), que encontram
+qualquer elemento do tipo, servem só de último recurso e nunca são lembrados.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from selenium.common.exceptions import InvalidSelectorException, NoSuchElementException
+from selenium.webdriver.common.by import By
+
+logger = logging.getLogger(__name__)
+
+SELETORES = {
+    # Login
+    'login.uc': [
+        (By.CSS_SELECTOR, "input[name*='UC' i]"),
+        (By.CSS_SELECTOR, "input[id*='UC' i]"),
+        (By.CSS_SELECTOR, "input[placeholder*='Unidade' i]"),
+        (By.CSS_SELECTOR, "input[class*='UC' i]"),
+    ],
+    'login.cpf': [
+        (By.CSS_SELECTOR, "input[name*='CPF' i]"),
+        (By.CSS_SELECTOR, "input[id*='CPF' i]"),
+        (By.CSS_SELECTOR, "input[placeholder*='CPF' i]"),
+        (By.CSS_SELECTOR, "input[class*='CPF' i]"),
+    ],
+    'login.entrar': [
+        (By.CSS_SELECTOR, "button.button"),
+        (By.CSS_SELECTOR, "button[type='submit']"),
+        (By.CSS_SELECTOR, "input[type='submit']"),
+        (By.XPATH, "//button[contains(., 'Entrar')]"),
+        (By.CSS_SELECTOR, "input[value*='Entrar' i]"),
+        (By.CSS_SELECTOR, "button"),
+    ],
+    'login.data_nascimento': [
+        (By.CSS_SELECTOR, "input[name*='txtData']"),
+        (By.CSS_SELECTOR, "input[id*='txtData']"),
+        (By.CSS_SELECTOR, "input[placeholder*='Data' i]"),
+        (By.CSS_SELECTOR, "input[class*='data' i]"),
+    ],
+    'login.validar': [
+        (By.CSS_SELECTOR, "input[name*='btnValidar']"),
+        (By.CSS_SELECTOR, "input[id*='btnValidar']"),
+        (By.CSS_SELECTOR, "button[type='submit']"),
+        (By.CSS_SELECTOR, "input[type='submit']"),
+        (By.XPATH, "//button[contains(., 'Validar')]"),
+        (By.CSS_SELECTOR, "input[value*='Validar' i]"),
+        (By.CSS_SELECTOR, "button"),
+    ],
+    # Segunda via
+    'segunda_via.uc': [
+        (By.CSS_SELECTOR, "#CONTENT_comboBoxUC"),
+        (By.CSS_SELECTOR, "select[id*='comboBoxUC' i]"),
+    ],
+    'segunda_via.tipo_emissao': [
+        (By.CSS_SELECTOR, "#CONTENT_cbTipoEmissao"),
+        (By.CSS_SELECTOR, "select[id*='TipoEmissao' i]"),
+    ],
+    'segunda_via.motivo': [
+        (By.CSS_SELECTOR, "#CONTENT_cbMotivo"),
+        (By.CSS_SELECTOR, "select[id*='Motivo' i]"),
+    ],
+    'segunda_via.emitir': [
+        (By.CSS_SELECTOR, "#CONTENT_btEnviar"),
+        (By.CSS_SELECTOR, "[id*='btEnviar' i]"),
+    ],
+    'segunda_via.faturas': [
+        (By.XPATH, "//tr[.//a[contains(text(), 'Download')]]"),
+        (By.XPATH, "//a[contains(., 'Download')]/ancestor::tr[1]"),
+    ],
+    'segunda_via.modal_ok': [
+        (By.CSS_SELECTOR, "#CONTENT_btnModal"),
+        (By.CSS_SELECTOR, "[id*='btnModal' i]"),
+    ],
+}
+
+# Seletores que casam com qualquer elemento do tipo: podem acertar por acaso em uma
+# página e errar em outra, então não passam à frente dos específicos
+GENERICOS = {
+    (By.CSS_SELECTOR, "button"),
+}
+
+# Por quanto tempo (segundos) o seletor vencedor fica no cache compartilhado
+VENCEDOR_TTL = 7 * 86400
+
+
+class RegistroSeletores:
+    def __init__(self, seletores):
+        self.seletores = seletores
+        self._vencedor = {}
+        self._primario_falhando = set()
+        self._buscas = Counter()
+        self._falhas = Counter()
+        self._tentativas = Counter()
+        self._segundos = Counter()
+        self._vitorias = Counter()
+        self._lock = threading.Lock()
+
+    def _ordem(self, elemento):
+        """Índices dos seletores do elemento, começando pelo último vencedor"""
+        total = len(self.seletores[elemento])
+        with self._lock:
+            vencedor = self._vencedor.get(elemento)
+        if vencedor is None:
+            vencedor = cache.get(f"equatorial:seletor:{elemento}")
+        if vencedor is None or not 0 <= vencedor < total or self.seletores[elemento][vencedor] in GENERICOS:
+            return list(range(total))
+        return [vencedor] + [i for i in range(total) if i != vencedor]
+
+    def _buscar(self, elemento, buscar):
+        inicio = time.monotonic()
+        tentativas = 0
+        for indice in self._ordem(elemento):
+            tentativas += 1
+            try:
+                resultado = buscar(self.seletores[elemento][indice])
+            except (NoSuchElementException, InvalidSelectorException):
+                continue
+            if resultado:
+                self._registrar(elemento, indice, tentativas, time.monotonic() - inicio)
+                return resultado
+        self._registrar(elemento, None, tentativas, time.monotonic() - inicio)
+        return None
+
+    def _registrar(self, elemento, indice, tentativas, segundos):
+        with self._lock:
+            self._buscas[elemento] += 1
+            self._tentativas[elemento] += tentativas
+            self._segundos[elemento] += segundos
+            if indice is None:
+                self._falhas[elemento] += 1
+                return
+            self._vitorias[(elemento, indice)] += 1
+            generico = self.seletores[elemento][indice] in GENERICOS
+            mudou = not generico and self._vencedor.get(elemento) != indice
+            if not generico:
+                self._vencedor[elemento] = indice
+            if indice == 0:
+                if elemento in self._primario_falhando:
+                    self._primario_falhando.discard(elemento)
+                    logger.info(f"Seletor primário de '{elemento}' voltou a encontrar o elemento")
+            elif elemento not in self._primario_falhando:
+                # Aviso único por mudança: o portal provavelmente alterou o HTML
+                self._primario_falhando.add(elemento)
+                logger.error(
+                    f"Seletor primário de '{elemento}' não encontra mais o elemento; "
+                    f"usando a alternativa {self.seletores[elemento][indice][1]!r}"
+                )
+        if mudou:
+            cache.set(f"equatorial:seletor:{elemento}", indice, VENCEDOR_TTL)
+
+    def localizar(self, contexto, elemento):
+        """
+        Primeiro elemento encontrado pelos seletores de `elemento` a partir de
+        `contexto` (driver ou outro elemento). Levanta NoSuchElementException.
+        """
+        encontrado = self._buscar(elemento, lambda seletor: contexto.find_element(*seletor))
+        if encontrado is None:
+            raise NoSuchElementException(
+                f"Elemento '{elemento}' não encontrado com {len(self.seletores[elemento])} seletores"
+            )
+        return encontrado
+
+    def localizar_todos(self, contexto, elemento):
+        """Elementos do primeiro seletor que encontrar algum; lista vazia se nenhum encontrar"""
+        return self._buscar(elemento, lambda seletor: contexto.find_elements(*seletor)) or []
+
+    def status(self):
+        with self._lock:
+            return {
+                elemento: {
+                    'seletor_atual': (
+                        self.seletores[elemento][self._vencedor[elemento]][1]
+                        if elemento in self._vencedor else None
+                    ),
+                    'primario_falhando': elemento in self._primario_falhando,
+                    'buscas': self._buscas[elemento],
+                    'falhas': self._falhas[elemento],
+                    'tentativas_por_busca': (
+                        round(self._tentativas[elemento] / self._buscas[elemento], 2)
+                        if self._buscas[elemento] else None
+                    ),
+                    'latencia_media_ms': (
+                        round(self._segundos[elemento] / self._buscas[elemento] * 1000, 1)
+                        if self._buscas[elemento] else None
+                    ),
+                    'vitorias': {
+                        seletor[1]: self._vitorias[(elemento, indice)]
+                        for indice, seletor in enumerate(self.seletores[elemento])
+                        if self._vitorias[(elemento, indice)]
+                    },
+                }
+                for elemento in self.seletores
+            }
+
+
+_registro = None
+_registro_lock = threading.Lock()
+
+
+def get_registro_seletores():
+    """Instância única por processo, compartilhada entre todas as sessões"""
+    global _registro
+    if _registro is None:
+        with _registro_lock:
+            if _registro is None:
+                _registro = RegistroSeletores(SELETORES)
+    return _registro
@@ -0,0 +1,43 @@
+# backend/api/signals.py
+"""
+Invalidação do cache das listagens (api/cache.py) a cada alteração.
+
+Atualizações em massa (QuerySet.update, bulk_create) não disparam estes
+sinais e precisam chamar cache_api.invalidar diretamente.
+
+Também remove do disco o PDF de cada fatura apagada, inclusive quando a
+remoção vem em cascata do cliente ou da UC.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache as cache_api
+from .models import Customer, UnidadeConsumidora, Fatura
+
+
+@receiver([post_save, post_delete], sender=Customer)
+def invalidar_cliente(sender, instance, **kwargs):
+    cache_api.invalidar(cache_api.CLIENTES)
+    cache_api.invalidar(cache_api.CLIENTE, instance.pk)
+
+
+@receiver([post_save, post_delete], sender=UnidadeConsumidora)
+def invalidar_uc(sender, instance, **kwargs):
+    cache_api.invalidar(cache_api.UCS, instance.customer_id)
+    # A listagem de faturas traz o código da UC
+    cache_api.invalidar(cache_api.FATURAS, instance.customer_id)
+
+
+@receiver([post_save, post_delete], sender=Fatura)
+def invalidar_fatura(sender, instance, **kwargs):
+    cache_api.invalidar(cache_api.FATURAS, instance.customer_id)
+
+
+@receiver(post_delete, sender=Fatura)
+def remover_arquivo_fatura(sender, instance, **kwargs):
+    if not instance.arquivo:
+        return
+    storage, nome = instance.arquivo.storage, instance.arquivo.name
+    # Só depois do commit: se a transação for desfeita, a fatura continua com o arquivo
+    transaction.on_commit(lambda: storage.delete(nome))
@@ -0,0 +1,225 @@
+# backend/api/streaming.py
+"""
+Geradores para respostas em streaming (StreamingHttpResponse).
+
+Os arquivos (ZIP, CSV e XLSX) são montados sob demanda, em pedaços, sem
+arquivo temporário e com uso de memória constante, qualquer que seja o
+tamanho total.
+"""
+import csv
+import io
+import logging
+import os
+import re
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _SaidaStreaming(io.RawIOBase):
+    """
+    Destino de escrita não-posicionável para o ZipFile. Acumula apenas o que
+    foi escrito desde a última leitura; o ZipFile passa a usar data descriptors
+    por não conseguir voltar no arquivo.
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def consumir(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _escrever_zip(entradas):
+    """
+    Gera um ZIP em pedaços a partir de `entradas`, um iterável de
+    (nome_no_zip, date_time, compressao, pedacos), em que `pedacos` é um
+    iterável de bytes com o conteúdo da entrada.
+    """
+    saida = _SaidaStreaming()
+    with zipfile.ZipFile(saida, 'w', allowZip64=True) as zf:
+        for nome, date_time, compressao, pedacos in entradas:
+            info = zipfile.ZipInfo(nome, date_time=date_time)
+            info.compress_type = compressao
+            with zf.open(info, 'w', force_zip64=True) as destino:
+                for pedaco in pedacos:
+                    destino.write(pedaco)
+                    dados = saida.consumir()
+                    if dados:
+                        yield dados
+            # Data descriptor da entrada
+            yield saida.consumir()
+    # Diretório central
+    yield saida.consumir()
+
+
+def _ler_arquivo(caminho, chunk_size):
+    with open(caminho, 'rb') as origem:
+        while True:
+            chunk = origem.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def gerar_zip(entradas, chunk_size=CHUNK_SIZE):
+    """
+    Gera um ZIP em pedaços a partir de `entradas`, um iterável de
+    (nome_no_zip, caminho_no_disco, date_time). Os PDFs já são comprimidos,
+    então as entradas são armazenadas sem compressão (ZIP_STORED).
+    """
+    def arquivos():
+        for nome, caminho, date_time in entradas:
+            if not os.path.isfile(caminho):
+                logger.warning(f"Arquivo ausente no disco, ignorado no ZIP: {caminho}")
+                continue
+            yield nome, date_time, zipfile.ZIP_STORED, _ler_arquivo(caminho, chunk_size)
+
+    return _escrever_zip(arquivos())
+
+
+class _Eco:
+    """Destino do csv.writer que devolve a linha escrita em vez de guardá-la"""
+
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(cabecalho, linhas):
+    """CSV em UTF-8 (com BOM, para o Excel reconhecer a codificação), uma linha por pedaço"""
+    escritor = csv.writer(_Eco())
+    yield '\ufeff'.encode('utf-8') + escritor.writerow(cabecalho).encode('utf-8')
+    for linha in linhas:
+        yield escritor.writerow(['' if valor is None else valor for valor in linha]).encode('utf-8')
+
+
+# Partes fixas de um XLSX com uma única planilha
+_XLSX_FIXOS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilo 1: data (formato embutido 14); estilo 2: número com duas casas (formato embutido 4)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="4">'
+        '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="4" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '</cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_EPOCA_EXCEL = date(1899, 12, 30)
+# Caracteres de controle não são permitidos em XML 1.0
+_CONTROLE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _celula(valor, estilo=None):
+    if valor is None:
+        return '<c/>'
+    if isinstance(valor, datetime):
+        valor = valor.date()
+    if isinstance(valor, date):
+        return f'<c s="1"><v>{(valor - _EPOCA_EXCEL).days}</v></c>'
+    if isinstance(valor, (int, float, Decimal)) and not isinstance(valor, bool):
+        atributo = f' s="{estilo}"' if estilo else ''
+        return f'<c{atributo}><v>{valor}</v></c>'
+    texto = escape(_CONTROLE.sub('', str(valor)))
+    atributo = f' s="{estilo}"' if estilo else ''
+    return f'<c t="inlineStr"{atributo}><is><t xml:space="preserve">{texto}</t></is></c>'
+
+
+def _planilha(cabecalho, linhas, linhas_por_pedaco):
+    yield (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<sheetViews><sheetView workbookViewId="0">'
+        '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+        '</sheetView></sheetViews><sheetData>'
+        '<row>' + ''.join(_celula(titulo, estilo=3) for titulo in cabecalho) + '</row>'
+    ).encode('utf-8')
+    pedaco = []
+    for linha in linhas:
+        pedaco.append('<row>' + ''.join(
+            # Valores monetários (Decimal) com duas casas
+            _celula(valor, estilo=2 if isinstance(valor, Decimal) else None) for valor in linha
+        ) + '</row>')
+        if len(pedaco) >= linhas_por_pedaco:
+            yield ''.join(pedaco).encode('utf-8')
+            pedaco.clear()
+    yield (''.join(pedaco) + '</sheetData></worksheet>').encode('utf-8')
+
+
+def gerar_xlsx(cabecalho, linhas, nome_planilha='Planilha', linhas_por_pedaco=500):
+    """
+    Planilha XLSX em streaming: o XML da planilha é escrito linha a linha
+    (strings inline, sem tabela de strings compartilhadas) e comprimido dentro
+    do ZIP à medida que é gerado. Datas e números viram células tipadas.
+    """
+    agora = datetime.now().timetuple()[:6]
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{escape(nome_planilha[:31])}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    )
+
+    def entradas():
+        for nome, conteudo in _XLSX_FIXOS.items():
+            yield nome, agora, zipfile.ZIP_DEFLATED, [conteudo.encode('utf-8')]
+        yield 'xl/workbook.xml', agora, zipfile.ZIP_DEFLATED, [workbook.encode('utf-8')]
+        yield 'xl/worksheets/sheet1.xml', agora, zipfile.ZIP_DEFLATED, _planilha(cabecalho, linhas, linhas_por_pedaco)
+
+    return _escrever_zip(entradas())
@@ -1,3 +1,1060 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import tempfile
+import zipfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+from .models import (
+    Customer, UnidadeConsumidora, Fatura, FaturaTask, FaturaLog, FaturaResultado, FaturaTexto, ProcessadorNode
+)
+from . import arquivos, logs
+from .management.commands import agendar_importacoes
+from .services import armazenamento, busca, importacao, integridade, processadores, relatorios
+from .services.cancelamento import ImportacaoCancelada
+from .services.controle_portal import (
+    ConcorrenciaAdaptativa, ControlePortal, PortalBloqueadoError, PortalIndisponivelError
+)
+from .services.equatorial_service_improved import (
+    EquatorialService, calcular_numero_sessoes, particionar_ucs, processar_faturas_em_paralelo
+)
+from .services.seletores import RegistroSeletores
+from .services.processadores import AnelConsistente
+
+
+class PlanoConsultasTests(TestCase):
+    """
+    Garante que as consultas quentes dos endpoints usam índice. O EXPLAIN é
+    capturado sobre uma massa de dados grande o bastante para o planejador
+    preferir varredura completa se o índice não existir.
+    """
+    CLIENTES = 20
+    UCS_POR_CLIENTE = 10
+    MESES = 24
+
+    @classmethod
+    def setUpTestData(cls):
+        clientes = Customer.objects.bulk_create([
+            Customer(nome=f"Cliente {i}", cpf=f"{i:011d}", endereco="Rua A") for i in range(cls.CLIENTES)
+        ])
+        ucs = UnidadeConsumidora.objects.bulk_create([
+            UnidadeConsumidora(
+                customer=cliente, codigo=f"{cliente.id}{j:04d}", endereco="Rua A",
+                # Uma UC encerrada por cliente, para o filtro de UCs ativas ser seletivo
+                data_vigencia_fim=date(2024, 1, 1) if j == 0 else None,
+            )
+            for cliente in clientes for j in range(cls.UCS_POR_CLIENTE)
+        ])
+        inicio = date(2023, 1, 1)
+        Fatura.objects.bulk_create([
+            Fatura(
+                id=f"{uc.codigo}_{m}", customer_id=uc.customer_id, unidade_consumidora=uc,
+                mes_referencia=(inicio + timedelta(days=31 * m)).replace(day=1),
+                arquivo=f"faturas/{uc.codigo}_{m}.pdf",
+            )
+            for uc in ucs for m in range(cls.MESES)
+        ])
+        FaturaTask.objects.bulk_create([
+            FaturaTask(customer_id=uc.customer_id, unidade_consumidora=uc, status=status)
+            for uc in ucs for status in ('completed', 'cancelled', 'completed', 'pending')
+        ])
+        FaturaLog.objects.bulk_create([
+            FaturaLog(cpf_titular=cliente.cpf, customer=cliente) for cliente in clientes for _ in range(30)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        cls.customer = clientes[0]
+        cls.uc = ucs[1]
+
+    def assertUsaIndice(self, queryset, ordenado=False):
+        plano = queryset.explain()
+        tabela = queryset.model._meta.db_table
+        if connection.vendor == 'sqlite':
+            # "SCAN tabela" (inclusive "SCAN tabela USING INDEX") percorre a tabela ou o índice inteiro
+            self.assertIsNone(re.search(rf"\bSCAN {tabela}\b", plano), f"Varredura completa em {tabela}:\n{plano}")
+            if ordenado:
+                self.assertNotIn("USE TEMP B-TREE FOR ORDER BY", plano, f"Ordenação sem índice:\n{plano}")
+        else:
+            self.assertNotIn(f"Seq Scan on {tabela}", plano, f"Varredura completa em {tabela}:\n{plano}")
+
+    def test_task_em_aberto_da_uc(self):
+        # start_fatura_import
+        self.assertUsaIndice(FaturaTask.objects.filter(
+            customer=self.customer, unidade_consumidora=self.uc, status__in=['pending', 'failed']
+        ))
+        # process_faturas
+        self.assertUsaIndice(FaturaTask.objects.filter(
+            customer=self.customer, unidade_consumidora=self.uc, status='pending'
+        ))
+
+    def test_ultimas_tasks(self):
+        self.assertUsaIndice(
+            FaturaTask.objects.filter(customer=self.customer).order_by('-created_at')[:10], ordenado=True
+        )
+
+    def test_faturas_do_cliente(self):
+        self.assertUsaIndice(
+            Fatura.objects.filter(customer=self.customer).order_by('-mes_referencia'), ordenado=True
+        )
+
+    def test_ucs_ativas(self):
+        self.assertUsaIndice(self.customer.unidades_consumidoras.filter(data_vigencia_fim__isnull=True))
+
+    def test_ultimos_logs(self):
+        self.assertUsaIndice(
+            FaturaLog.objects.filter(customer=self.customer).order_by('-created_at')[:10], ordenado=True
+        )
+
+
+class AnelConsistenteTests(TestCase):
+    """Distribuição dos clientes entre as instâncias do task_processor"""
+    CHAVES = [f"{i:011d}" for i in range(3000)]
+
+    @staticmethod
+    def _no(nome, capacidade=1):
+        return ProcessadorNode(nome=nome, url='', capacidade=capacidade, ultimo_heartbeat=timezone.now())
+
+    def _distribuicao(self, nos):
+        anel = AnelConsistente(nos)
+        return {chave: anel.no_para(chave).nome for chave in self.CHAVES}
+
+    def test_anel_vazio(self):
+        self.assertIsNone(AnelConsistente([]).no_para('123'))
+
+    def test_peso_proporcional_a_capacidade(self):
+        contagem = Counter(self._distribuicao([self._no('a', 1), self._no('b', 3)]).values())
+        fracao = contagem['b'] / len(self.CHAVES)
+        self.assertGreater(fracao, 0.65)
+        self.assertLess(fracao, 0.85)
+
+    def test_entrada_de_no_so_move_clientes_para_ele(self):
+        antes = self._distribuicao([self._no('a', 2), self._no('b', 2)])
+        depois = self._distribuicao([self._no('a', 2), self._no('b', 2), self._no('c', 2)])
+        movidos = [chave for chave in self.CHAVES if antes[chave] != depois[chave]]
+        self.assertTrue(movidos)
+        self.assertTrue(all(depois[chave] == 'c' for chave in movidos))
+        # Cerca de um terço dos clientes, não uma redistribuição completa
+        self.assertLess(len(movidos) / len(self.CHAVES), 0.45)
+
+
+class AssumirJobsOrfaosTests(TestCase):
+    """Redistribuição dos jobs de instâncias sem heartbeat"""
+
+    def setUp(self):
+        agora = timezone.now()
+        ProcessadorNode.objects.create(nome='viva-1', url='', capacidade=2, ultimo_heartbeat=agora)
+        ProcessadorNode.objects.create(nome='viva-2', url='', capacidade=2, ultimo_heartbeat=agora)
+        ProcessadorNode.objects.create(
+            nome='morta', url='', capacidade=2,
+            ultimo_heartbeat=agora - timedelta(seconds=settings.PROCESSADOR_HEARTBEAT_TIMEOUT + 60)
+        )
+        self.clientes = []
+        for i in range(10):
+            cliente = Customer.objects.create(nome=f"Cliente {i}", cpf=f"{i:011d}", endereco="Rua A")
+            uc = UnidadeConsumidora.objects.create(customer=cliente, codigo=f"9{i:04d}", endereco="Rua A")
+            FaturaTask.objects.create(customer=cliente, unidade_consumidora=uc, status='processing', processador='morta')
+            self.clientes.append(cliente)
+
+    def test_cada_job_assumido_por_uma_so_instancia(self):
+        assumidos_1 = processadores.assumir_jobs_orfaos('viva-1')
+        assumidos_2 = processadores.assumir_jobs_orfaos('viva-2')
+        self.assertEqual(sorted(assumidos_1 + assumidos_2), sorted(cliente.pk for cliente in self.clientes))
+        self.assertFalse(set(assumidos_1) & set(assumidos_2))
+        anel = AnelConsistente(processadores.nos_ativos())
+        for task in FaturaTask.objects.all():
+            self.assertEqual(task.status, 'pending')
+            self.assertEqual(task.processador, anel.no_para(task.customer.cpf).nome)
+        # Uma segunda chamada não encontra mais órfãos
+        self.assertEqual(processadores.assumir_jobs_orfaos('viva-1'), [])
+
+    def test_instancia_sem_heartbeat_nao_assume(self):
+        self.assertEqual(processadores.assumir_jobs_orfaos('morta'), [])
+        self.assertFalse(FaturaTask.objects.exclude(processador='morta').exists())
+
+    def test_instancia_antiga_perde_a_posse(self):
+        cliente = self.clientes[0]
+        tasks = FaturaTask.objects.filter(customer=cliente)
+        processadores.verificar_posse(tasks, 'morta')
+        processadores.assumir_jobs_orfaos('viva-1')
+        processadores.assumir_jobs_orfaos('viva-2')
+        with self.assertRaises(processadores.JobAssumidoError):
+            processadores.verificar_posse(tasks, 'morta')
+
+
+class CriarTasksConcorrenteTests(TransactionTestCase):
+    """Disparos simultâneos da importação do mesmo cliente"""
+    DISPAROS = 6
+
+    def setUp(self):
+        self.customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        for i in range(3):
+            UnidadeConsumidora.objects.create(customer=self.customer, codigo=f"8{i:04d}", endereco="Rua A")
+
+    def _disparar(self, barreira, resultados):
+        try:
+            barreira.wait()
+            with transaction.atomic():
+                importacao.criar_tasks(self.customer, self.customer.unidades_consumidoras.all())
+                # Mantém a transação aberta para os outros disparos a encontrarem em andamento
+                time.sleep(0.2)
+            resultados.append('criadas')
+        except importacao.ImportacaoEmAndamento:
+            resultados.append('em_andamento')
+        except Exception as e:
+            resultados.append(f"{type(e).__name__}: {e}")
+        finally:
+            connection.close()
+
+    def test_um_so_job_sem_erro_de_banco_travado(self):
+        barreira = threading.Barrier(self.DISPAROS)
+        resultados = []
+        threads = [
+            threading.Thread(target=self._disparar, args=(barreira, resultados))
+            for _ in range(self.DISPAROS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(resultados), ['criadas'] + ['em_andamento'] * (self.DISPAROS - 1))
+        self.assertEqual(FaturaTask.objects.filter(customer=self.customer, status='pending').count(), 3)
+
+
+class RebaixarPendentesTests(TestCase):
+    """Faturas corrompidas ou ausentes voltam à fila enquanto não forem baixadas de novo"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        self.uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo="70001", endereco="Rua A")
+        self.fatura = Fatura.objects.create(
+            id="70001-2024-01", customer=self.customer, unidade_consumidora=self.uc,
+            mes_referencia=date(2024, 1, 1), arquivo="faturas/inexistente.pdf",
+            estado_arquivo='corrompido', verificado_em=timezone.now(),
+        )
+
+    def test_pendentes_sem_task_aberta(self):
+        self.assertEqual(
+            integridade.pendentes_de_download(),
+            {self.fatura.pk: (self.customer.pk, self.uc.pk, date(2024, 1, 1))}
+        )
+        task = FaturaTask.objects.create(customer=self.customer, unidade_consumidora=self.uc, status='pending')
+        self.assertEqual(integridade.pendentes_de_download(), {})
+        # Uma task com falha não impede o novo download
+        task.status = 'failed'
+        task.save()
+        self.assertIn(self.fatura.pk, integridade.pendentes_de_download())
+
+    def test_ausente_relida_a_cada_execucao(self):
+        # Verificada agora: só volta à verificação depois de INTEGRIDADE_REVERIFICAR_DIAS...
+        self.assertFalse(integridade._pendentes().filter(pk=self.fatura.pk).exists())
+        # ...a não ser que o arquivo esteja ausente
+        Fatura.objects.filter(pk=self.fatura.pk).update(estado_arquivo='ausente')
+        self.assertTrue(integridade._pendentes().filter(pk=self.fatura.pk).exists())
+
+
+class BuscaTrechoTests(TestCase):
+    """O trecho da busca textual é texto do PDF: só as tags de destaque podem chegar como HTML"""
+
+    def test_trecho_escapado(self):
+        customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        uc = UnidadeConsumidora.objects.create(customer=customer, codigo="60001", endereco="Rua A")
+        fatura = Fatura.objects.create(
+            id="60001-2024-01", customer=customer, unidade_consumidora=uc,
+            mes_referencia=date(2024, 1, 1), arquivo="faturas/60001.pdf",
+        )
+        FaturaTexto.objects.create(fatura=fatura, conteudo='Titular <img src=x onerror=alert(1)> consumo & energia')
+        [(encontrada, _, trecho)] = busca.buscar('energia')
+        self.assertEqual(encontrada, fatura)
+        self.assertEqual(trecho, 'Titular &lt;img src=x onerror=alert(1)&gt; consumo &amp; <mark>energia</mark>')
+
+
+class ControlePortalTests(TestCase):
+    """Transições do circuit breaker do portal"""
+
+    def _controle(self, pausa=0.05):
+        return ControlePortal(
+            taxa=1000, rajada=1000, sessoes_inicial=2, sessoes_min=1, sessoes_max=4,
+            latencia_alvo=10, limiar_falhas=1, pausa=pausa, pausa_maxima=1,
+        )
+
+    def _abrir_e_aguardar_teste(self, controle):
+        with self.assertRaises(PortalBloqueadoError):
+            with controle.requisicao():
+                raise PortalBloqueadoError("bloqueado")
+        self.assertEqual(controle.circuito.estado, 'aberto')
+        time.sleep(0.06)
+        self.assertEqual(controle.circuito.estado, 'meio_aberto')
+
+    def _assert_teste_liberado(self, controle):
+        self.assertEqual(controle.circuito.estado, 'meio_aberto')
+        self.assertTrue(controle.aguardar_portal(timeout=1))
+        # A requisição seguinte vira o novo teste e fecha o circuito
+        with controle.requisicao():
+            pass
+        self.assertEqual(controle.circuito.estado, 'fechado')
+
+    def test_abre_no_limiar_e_fecha_com_o_teste_bem_sucedido(self):
+        controle = ControlePortal(
+            taxa=1000, rajada=1000, sessoes_inicial=2, sessoes_min=1, sessoes_max=4,
+            latencia_alvo=10, limiar_falhas=2, pausa=0.3, pausa_maxima=1,
+        )
+        with self.assertRaises(PortalBloqueadoError):
+            with controle.requisicao():
+                raise PortalBloqueadoError("bloqueado")
+        self.assertEqual(controle.circuito.estado, 'fechado')
+        with self.assertRaises(PortalBloqueadoError):
+            with controle.requisicao():
+                raise PortalBloqueadoError("bloqueado")
+        self.assertEqual(controle.circuito.estado, 'aberto')
+        # Com o circuito aberto nenhuma requisição passa
+        with self.assertRaises(PortalIndisponivelError):
+            with controle.requisicao():
+                pass
+        self.assertFalse(controle.aguardar_portal(timeout=0.01))
+
+        self.assertTrue(controle.aguardar_portal(timeout=1))
+        self.assertEqual(controle.circuito.estado, 'meio_aberto')
+        self.assertTrue(controle.circuito.permite())
+        # Uma só requisição de teste por vez
+        self.assertFalse(controle.circuito.permite())
+        controle.circuito.registrar_sucesso()
+        self.assertEqual(controle.circuito.estado, 'fechado')
+
+    def test_teste_com_falha_reabre_com_o_dobro_da_pausa(self):
+        controle = self._controle(pausa=0.1)
+        with self.assertRaises(PortalBloqueadoError):
+            with controle.requisicao():
+                raise PortalBloqueadoError("bloqueado")
+        time.sleep(0.15)
+        with self.assertRaises(TimeoutException):
+            with controle.requisicao():
+                raise TimeoutException("lento")
+        self.assertEqual(controle.circuito.estado, 'aberto')
+        self.assertAlmostEqual(controle.circuito._pausa, 0.2)
+        time.sleep(0.1)
+        self.assertEqual(controle.circuito.estado, 'aberto')
+        time.sleep(0.15)
+        self.assertEqual(controle.circuito.estado, 'meio_aberto')
+
+    def test_teste_com_erro_fora_do_portal_libera_a_vaga(self):
+        controle = self._controle()
+        self._abrir_e_aguardar_teste(controle)
+        with self.assertRaises(NoSuchElementException):
+            with controle.requisicao():
+                raise NoSuchElementException("elemento")
+        self._assert_teste_liberado(controle)
+
+    def test_teste_cancelado_libera_a_vaga(self):
+        controle = self._controle()
+        self._abrir_e_aguardar_teste(controle)
+        with self.assertRaises(ImportacaoCancelada):
+            with controle.requisicao():
+                raise ImportacaoCancelada("cancelado")
+        self._assert_teste_liberado(controle)
+
+    def test_teste_com_navegador_fechado_de_proposito_libera_a_vaga(self):
+        controle = self._controle()
+        self._abrir_e_aguardar_teste(controle)
+        with self.assertRaises(PortalBloqueadoError):
+            with controle.requisicao(interrompida=lambda: True):
+                raise PortalBloqueadoError("navegador fechado")
+        self._assert_teste_liberado(controle)
+
+
+class UcsDoPortalTests(TestCase):
+    """Descoberta das UCs do titular no dropdown do portal"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        UnidadeConsumidora.objects.create(customer=self.customer, codigo="50001", endereco="Rua A")
+        self.chave = f"equatorial:ucs_portal:{self.customer.cpf}"
+        self.addCleanup(cache.delete, self.chave)
+
+    def test_ucs_novas_cadastradas_com_o_dropdown_em_cache(self):
+        cache.set(self.chave, ["50001", "50002"], 60)
+        service = EquatorialService(self.customer.pk, descobrir_ucs=True)
+        # Com o cache válido o dropdown não é lido
+        service.get_all_ucs_from_dropdown = lambda: self.fail("dropdown lido com o cache válido")
+
+        self.assertEqual(service._ucs_do_portal(), ["50001", "50002"])
+        nova = UnidadeConsumidora.objects.get(customer=self.customer, codigo="50002")
+        self.assertTrue(FaturaTask.objects.filter(unidade_consumidora=nova, status='pending').exists())
+
+    def test_sem_descoberta_nada_e_cadastrado(self):
+        cache.set(self.chave, ["50001", "50002"], 60)
+        service = EquatorialService(self.customer.pk, descobrir_ucs=False)
+        self.assertEqual(service._ucs_do_portal(), ["50001", "50002"])
+        self.assertFalse(UnidadeConsumidora.objects.filter(codigo="50002").exists())
+
+
+class CancelamentoPeloBancoTests(TestCase):
+    """Um cancelamento gravado pela view vale mesmo sem o aviso ao task_processor"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        self.tasks = []
+        for codigo in ("40001", "40002"):
+            uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo=codigo, endereco="Rua A")
+            self.tasks.append(FaturaTask.objects.create(customer=self.customer, unidade_consumidora=uc, status='pending'))
+        self.log = FaturaLog.objects.create(customer=self.customer, ucs_encontradas=["40001", "40002"])
+        self.service = EquatorialService(self.customer.pk, fatura_log=self.log)
+        # Sem navegador: só o fluxo das tasks é exercitado
+        self.service.driver = mock.MagicMock()
+        self.service._aguardar = lambda segundos: None
+        self.service._navegar = lambda url: None
+        self.service.set_emission_type = lambda *args: True
+        self.service.set_emission_reason = lambda *args: True
+        patcher = mock.patch('api.services.equatorial_service_improved.Select')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _cancelar_como_a_view(self):
+        FaturaTask.objects.filter(customer=self.customer, status__in=['pending', 'processing']).update(
+            status='cancelled', error_message='Cancelada pelo usuário', completed_at=timezone.now()
+        )
+
+    def test_cancelamento_sobrevive_a_conclusao_da_uc(self):
+        self.service.extract_and_download_invoices = lambda uc, task=None: self._cancelar_como_a_view()
+        with self.assertRaises(ImportacaoCancelada):
+            self.service.process_faturas()
+        self.assertEqual(
+            list(FaturaTask.objects.order_by('pk').values_list('status', flat=True)), ['cancelled', 'cancelled']
+        )
+
+    def test_cancelamento_verificado_antes_da_proxima_uc(self):
+        self.service.extract_and_download_invoices = lambda uc, task=None: None
+        self.service._navegar = lambda url: self._cancelar_como_a_view()
+        with self.assertRaises(ImportacaoCancelada):
+            self.service.process_faturas()
+        self.assertEqual(
+            list(FaturaTask.objects.order_by('pk').values_list('status', flat=True)), ['completed', 'cancelled']
+        )
+
+
+class ProfilingStreamingTests(TestCase):
+    """O perfil de uma resposta em streaming cobre a geração do corpo"""
+
+    def test_perfil_termina_com_o_corpo(self):
+        customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        uc = UnidadeConsumidora.objects.create(customer=customer, codigo="30001", endereco="Rua A")
+        Fatura.objects.create(
+            id="30001-2024-01", customer=customer, unidade_consumidora=uc,
+            mes_referencia=date(2024, 1, 1), arquivo="faturas/30001.pdf",
+        )
+        with tempfile.TemporaryDirectory() as pasta, \
+                override_settings(PROFILING_DIR=pasta, PROFILING_HEADER_HABILITADO=True):
+            response = self.client.get('/api/faturas/exportar/', headers={'X-Profile': '1'})
+            caminho = os.path.join(pasta, f"{response['X-Profile-Id']}.json")
+            self.assertFalse(os.path.exists(caminho))
+
+            corpo = b''.join(response.streaming_content)
+            self.assertIn(b'30001', corpo)
+            with open(caminho, encoding='utf-8') as arquivo:
+                perfil = json.load(arquivo)
+        self.assertTrue(perfil['streaming'])
+        # As consultas da exportação rodam enquanto o corpo é gerado
+        self.assertTrue(any('api_fatura' in consulta['sql'] for consulta in perfil['sql']['mais_lentas']))
+
+
+class ConcorrenciaAdaptativaTests(TestCase):
+    """Limite de sessões simultâneas ajustado por AIMD"""
+
+    def _concorrencia(self, **kwargs):
+        return ConcorrenciaAdaptativa(
+            inicial=4, minimo=1, maximo=5, latencia_alvo=2, sucessos_para_aumentar=3, intervalo_reducao=30,
+            **kwargs
+        )
+
+    def test_aumento_aditivo_ate_o_maximo(self):
+        concorrencia = self._concorrencia()
+        for _ in range(3):
+            concorrencia.registrar_sucesso(latencia=0.5)
+        self.assertEqual(concorrencia.limite, 5)
+        for _ in range(3):
+            concorrencia.registrar_sucesso(latencia=0.5)
+        self.assertEqual(concorrencia.limite, 5)
+
+    def test_reducao_multiplicativa_uma_vez_por_onda_de_erros(self):
+        concorrencia = self._concorrencia()
+        concorrencia._ultima_reducao = -1000
+        concorrencia.registrar_erro()
+        self.assertEqual(concorrencia.limite, 2)
+        # Erros seguidos dentro de intervalo_reducao não reduzem de novo
+        concorrencia.registrar_erro()
+        self.assertEqual(concorrencia.limite, 2)
+
+    def test_latencia_acima_do_alvo_conta_como_erro(self):
+        concorrencia = self._concorrencia()
+        concorrencia._ultima_reducao = -1000
+        concorrencia.registrar_sucesso(latencia=5)
+        self.assertEqual(concorrencia.limite, 2)
+
+    def test_lote_respeita_as_vagas_reservadas(self):
+        concorrencia = self._concorrencia(reservadas_interativas=1)
+        for _ in range(3):
+            self.assertTrue(concorrencia.adquirir(timeout=0, faixa='lote'))
+        # A última vaga fica para uma sessão interativa
+        self.assertFalse(concorrencia.adquirir(timeout=0, faixa='lote'))
+        self.assertTrue(concorrencia.adquirir(timeout=0, faixa='interativa'))
+        self.assertEqual(concorrencia.em_uso_por_faixa(), {'interativa': 1, 'lote': 3})
+
+
+class RegistroSeletoresTests(TestCase):
+    """Aprendizado do seletor vencedor de cada elemento do portal"""
+    SELETORES = {
+        'botao': [
+            ('css selector', '#primario'),
+            ('css selector', '.alternativa'),
+            ('css selector', 'button'),
+        ],
+    }
+
+    class Pagina:
+        def __init__(self, existentes):
+            self.existentes = existentes
+            self.buscas = []
+
+        def find_element(self, by, valor):
+            self.buscas.append(valor)
+            if valor not in self.existentes:
+                raise NoSuchElementException(valor)
+            return valor
+
+    def setUp(self):
+        cache.clear()
+
+    def test_alternativa_aprendida_e_compartilhada(self):
+        self.assertEqual(RegistroSeletores(self.SELETORES).localizar(self.Pagina({'.alternativa'}), 'botao'), '.alternativa')
+        # Outra instância (outro processador) lê o vencedor do cache e o tenta primeiro
+        pagina = self.Pagina({'.alternativa'})
+        RegistroSeletores(self.SELETORES).localizar(pagina, 'botao')
+        self.assertEqual(pagina.buscas, ['.alternativa'])
+
+    def test_seletor_generico_nunca_aprendido(self):
+        registro = RegistroSeletores({'botao': [
+            ('css selector', '#primario'),
+            ('css selector', 'button'),
+        ]})
+        self.assertEqual(registro.localizar(self.Pagina({'button'}), 'botao'), 'button')
+        self.assertIsNone(cache.get('equatorial:seletor:botao'))
+        pagina = self.Pagina({'#primario', 'button'})
+        self.assertEqual(registro.localizar(pagina, 'botao'), '#primario')
+        self.assertEqual(pagina.buscas, ['#primario'])
+
+    def test_nenhum_seletor_encontra(self):
+        registro = RegistroSeletores(self.SELETORES)
+        with self.assertRaises(NoSuchElementException):
+            registro.localizar(self.Pagina(set()), 'botao')
+        self.assertEqual(registro.status()['botao']['falhas'], 1)
+
+
+@override_settings(EQUATORIAL_MAX_SESSOES_POR_CLIENTE=3, EQUATORIAL_MIN_UCS_POR_SESSAO=4,
+                   EQUATORIAL_INTERVALO_ENTRE_SESSOES=0)
+class SessoesParalelasTests(TestCase):
+    """Divisão das UCs de um cliente entre sessões paralelas do navegador"""
+
+    def test_numero_de_sessoes(self):
+        self.assertEqual(calcular_numero_sessoes(1), 1)
+        self.assertEqual(calcular_numero_sessoes(4), 1)
+        self.assertEqual(calcular_numero_sessoes(5), 2)
+        self.assertEqual(calcular_numero_sessoes(50), 3)
+        self.assertEqual(calcular_numero_sessoes(50, max_sessoes=1), 1)
+
+    def test_particoes_equilibradas(self):
+        particoes = particionar_ucs([str(i) for i in range(7)], 3)
+        self.assertEqual(particoes, [['0', '3', '6'], ['1', '4'], ['2', '5']])
+        self.assertEqual(particionar_ucs(['0'], 3), [['0']])
+
+
+@override_settings(EQUATORIAL_MAX_SESSOES_POR_CLIENTE=3, EQUATORIAL_MIN_UCS_POR_SESSAO=4,
+                   EQUATORIAL_INTERVALO_ENTRE_SESSOES=0)
+class ProcessarEmParaleloTests(TransactionTestCase):
+    """As sessões rodam em threads, cada uma com a sua conexão: os dados precisam estar gravados"""
+
+    def test_cada_uc_pendente_em_uma_so_sessao(self):
+        customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        for i in range(10):
+            uc = UnidadeConsumidora.objects.create(customer=customer, codigo=f"2{i:04d}", endereco="Rua A")
+            FaturaTask.objects.create(customer=customer, unidade_consumidora=uc, status='completed' if i < 2 else 'pending')
+
+        sessoes = []
+
+        def processar(service):
+            sessoes.append(list(service.uc_codes))
+            service.ucs_encontradas = list(service.uc_codes)
+            return True
+
+        log = FaturaLog.objects.create(customer=customer)
+        with mock.patch.object(EquatorialService, 'processar_todas_faturas', processar):
+            self.assertTrue(processar_faturas_em_paralelo(customer.pk, fatura_log=log))
+
+        # As concluídas ficam de fora: 8 pendentes em 2 sessões
+        self.assertEqual(len(sessoes), 2)
+        ucs = [uc for sessao in sessoes for uc in sessao]
+        self.assertEqual(sorted(ucs), [f"2{i:04d}" for i in range(2, 10)])
+        log.refresh_from_db()
+        self.assertEqual(sorted(log.ucs_encontradas), sorted(ucs))
+
+
+class CheckpointTests(TestCase):
+    """Retomada de uma UC a partir dos meses já concluídos da task"""
+
+    def setUp(self):
+        self.customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A")
+        self.uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo="10001", endereco="Rua A")
+        self.task = FaturaTask.objects.create(
+            customer=self.customer, unidade_consumidora=self.uc, status='processing', meses_concluidos=['2025-06']
+        )
+        self.log = FaturaLog.objects.create(customer=self.customer)
+        self.service = EquatorialService(self.customer.pk, fatura_log=self.log)
+
+    @staticmethod
+    def _linha(mes):
+        linha = mock.MagicMock()
+        linha.find_element.return_value.text = mes
+        return linha
+
+    def test_meses_concluidos_e_existentes_nao_sao_baixados(self):
+        Fatura.objects.create(
+            id="10001_05_2025", customer=self.customer, unidade_consumidora=self.uc,
+            mes_referencia=date(2025, 5, 1), arquivo="faturas/10001_05_2025.pdf",
+        )
+        linhas = [self._linha("06/2025"), self._linha("05/2025")]
+        self.service.seletores = mock.Mock(localizar_todos=mock.Mock(return_value=linhas))
+
+        self.service.extract_and_download_invoices(self.uc, task=self.task)
+
+        # Só a coluna do mês foi lida: nenhum link de download foi procurado
+        for linha in linhas:
+            linha.find_element.assert_called_once_with('xpath', "./td[1]")
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.meses_concluidos, ['2025-06', '2025-05'])
+        self.assertEqual(
+            list(FaturaResultado.objects.filter(fatura_log=self.log).values_list('status', flat=True)),
+            ['existente', 'existente']
+        )
+
+    def test_checkpoint_gravado_uma_vez(self):
+        self.service._registrar_checkpoint(self.task, '2025-07')
+        self.service._registrar_checkpoint(self.task, '2025-07')
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.meses_concluidos, ['2025-06', '2025-07'])
+
+
+class ArquivosDeFaturaMixin:
+    """Faturas com PDFs reais em um MEDIA_ROOT temporário"""
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.media_root = pasta.name
+        configuracao = override_settings(MEDIA_ROOT=self.media_root)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.customer = Customer.objects.create(nome="Cliente Teste", cpf="12345678901", endereco="Rua A")
+        self.uc = UnidadeConsumidora.objects.create(customer=self.customer, codigo="20001", endereco="Rua A")
+
+    def _fatura(self, mes, conteudo=b'%PDF-1.4 fatura %%EOF'):
+        nome = f"faturas/20001_{mes:%m_%Y}.pdf"
+        os.makedirs(os.path.join(self.media_root, 'faturas'), exist_ok=True)
+        with open(os.path.join(self.media_root, nome), 'wb') as arquivo:
+            arquivo.write(conteudo)
+        return Fatura.objects.create(
+            id=f"20001_{mes:%m_%Y}", customer=self.customer, unidade_consumidora=self.uc,
+            mes_referencia=mes, arquivo=nome, valor=100, vencimento=mes + timedelta(days=20),
+        )
+
+
+class ZipFaturasTests(ArquivosDeFaturaMixin, TestCase):
+    """ZIP em streaming com os PDFs do cliente"""
+
+    def test_zip_com_os_pdfs_filtrados(self):
+        self._fatura(date(2025, 1, 1), b'%PDF-janeiro')
+        self._fatura(date(2025, 2, 1), b'%PDF-fevereiro')
+        self._fatura(date(2025, 3, 1), b'%PDF-marco')
+
+        response = self.client.get(
+            f'/api/customers/{self.customer.pk}/faturas/zip/', {'inicio': '2025-02', 'fim': '2025-03'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as arquivo_zip:
+            self.assertIsNone(arquivo_zip.testzip())
+            self.assertEqual(arquivo_zip.namelist(), ['20001/20001_02_2025.pdf', '20001/20001_03_2025.pdf'])
+            self.assertEqual(arquivo_zip.read('20001/20001_03_2025.pdf'), b'%PDF-marco')
+
+    def test_zip_em_lote_separado_por_cliente(self):
+        self._fatura(date(2025, 1, 1))
+        response = self.client.get('/api/faturas/zip/', {'customers': str(self.customer.pk)})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as arquivo_zip:
+            self.assertEqual(
+                arquivo_zip.namelist(), [f"{self.customer.pk}_cliente-teste/20001/20001_01_2025.pdf"]
+            )
+
+
+class EntregaProtegidaTests(ArquivosDeFaturaMixin, TestCase):
+    """PDFs entregues por URL assinada, via X-Accel-Redirect quando há nginx"""
+
+    def setUp(self):
+        super().setUp()
+        self.fatura = self._fatura(date(2025, 1, 1), b'%PDF-conteudo')
+        self.url = f'/api/faturas/{self.fatura.id}/arquivo/'
+
+    def test_token_invalido_ou_de_outra_fatura(self):
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(self.url, {'token': 'x:y'}).status_code, 403)
+        self.assertEqual(self.client.get(self.url, {'token': arquivos.assinar('outra')}).status_code, 403)
+
+    @override_settings(MEDIA_URL_VALIDADE_SEGUNDOS=-1)
+    def test_token_expirado(self):
+        self.assertEqual(self.client.get(self.url, {'token': arquivos.assinar(self.fatura.id)}).status_code, 403)
+
+    @override_settings(MEDIA_X_ACCEL_REDIRECT=True)
+    def test_envio_delegado_ao_nginx(self):
+        response = self.client.get(self.url, {'token': arquivos.assinar(self.fatura.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/faturas/20001_01_2025.pdf')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(MEDIA_X_ACCEL_REDIRECT=False)
+    def test_envio_pelo_django_sem_nginx(self):
+        response = self.client.get(self.url, {'token': arquivos.assinar(self.fatura.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-conteudo')
+
+
+class ExportacaoFaturasTests(TestCase):
+    """Planilha das faturas de todos os clientes, em streaming"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for i, nome in enumerate(["Ana", "Bruno"]):
+            customer = Customer.objects.create(nome=nome, cpf=f"0000000000{i}", endereco="Rua A")
+            uc = UnidadeConsumidora.objects.create(customer=customer, codigo=f"9900{i}", endereco="Rua A")
+            for mes in (2, 1):
+                Fatura.objects.create(
+                    id=f"9900{i}_{mes:02d}_2025", customer=customer, unidade_consumidora=uc,
+                    mes_referencia=date(2025, mes, 1), arquivo=f"faturas/9900{i}_{mes:02d}_2025.pdf",
+                    valor=f"{mes}10.50", vencimento=None,
+                )
+
+    def _linhas_csv(self, **params):
+        response = self.client.get('/api/faturas/exportar/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        conteudo = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.reader(io.StringIO(conteudo)))
+
+    def test_csv_ordenado_por_cliente_uc_e_mes(self):
+        linhas = self._linhas_csv()
+        self.assertEqual(linhas[0][:4], ['Cliente ID', 'Cliente', 'CPF', 'UC'])
+        self.assertEqual([linha[7] for linha in linhas[1:]],
+                         ['99000_01_2025', '99000_02_2025', '99001_01_2025', '99001_02_2025'])
+        self.assertEqual(linhas[1][4:7], ['2025-01-01', '110.50', ''])
+
+    def test_filtros_de_cliente_e_periodo(self):
+        ana = Customer.objects.get(nome="Ana")
+        linhas = self._linhas_csv(customers=str(ana.pk), inicio='2025-02')
+        self.assertEqual([linha[7] for linha in linhas[1:]], ['99000_02_2025'])
+
+    def test_xlsx_valido(self):
+        response = self.client.get('/api/faturas/exportar/', {'formato': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as planilha:
+            self.assertIsNone(planilha.testzip())
+            folha = planilha.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertIn('99001_02_2025', folha)
+        self.assertIn('Bruno', folha)
+
+    def test_formato_invalido(self):
+        self.assertEqual(self.client.get('/api/faturas/exportar/', {'formato': 'pdf'}).status_code, 400)
+
+
+class AgendadorImportacoesTests(TestCase):
+    """Varredura periódica que espalha as importações incrementais na janela"""
+
+    def test_mes_esperado(self):
+        self.assertEqual(agendar_importacoes.mes_esperado(date(2025, 3, 15), meses_atras=1), date(2025, 2, 1))
+        self.assertEqual(agendar_importacoes.mes_esperado(date(2025, 1, 5), meses_atras=2), date(2024, 11, 1))
+
+    def test_disparos_espalhados_na_janela(self):
+        self.assertEqual(agendar_importacoes.distribuir(0, 3600, 0.5), [])
+        self.assertEqual(agendar_importacoes.distribuir(4, 100, 0), [0, 25, 50, 75])
+        instantes = agendar_importacoes.distribuir(50, 3600, 1)
+        self.assertEqual(len(instantes), 50)
+        self.assertEqual(instantes, sorted(instantes))
+        self.assertTrue(all(0 <= instante <= 3600 for instante in instantes))
+        # Com jitter, cada disparo fica a no máximo meio espaçamento da sua posição
+        self.assertTrue(all(abs(instante - i * 72) <= 36 for i, instante in enumerate(instantes)))
+
+    def test_enfileira_so_as_ucs_sem_a_fatura_do_mes(self):
+        customer = Customer.objects.create(nome="Cliente", cpf="12345678901", endereco="Rua A",
+                                           data_nascimento=date(1980, 1, 1))
+        com_fatura = UnidadeConsumidora.objects.create(customer=customer, codigo="80001", endereco="Rua A")
+        sem_fatura = UnidadeConsumidora.objects.create(customer=customer, codigo="80002", endereco="Rua A")
+        Fatura.objects.create(id="80001_02_2025", customer=customer, unidade_consumidora=com_fatura,
+                              mes_referencia=date(2025, 2, 1), arquivo="faturas/80001_02_2025.pdf")
+        comando = agendar_importacoes.Command()
+
+        with mock.patch.object(importacao, 'despachar') as despachar:
+            self.assertEqual(comando.enfileirar(customer.pk, date(2025, 2, 1)), 1)
+            # Com a importação em andamento, o cliente não é enfileirado de novo
+            self.assertEqual(comando.enfileirar(customer.pk, date(2025, 2, 1)), 0)
+
+        despachar.assert_called_once()
+        task = FaturaTask.objects.get(customer=customer)
+        self.assertEqual((task.unidade_consumidora, task.status, task.prioridade), (sem_fatura, 'pending', 'lote'))
+
+
+class RelatorioTests(ArquivosDeFaturaMixin, TestCase):
+    """Relatório consolidado em cache pela impressão digital das faturas"""
+
+    def setUp(self):
+        super().setUp()
+        self.pool = mock.Mock()
+        self.pool.submit.side_effect = lambda *args: Future()
+        patcher = mock.patch.object(relatorios, '_get_pool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _faturas(self):
+        return Fatura.objects.filter(customer=self.customer)
+
+    def _gerar(self, nome):
+        """Conclui a geração pendente de `nome` como o processo do pool faria"""
+        future = relatorios._em_andamento[nome]
+        with open(os.path.join(self.media_root, nome), 'wb') as arquivo:
+            arquivo.write(b'%PDF-relatorio')
+        future.set_result(None)
+
+    def test_impressao_digital_muda_com_os_dados_ou_o_pdf(self):
+        fatura = self._fatura(date(2025, 1, 1))
+        dados = relatorios._dados_faturas(self._faturas())
+        impressao = relatorios._impressao_digital(dados)
+        self.assertEqual(relatorios._impressao_digital(relatorios._dados_faturas(self._faturas())), impressao)
+
+        Fatura.objects.filter(pk=fatura.pk).update(valor=150)
+        self.assertNotEqual(relatorios._impressao_digital(relatorios._dados_faturas(self._faturas())), impressao)
+
+        os.remove(dados[0]['caminho'])
+        self.assertNotEqual(relatorios._impressao_digital(dados), impressao)
+
+    def test_periodo(self):
+        self.assertEqual(relatorios._periodo(date(2025, 1, 1), date(2025, 3, 1)), ('202501-202503', '01/2025 a 03/2025'))
+        self.assertEqual(relatorios._periodo(None, None), ('inicio-fim', 'todas as faturas'))
+
+    def test_pedidos_simultaneos_aguardam_a_mesma_geracao(self):
+        self._fatura(date(2025, 1, 1))
+
+        self.assertIsNone(relatorios.obter_relatorio(self.customer, self._faturas(), espera=0))
+        self.assertIsNone(relatorios.obter_relatorio(self.customer, self._faturas(), espera=0))
+        self.assertEqual(self.pool.submit.call_count, 1)
+
+        nome, = relatorios._em_andamento
+        self._gerar(nome)
+        self.assertNotIn(nome, relatorios._em_andamento)
+        # Pronto, o arquivo é servido sem nova geração
+        self.assertEqual(relatorios.obter_relatorio(self.customer, self._faturas(), espera=0), nome)
+        self.assertEqual(self.pool.submit.call_count, 1)
+
+    def test_fatura_alterada_gera_nova_versao_e_remove_a_anterior(self):
+        fatura = self._fatura(date(2025, 1, 1))
+        relatorios.obter_relatorio(self.customer, self._faturas(), espera=0)
+        anterior, = relatorios._em_andamento
+        self._gerar(anterior)
+
+        Fatura.objects.filter(pk=fatura.pk).update(valor=150)
+        self.assertIsNone(relatorios.obter_relatorio(self.customer, self._faturas(), espera=0))
+        atual, = relatorios._em_andamento
+        self.assertNotEqual(atual, anterior)
+        self._gerar(atual)
+
+        pasta = os.path.join(self.media_root, relatorios.PASTA, str(self.customer.pk))
+        self.assertEqual(os.listdir(pasta), [os.path.basename(atual)])
+
+    def test_geracao_concluida_antes_do_callback_nao_trava(self):
+        self._fatura(date(2025, 1, 1))
+
+        def submit(funcao, destino, *args):
+            with open(destino, 'wb') as arquivo:
+                arquivo.write(b'%PDF-relatorio')
+            future = Future()
+            future.set_result(None)
+            return future
+
+        self.pool.submit.side_effect = submit
+        nome = relatorios.obter_relatorio(self.customer, self._faturas(), espera=0)
+        self.assertTrue(os.path.isfile(os.path.join(self.media_root, nome)))
+        self.assertEqual(relatorios._em_andamento, {})
+
+
+class ReconciliacaoArmazenamentoTests(ArquivosDeFaturaMixin, TestCase):
+    """Reconciliação entre os PDFs em MEDIA_ROOT e as linhas de Fatura"""
+
+    def _arquivo(self, nome, conteudo=b'%PDF-orfao', idade=3600):
+        caminho = os.path.join(self.media_root, nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        instante = time.time() - idade
+        os.utime(caminho, (instante, instante))
+        os.utime(os.path.dirname(caminho), (instante, instante))
+        return caminho
+
+    def test_remove_so_os_orfaos_fora_da_carencia(self):
+        fatura = self._fatura(date(2025, 1, 1))
+        antigo = self._arquivo('faturas/2024/12/20001_12_2024.pdf')
+        recente = self._arquivo('faturas/2024/11/20001_11_2024.pdf', idade=0)
+
+        verificados, orfaos, liberados = armazenamento.limpar_orfaos(lote=1, carencia=60)
+
+        self.assertEqual((verificados, orfaos, liberados), (3, 1, len(b'%PDF-orfao')))
+        self.assertFalse(os.path.exists(antigo))
+        self.assertFalse(os.path.exists(os.path.dirname(antigo)))
+        self.assertTrue(os.path.exists(recente))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, fatura.arquivo.name)))
+
+    def test_dry_run_nao_altera_nada(self):
+        self._fatura(date(2025, 1, 1))
+        orfao = self._arquivo('faturas/2024/12/20001_12_2024.pdf')
+        temporario = self._arquivo('temp_faturas/sessao/parcial.pdf')
+
+        resumo = armazenamento.reconciliar(carencia=60, dry_run=True)
+
+        self.assertEqual((resumo['orfaos'], resumo['temporarios']), (1, 1))
+        self.assertTrue(os.path.exists(orfao))
+        self.assertTrue(os.path.exists(temporario))
+
+    def test_marca_ausentes_e_recuperadas(self):
+        fatura = self._fatura(date(2025, 1, 1))
+        caminho = os.path.join(self.media_root, fatura.arquivo.name)
+        os.rename(caminho, caminho + '.bak')
+
+        self.assertEqual(armazenamento.marcar_ausentes(), (1, 0))
+        fatura.refresh_from_db()
+        self.assertEqual(fatura.estado_arquivo, 'ausente')
+        # Já marcada, não conta de novo
+        self.assertEqual(armazenamento.marcar_ausentes(), (0, 0))
+
+        os.rename(caminho + '.bak', caminho)
+        self.assertEqual(armazenamento.marcar_ausentes(), (0, 1))
+        fatura.refresh_from_db()
+        self.assertEqual(fatura.estado_arquivo, 'ok')
+
+    def test_limpa_downloads_abandonados(self):
+        abandonado = self._arquivo('temp_faturas/sessao_antiga/parcial.pdf')
+        em_andamento = self._arquivo('temp_faturas/sessao_atual/parcial.pdf')
+        # A pasta da sessão atual é antiga, mas um arquivo dela foi modificado agora
+        os.utime(em_andamento)
+
+        self.assertEqual(armazenamento.limpar_temporarios(carencia=60), (1, len(b'%PDF-orfao')))
+        self.assertFalse(os.path.exists(os.path.dirname(abandonado)))
+        self.assertTrue(os.path.exists(em_andamento))
+
+    def test_remove_relatorios_de_clientes_apagados(self):
+        self._arquivo(f'relatorios/{self.customer.pk}/inicio-fim_abc.pdf')
+        removido = self._arquivo(f'relatorios/{self.customer.pk + 1}/inicio-fim_abc.pdf')
+
+        self.assertEqual(armazenamento.limpar_relatorios(), 1)
+        self.assertFalse(os.path.exists(os.path.dirname(removido)))
+        self.assertTrue(os.path.isdir(os.path.join(self.media_root, 'relatorios', str(self.customer.pk))))
+
+    def test_migra_o_layout_antigo(self):
+        self._arquivo('faturas/JAN-2025/20001_01_2025.pdf', b'%PDF-legado')
+        fatura = Fatura.objects.create(
+            id='20001_01_2025', customer=self.customer, unidade_consumidora=self.uc,
+            mes_referencia=date(2025, 1, 1), arquivo='faturas/JAN-2025/20001_01_2025.pdf',
+        )
+
+        self.assertEqual(armazenamento.migrar_legado(), 1)
+        fatura.refresh_from_db()
+        self.assertEqual(fatura.arquivo.name, 'faturas/2025/01/20001_01_2025.pdf')
+        with open(os.path.join(self.media_root, fatura.arquivo.name), 'rb') as arquivo:
+            self.assertEqual(arquivo.read(), b'%PDF-legado')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'faturas/JAN-2025/20001_01_2025.pdf')))
+
+
+class LogsEstruturadosTests(TestCase):
+    """Registros em JSON com o contexto do job, emitidos por uma fila"""
+
+    def setUp(self):
+        self.fila = queue.SimpleQueue()
+        self.saida = io.StringIO()
+        escrita = logging.StreamHandler(self.saida)
+        escrita.setFormatter(logs.JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.fila, escrita)
+        self.listener.start()
+        self.parado = False
+        self.addCleanup(self._parar)
+
+        em_fila = logs._FilaHandler(self.fila)
+        em_fila.addFilter(logs.ContextoFilter())
+        self.logger = logging.getLogger('api.tests.logs_estruturados')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.handlers = [em_fila]
+        self.addCleanup(setattr, self.logger, 'handlers', [])
+
+    def _parar(self):
+        # Esvazia a fila antes de ler a saída
+        if not self.parado:
+            self.parado = True
+            self.listener.stop()
+
+    def _registros(self):
+        self._parar()
+        return [json.loads(linha) for linha in self.saida.getvalue().splitlines()]
+
+    def test_registro_em_json_com_o_contexto_do_job(self):
+        with logs.contexto_log(job='job-1', customer=7):
+            with logs.contexto_log(uc='30001'):
+                self.logger.info("Baixando %s", "fatura")
+            self.logger.warning("Fim da UC")
+        self.logger.info("Fora do job")
+
+        dentro_uc, fora_uc, fora_job = self._registros()
+        self.assertEqual(dentro_uc['msg'], "Baixando fatura")
+        self.assertEqual((dentro_uc['job'], dentro_uc['customer'], dentro_uc['uc']), ('job-1', 7, '30001'))
+        self.assertEqual((fora_uc['level'], fora_uc['job']), ('WARNING', 'job-1'))
+        self.assertNotIn('uc', fora_uc)
+        self.assertNotIn('job', fora_job)
+        self.assertEqual(logs.contexto_atual(), {})
+
+    def test_traceback_fora_da_mensagem(self):
+        try:
+            raise ValueError("seletor mudou")
+        except ValueError:
+            self.logger.exception("Falha na UC")
+
+        registro, = self._registros()
+        self.assertEqual(registro['msg'], "Falha na UC")
+        self.assertIn("ValueError: seletor mudou", registro['exc'])
+
+    def test_contexto_copiado_para_outra_thread(self):
+        with logs.contexto_log(job='job-2'):
+            contexto = logs.copiar_contexto()
+        sessao = threading.Thread(target=contexto.run, args=(self.logger.info, "Sessão paralela"))
+        sessao.start()
+        sessao.join()
+
+        registro, = self._registros()
+        self.assertEqual(registro['job'], 'job-2')
+        self.assertNotEqual(registro['thread'], threading.current_thread().name)
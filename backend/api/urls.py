@@ -11,7 +11,20 @@ urlpatterns = [
     
     # Novas rotas para faturas
     path('customers/<int:customer_id>/faturas/import/', views.start_fatura_import, name='start_fatura_import'),
+    path('customers/<int:customer_id>/faturas/import/cancel/', views.cancel_fatura_import, name='cancel_fatura_import'),
     path('customers/<int:customer_id>/faturas/tasks/', views.get_fatura_tasks, name='get_fatura_tasks'),
     path('customers/<int:customer_id>/faturas/', views.get_faturas, name='get_faturas'),
     path('customers/<int:customer_id>/faturas/logs/', views.get_fatura_logs, name='get_fatura_logs'),
+    path('customers/<int:customer_id>/faturas/logs/resumo/', views.get_fatura_logs_resumo, name='get_fatura_logs_resumo'),
+    path('faturas/resultados/', views.get_fatura_resultados, name='get_fatura_resultados'),
+    path('customers/<int:customer_id>/faturas/zip/', views.download_faturas_zip, name='download_faturas_zip'),
+    path('customers/<int:customer_id>/relatorio/', views.relatorio_cliente, name='relatorio_cliente'),
+    path('faturas/zip/', views.download_faturas_zip_lote, name='download_faturas_zip_lote'),
+    path('faturas/exportar/', views.exportar_faturas, name='exportar_faturas'),
+    path('faturas/busca/', views.buscar_faturas, name='buscar_faturas'),
+    path('faturas/<str:fatura_id>/arquivo/', views.fatura_arquivo, name='fatura_arquivo'),
+    path('faturas/tasks/<int:task_id>/snapshots/', views.get_task_snapshots, name='get_task_snapshots'),
+    path('faturas/snapshots/<path:snapshot_id>/<str:nome>/', views.snapshot_arquivo, name='snapshot_arquivo'),
+    path('cache/status/', views.cache_status, name='cache_status'),
+    path('processadores/status/', views.processadores_status, name='processadores_status'),
 ]
\ No newline at end of file
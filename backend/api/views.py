@@ -2,13 +2,26 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Customer, UnidadeConsumidora, FaturaTask, Fatura, FaturaLog
+from .models import Customer, UnidadeConsumidora, FaturaTask, Fatura, FaturaLog, FaturaResultado, IdempotencyKey, ProcessadorNode
 from rest_framework import serializers
 from django.utils import timezone
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, Prefetch, Q, Sum
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.text import slugify
+from datetime import datetime, timedelta
+import logging
 import threading
 import requests # Adicionado para fazer requisições HTTP
 from .services.equatorial_service_improved import EquatorialService
+from .services import artefatos, busca, exportacao, importacao, processadores, relatorios
+from .streaming import gerar_zip
+from . import arquivos
+from . import cache as cache_api
+
+logger = logging.getLogger(__name__)
 
 class CustomerSerializer(serializers.ModelSerializer):
     data_nascimento = serializers.DateField(format='%Y-%m-%d', input_formats=['%Y-%m-%d', '%d/%m/%Y'])
@@ -16,7 +29,7 @@ class CustomerSerializer(serializers.ModelSerializer):
     class Meta:
         model = Customer
         fields = ['id', 'nome', 'cpf', 'cpf_titular', 'data_nascimento', 
-                  'endereco', 'telefone', 'email', 'created_at', 'updated_at']
+                  'endereco', 'telefone', 'email', 'descobrir_ucs', 'created_at', 'updated_at']
 
 class UnidadeConsumidoraSerializer(serializers.ModelSerializer):
     is_active = serializers.ReadOnlyField()
@@ -31,9 +44,11 @@ class UnidadeConsumidoraSerializer(serializers.ModelSerializer):
 @api_view(['GET', 'POST'])
 def customer_list(request):
     if request.method == 'GET':
-        customers = Customer.objects.all()
-        serializer = CustomerSerializer(customers, many=True)
-        return Response(serializer.data)
+        dados = cache_api.obter(
+            cache_api.CLIENTES, None,
+            lambda: CustomerSerializer(Customer.objects.all(), many=True).data
+        )
+        return Response(dados)
 
     elif request.method == 'POST':
         serializer = CustomerSerializer(data=request.data)
@@ -44,16 +59,22 @@ def customer_list(request):
 
 @api_view(['GET', 'PUT', 'DELETE'])
 def customer_detail(request, pk):
+    if request.method == 'GET':
+        try:
+            dados = cache_api.obter(
+                cache_api.CLIENTE, pk,
+                lambda: CustomerSerializer(Customer.objects.get(pk=pk)).data
+            )
+        except Customer.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(dados)
+
     try:
         customer = Customer.objects.get(pk=pk)
     except Customer.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == 'GET':
-        serializer = CustomerSerializer(customer)
-        return Response(serializer.data)
-
-    elif request.method == 'PUT':
+    if request.method == 'PUT':
         serializer = CustomerSerializer(customer, data=request.data)
         if serializer.is_valid():
             serializer.save()
@@ -66,17 +87,24 @@ def customer_detail(request, pk):
 
 @api_view(['GET', 'POST'])
 def uc_list(request, customer_id):
+    if request.method == 'GET':
+        def calcular():
+            customer = Customer.objects.get(pk=customer_id)
+            ucs = UnidadeConsumidora.objects.filter(customer=customer)
+            return UnidadeConsumidoraSerializer(ucs, many=True).data
+
+        try:
+            dados = cache_api.obter(cache_api.UCS, customer_id, calcular)
+        except Customer.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(dados)
+
     try:
         customer = Customer.objects.get(pk=customer_id)
     except Customer.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
     
-    if request.method == 'GET':
-        ucs = UnidadeConsumidora.objects.filter(customer=customer)
-        serializer = UnidadeConsumidoraSerializer(ucs, many=True)
-        return Response(serializer.data)
-    
-    elif request.method == 'POST':
+    if request.method == 'POST':
         data = request.data.copy()
         data['customer'] = customer_id
         serializer = UnidadeConsumidoraSerializer(data=data)
@@ -139,12 +167,13 @@ class FaturaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Fatura
         fields = ['id', 'unidade_consumidora', 'unidade_consumidora_codigo', 'mes_referencia', 'arquivo', 
-                  'arquivo_url', 'valor', 'vencimento', 'downloaded_at']
+                  'arquivo_url', 'valor', 'vencimento', 'downloaded_at', 'estado_arquivo']
     
     def get_arquivo_url(self, obj):
         if obj.arquivo:
-            # Corrigido para retornar a URL relativa correta
-            return obj.arquivo.url
+            # URL assinada do endpoint protegido; o arquivo não é mais servido publicamente em /media/
+            url = reverse('fatura_arquivo', args=[obj.id])
+            return f"{url}?token={arquivos.assinar(obj.id)}"
         return None
 
 
@@ -154,7 +183,37 @@ class FaturaTaskSerializer(serializers.ModelSerializer):
     class Meta:
         model = FaturaTask
         fields = ['id', 'unidade_consumidora', 'unidade_consumidora_codigo', 
-                  'status', 'created_at', 'completed_at', 'error_message']
+                  'status', 'prioridade', 'created_at', 'completed_at', 'error_message',
+                  'tentativas', 'proxima_tentativa_em', 'meses']
+
+
+class FaturaResultadoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = FaturaResultado
+        fields = ['id', 'fatura_log', 'customer', 'uc_codigo', 'mes_referencia', 'mes_texto',
+                  'status', 'erro', 'duracao_ms', 'tamanho_bytes', 'created_at']
+
+
+def _registrar_resposta_idempotente(registro, data, status_code):
+    """Guarda a resposta da requisição original para ser devolvida nas repetições da mesma chave"""
+    if registro is not None:
+        registro.status_code = status_code
+        registro.resposta = data
+        registro.save(update_fields=['status_code', 'resposta'])
+    return Response(data, status=status_code)
+
+
+def _importacao_em_andamento(customer, registro=None):
+    """Resposta para um disparo que chegou com um job do cliente já na fila ou em execução"""
+    # O usuário está esperando: um job em lote do cliente passa para a faixa interativa
+    importacao.promover(customer)
+    tasks = FaturaTask.objects.filter(customer=customer, status__in=['pending', 'processing'])
+    data = {
+        "message": "Já existe uma importação em andamento para este cliente.",
+        "coalesced": True,
+        "tasks": FaturaTaskSerializer(tasks, many=True).data
+    }
+    return _registrar_resposta_idempotente(registro, data, status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -162,10 +221,30 @@ def start_fatura_import(request, customer_id):
     """
     Inicia o processo de importação de faturas.
     Esta view agora delega a tarefa de scraping para o serviço task_processor.
-    Lógica aprimorada para evitar tarefas duplicadas.
+
+    Um disparo que chega enquanto o cliente já tem um job na fila ou em
+    execução devolve as tasks desse job, sem acionar outro navegador. Com o
+    header Idempotency-Key, repetições da mesma requisição recebem a resposta
+    original.
     """
     try:
         customer = Customer.objects.get(pk=customer_id)
+
+        chave = request.headers.get('Idempotency-Key')
+        if chave:
+            validade = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_VALIDADE_HORAS)
+            anterior = IdempotencyKey.objects.filter(
+                customer=customer, chave=chave, created_at__gte=validade
+            ).first()
+            if anterior is not None:
+                if anterior.status_code is None:
+                    return Response(
+                        {"error": "Uma requisição com esta Idempotency-Key ainda está em processamento"},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                return Response(anterior.resposta, status=anterior.status_code)
+            # Chave expirada: libera para um novo uso
+            IdempotencyKey.objects.filter(customer=customer, chave=chave).delete()
         
         # Validações de dados do cliente
         if not customer.data_nascimento:
@@ -188,57 +267,41 @@ def start_fatura_import(request, customer_id):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Lógica robusta para criar ou reutilizar tasks
-        tasks = []
-        with transaction.atomic():
-            for uc in active_ucs:
-                # Procura por uma tarefa existente para esta UC que possa ser reutilizada (pendente ou falha)
-                task = FaturaTask.objects.filter(
-                    customer=customer,
-                    unidade_consumidora=uc,
-                    status__in=['pending', 'failed']
-                ).first()
-
-                if task:
-                    # Se encontrou, reseta o estado dela para ser executada novamente
-                    task.status = 'pending'
-                    task.error_message = None
-                    task.completed_at = None
-                    task.save()
-                else:
-                    # Se não encontrou nenhuma tarefa para reutilizar, cria uma nova
-                    task = FaturaTask.objects.create(
-                        customer=customer,
-                        unidade_consumidora=uc,
-                        status='pending'
-                    )
-                tasks.append(task)
+        registro = None
+        try:
+            with transaction.atomic():
+                if chave:
+                    registro = IdempotencyKey.objects.create(customer=customer, chave=chave)
+                tasks = importacao.criar_tasks(customer, active_ucs)
+        except importacao.ImportacaoEmAndamento:
+            # Nada foi criado (a transação foi desfeita); a chave registra a resposta agrupada
+            if chave:
+                registro, _ = IdempotencyKey.objects.get_or_create(customer=customer, chave=chave)
+            return _importacao_em_andamento(customer, registro)
+        except IntegrityError:
+            # Rede de segurança caso o banco não serialize as transações (no SQLite isso é
+            # feito pelo BEGIN IMMEDIATE): as restrições unique_open_task_per_uc e
+            # unique_idempotency_key_per_customer barram o disparo concorrente
+            logger.info(f"Disparo concorrente de importação do cliente {customer_id} agrupado ao job existente")
+            return _importacao_em_andamento(customer)
         
         # Delega a tarefa para o Task Processor
         try:
-            task_processor_url = 'http://host.docker.internal:5001/process-task'
-            response = requests.post(task_processor_url, json={'customer_id': customer_id}, timeout=10)
-            
-            if response.status_code != 202:
-                raise requests.exceptions.RequestException(f"Serviço de automação respondeu com status {response.status_code}")
-
-        except requests.exceptions.RequestException as e:
-            # Se a comunicação com o bot falhar, marca as tarefas como falhas
-            error_msg = f"Não foi possível conectar ao serviço de automação: {e}"
-            for task in tasks:
-                task.status = 'failed'
-                task.error_message = error_msg
-                task.save()
+            importacao.despachar(customer_id, tasks, perfilar=bool(request.data.get('profile')))
+        except importacao.ProcessadorIndisponivelError:
+            # A falha não é memorizada: a mesma chave pode ser usada para tentar de novo
+            if registro is not None:
+                registro.delete()
             return Response(
                 {"error": "Não foi possível iniciar a automação. Verifique se o 'task_processor' está ativo."},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
         
         serializer = FaturaTaskSerializer(tasks, many=True)
-        return Response({
+        return _registrar_resposta_idempotente(registro, {
             "message": "Solicitação de importação enviada para o serviço de automação.",
             "tasks": serializer.data
-        }, status=status.HTTP_202_ACCEPTED)
+        }, status.HTTP_202_ACCEPTED)
         
     except Customer.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
@@ -249,6 +312,48 @@ def start_fatura_import(request, customer_id):
         )
 
 
+@api_view(['POST'])
+def cancel_fatura_import(request, customer_id):
+    """
+    Cancela as tarefas de importação pendentes ou em andamento do cliente.
+    O task_processor é avisado para interromper o job e fechar os navegadores na hora.
+    """
+    try:
+        customer = Customer.objects.get(pk=customer_id)
+    except Customer.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    with transaction.atomic():
+        tasks = FaturaTask.objects.filter(customer=customer, status__in=['pending', 'processing'])
+        task_ids = list(tasks.values_list('id', flat=True))
+        nos = set(tasks.values_list('processador', flat=True))
+        tasks.update(
+            status='cancelled',
+            error_message='Cancelada pelo usuário',
+            completed_at=timezone.now()
+        )
+
+    if not task_ids:
+        return Response(
+            {"error": "Não há importação em andamento para este cliente"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    # O cancelamento já vale pelo banco; o aviso ao processador apenas acelera a liberação do navegador
+    # Avisa a instância que recebeu o job (TASK_PROCESSOR_URL quando não há instâncias registradas)
+    for url in {processadores.url_do_no(nome) for nome in nos}:
+        try:
+            requests.post(f"{url}/cancel-task", json={'customer_id': customer_id}, timeout=5)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Não foi possível avisar o task_processor {url} sobre o cancelamento do cliente {customer_id}: {e}")
+
+    serializer = FaturaTaskSerializer(FaturaTask.objects.filter(id__in=task_ids), many=True)
+    return Response({
+        "message": "Importação cancelada.",
+        "tasks": serializer.data
+    })
+
+
 @api_view(['GET'])
 def get_fatura_tasks(request, customer_id):
     """Retorna o status das tarefas de importação"""
@@ -264,30 +369,352 @@ def get_fatura_tasks(request, customer_id):
 @api_view(['GET'])
 def get_faturas(request, customer_id):
     """Retorna as faturas baixadas do cliente"""
-    try:
+    def calcular():
         customer = Customer.objects.get(pk=customer_id)
-        faturas = Fatura.objects.filter(customer=customer).order_by('-mes_referencia')
-        serializer = FaturaSerializer(faturas, many=True, context={'request': request})
-        return Response(serializer.data)
+        faturas = (
+            Fatura.objects.filter(customer=customer)
+            .select_related('unidade_consumidora')
+            .order_by('-mes_referencia')
+        )
+        return FaturaSerializer(faturas, many=True, context={'request': request}).data
+
+    try:
+        return Response(cache_api.obter(cache_api.FATURAS, customer_id, calcular))
     except Customer.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
 
+@api_view(['GET'])
+def buscar_faturas(request):
+    """Busca textual no conteúdo dos PDFs, com as faturas mais relevantes primeiro e o trecho encontrado"""
+    termo = request.query_params.get('q', '').strip()
+    if not termo:
+        return Response({"error": "Informe o parâmetro q"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limite = min(max(int(request.query_params.get('limite', 20)), 1), 100)
+    except ValueError:
+        return Response({"error": "limite inválido"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        resultados = busca.buscar(termo, limite)
+    except busca.BuscaIndisponivelError as e:
+        return Response({"error": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    return Response([
+        {
+            **FaturaSerializer(fatura, context={'request': request}).data,
+            'customer': fatura.customer_id,
+            'customer_nome': fatura.customer.nome,
+            'relevancia': round(relevancia, 4),
+            'trecho': trecho,
+        }
+        for fatura, relevancia, trecho in resultados
+    ])
+
+
+@api_view(['GET'])
+def get_task_snapshots(request, task_id):
+    """Snapshots de falha (screenshot, DOM e console) capturados durante a task"""
+    if not FaturaTask.objects.filter(pk=task_id).exists():
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    snapshots = artefatos.listar_snapshots(task_id)
+    for snapshot in snapshots:
+        snapshot['urls'] = {
+            nome: reverse('snapshot_arquivo', args=[snapshot['id'], nome]) for nome in snapshot['arquivos']
+        }
+    return Response(snapshots)
+
+
+@api_view(['GET'])
+def snapshot_arquivo(request, snapshot_id, nome):
+    """Entrega um arquivo de um snapshot de falha"""
+    caminho = artefatos.caminho_arquivo(snapshot_id, nome)
+    if caminho is None:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+    return FileResponse(
+        open(caminho, 'rb'),
+        content_type=artefatos.ARQUIVOS[nome],
+        as_attachment=nome.endswith('.gz'),
+        filename=f"{slugify(snapshot_id)}-{nome}"
+    )
+
+
+@api_view(['GET'])
+def cache_status(request):
+    """Taxa de acerto do cache das listagens"""
+    return Response(cache_api.estatisticas())
+
+
+@api_view(['GET'])
+def processadores_status(request):
+    """Instâncias do task_processor registradas, com capacidade e heartbeat"""
+    ativos = {no.nome for no in processadores.nos_ativos()}
+    return Response([
+        {
+            'nome': no.nome,
+            'url': no.url,
+            'capacidade': no.capacidade,
+            'sessoes_em_uso': no.sessoes_em_uso,
+            'ultimo_heartbeat': no.ultimo_heartbeat,
+            'ativo': no.nome in ativos,
+        }
+        for no in ProcessadorNode.objects.all()
+    ])
+
+
+@api_view(['GET'])
+def fatura_arquivo(request, fatura_id):
+    """
+    Entrega o PDF de uma fatura mediante URL assinada. O envio é feito pelo
+    nginx (X-Accel-Redirect), com sendfile, Range e ETag.
+    """
+    if not arquivos.token_valido(fatura_id, request.query_params.get('token')):
+        return Response({"error": "Link inválido ou expirado"}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        fatura = Fatura.objects.only('id', 'arquivo').get(pk=fatura_id)
+    except Fatura.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    if not fatura.arquivo:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    return arquivos.resposta_arquivo(fatura.arquivo.name, 'application/pdf', f"{fatura.id}.pdf")
+
+
 @api_view(['GET'])
 def get_fatura_logs(request, customer_id):
     """Retorna os logs de busca de faturas"""
     try:
         customer = Customer.objects.get(pk=customer_id)
-        logs = FaturaLog.objects.filter(customer=customer).order_by('-created_at')[:10]
+        resultados = FaturaResultado.objects.only(
+            'fatura_log_id', 'uc_codigo', 'mes_texto', 'status', 'erro'
+        ).order_by('uc_codigo', 'mes_referencia')
+        # O JSON legado faturas_encontradas não é mais lido; os resultados vêm da tabela normalizada
+        logs = (
+            FaturaLog.objects.filter(customer=customer)
+            .defer('faturas_encontradas')
+            .order_by('-created_at')
+            .prefetch_related(Prefetch('resultados', queryset=resultados))[:10]
+        )
         data = []
         for log in logs:
+            faturas_encontradas = {}
+            for resultado in log.resultados.all():
+                faturas_encontradas.setdefault(resultado.uc_codigo, []).append({
+                    'mes': resultado.mes_texto,
+                    'status': resultado.status,
+                    'erro': resultado.erro,
+                })
             data.append({
                 'id': log.id,
                 'cpf_titular': log.cpf_titular,
                 'ucs_encontradas': log.ucs_encontradas,
-                'faturas_encontradas': log.faturas_encontradas,
+                'faturas_encontradas': faturas_encontradas,
                 'created_at': log.created_at
             })
         return Response(data)
     except Customer.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def get_fatura_logs_resumo(request, customer_id):
+    """Resumo compacto das últimas buscas: contagem por status, bytes e duração média"""
+    try:
+        customer = Customer.objects.get(pk=customer_id)
+    except Customer.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        limite = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+    except ValueError:
+        return Response({"error": "limit deve ser um número"}, status=status.HTTP_400_BAD_REQUEST)
+    logs = (
+        FaturaLog.objects.filter(customer=customer)
+        .order_by('-created_at')
+        .annotate(
+            baixadas=Count('resultados', filter=Q(resultados__status='criada')),
+            existentes=Count('resultados', filter=Q(resultados__status='existente')),
+            sem_faturas=Count('resultados', filter=Q(resultados__status='sem_faturas')),
+            erros=Count('resultados', filter=Q(resultados__status='erro')),
+            total_bytes=Sum('resultados__tamanho_bytes'),
+            duracao_media_ms=Avg('resultados__duracao_ms'),
+        )
+        .values('id', 'created_at', 'baixadas', 'existentes', 'sem_faturas', 'erros',
+                'total_bytes', 'duracao_media_ms')[:limite]
+    )
+    return Response(list(logs))
+
+
+@api_view(['GET'])
+def get_fatura_resultados(request):
+    """
+    Consulta operacional dos resultados por UC/mês, ex.: ?status=erro&desde=2025-06-01.
+    Filtros: status, customer, uc, desde, ate (YYYY-MM-DD, inclusivos) e limit (1 a 500).
+    """
+    resultados = FaturaResultado.objects.all()
+    params = request.query_params
+    try:
+        if params.get('status'):
+            resultados = resultados.filter(status=params['status'])
+        if params.get('customer'):
+            resultados = resultados.filter(customer_id=int(params['customer']))
+        if params.get('uc'):
+            resultados = resultados.filter(uc_codigo=params['uc'])
+        if params.get('desde'):
+            resultados = resultados.filter(created_at__gte=datetime.strptime(params['desde'], '%Y-%m-%d'))
+        if params.get('ate'):
+            # Até o fim do dia informado
+            ate = datetime.strptime(params['ate'], '%Y-%m-%d') + timedelta(days=1)
+            resultados = resultados.filter(created_at__lt=ate)
+        limite = min(max(int(params.get('limit', 100)), 1), 500)
+    except ValueError:
+        return Response({"error": "Parâmetros inválidos"}, status=status.HTTP_400_BAD_REQUEST)
+
+    serializer = FaturaResultadoSerializer(resultados.order_by('-created_at')[:limite], many=True)
+    return Response(serializer.data)
+
+def _parse_mes(valor):
+    """Converte 'YYYY-MM' no primeiro dia do mês"""
+    return datetime.strptime(valor, '%Y-%m').date()
+
+
+def filtrar_faturas(faturas, params):
+    """
+    Aplica os filtros opcionais da query string: ?uc=<codigo> (pode repetir)
+    e período ?inicio=YYYY-MM&fim=YYYY-MM (inclusivos).
+    """
+    ucs = params.getlist('uc')
+    if ucs:
+        faturas = faturas.filter(unidade_consumidora__codigo__in=ucs)
+    if params.get('inicio'):
+        faturas = faturas.filter(mes_referencia__gte=_parse_mes(params['inicio']))
+    if params.get('fim'):
+        faturas = faturas.filter(mes_referencia__lte=_parse_mes(params['fim']))
+    return faturas
+
+
+def _filtrar_clientes(faturas, params):
+    """Restringe aos clientes de ?customers=1,2,3; sem o parâmetro, mantém todos"""
+    if params.get('customers'):
+        customer_ids = [int(pk) for pk in params['customers'].split(',') if pk.strip()]
+        faturas = faturas.filter(customer_id__in=customer_ids)
+    return faturas
+
+
+def _entradas_zip(faturas, pasta_por_cliente=False):
+    """Percorre as faturas em blocos, sem carregar tudo na memória"""
+    for fatura in faturas.iterator(chunk_size=500):
+        if not fatura.arquivo:
+            continue
+        pasta = fatura.unidade_consumidora.codigo
+        if pasta_por_cliente:
+            pasta = f"{fatura.customer_id}_{slugify(fatura.customer.nome)}/{pasta}"
+        yield f"{pasta}/{fatura.id}.pdf", fatura.arquivo.path, fatura.downloaded_at.timetuple()[:6]
+
+
+def _zip_response(entradas, nome_arquivo):
+    response = StreamingHttpResponse(gerar_zip(entradas), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    # Impede o nginx de acumular a resposta antes de repassá-la ao cliente
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['GET'])
+def download_faturas_zip(request, customer_id):
+    """Baixa em um único ZIP, gerado em streaming, os PDFs das faturas do cliente"""
+    try:
+        customer = Customer.objects.get(pk=customer_id)
+    except Customer.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        faturas = filtrar_faturas(
+            Fatura.objects.filter(customer=customer).select_related('unidade_consumidora'),
+            request.query_params
+        ).order_by('unidade_consumidora__codigo', 'mes_referencia')
+    except ValueError:
+        return Response({"error": "Use o formato YYYY-MM para inicio e fim"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return _zip_response(_entradas_zip(faturas), f"faturas_{customer.id}_{slugify(customer.nome)}.zip")
+
+
+@api_view(['GET'])
+def download_faturas_zip_lote(request):
+    """
+    ZIP em streaming com as faturas de vários clientes (?customers=1,2,3),
+    ou de todos quando o parâmetro é omitido. Aceita os mesmos filtros de UC e período.
+    """
+    faturas = Fatura.objects.select_related('unidade_consumidora', 'customer')
+    try:
+        faturas = _filtrar_clientes(faturas, request.query_params)
+    except ValueError:
+        return Response({"error": "customers deve ser uma lista de IDs separados por vírgula"},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        faturas = filtrar_faturas(faturas, request.query_params).order_by(
+            'customer_id', 'unidade_consumidora__codigo', 'mes_referencia'
+        )
+    except ValueError:
+        return Response({"error": "Use o formato YYYY-MM para inicio e fim"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return _zip_response(_entradas_zip(faturas, pasta_por_cliente=True), "faturas.zip")
+
+
+@api_view(['GET'])
+def relatorio_cliente(request, customer_id):
+    """
+    Relatório consolidado em PDF do cliente: resumo por UC e mês seguido das
+    faturas do período (?inicio=YYYY-MM&fim=YYYY-MM). Servido do cache enquanto
+    as faturas não mudarem; se a geração demorar, responde 202 e o cliente
+    repete a requisição.
+    """
+    try:
+        customer = Customer.objects.get(pk=customer_id)
+    except Customer.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    params = request.query_params
+    try:
+        inicio = _parse_mes(params['inicio']) if params.get('inicio') else None
+        fim = _parse_mes(params['fim']) if params.get('fim') else None
+        faturas = filtrar_faturas(Fatura.objects.filter(customer=customer), params)
+    except ValueError:
+        return Response({"error": "Use o formato YYYY-MM para inicio e fim"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        nome = relatorios.obter_relatorio(customer, faturas, inicio, fim)
+    except Exception as e:
+        logger.error(f"Erro ao gerar o relatório do cliente {customer_id}: {e}")
+        return Response({"error": "Falha ao gerar o relatório"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if nome is None:
+        return Response({"status": "gerando"}, status=status.HTTP_202_ACCEPTED)
+    return arquivos.resposta_arquivo(nome, 'application/pdf', f"relatorio_{customer.id}_{slugify(customer.nome)}.pdf")
+
+
+@api_view(['GET'])
+def exportar_faturas(request):
+    """
+    Planilha com as faturas de todos os clientes (ou de ?customers=1,2,3), em
+    streaming: ?formato=csv (padrão) ou xlsx. Aceita os filtros de UC e período.
+    """
+    formato = request.query_params.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        return Response({"error": "formato deve ser csv ou xlsx"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        faturas = _filtrar_clientes(Fatura.objects.all(), request.query_params)
+    except ValueError:
+        return Response({"error": "customers deve ser uma lista de IDs separados por vírgula"},
+                        status=status.HTTP_400_BAD_REQUEST)
+    try:
+        faturas = filtrar_faturas(faturas, request.query_params)
+    except ValueError:
+        return Response({"error": "Use o formato YYYY-MM para inicio e fim"}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type, _ = exportacao.FORMATOS[formato]
+    response = StreamingHttpResponse(exportacao.gerar(faturas, formato), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="faturas_{datetime.now():%Y%m%d}.{formato}"'
+    response['X-Accel-Buffering'] = 'no'
+    return response
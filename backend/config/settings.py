@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+import socket
+import sys
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -52,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -81,6 +85,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # O SQLite ignora SELECT FOR UPDATE: começar cada transação com BEGIN IMMEDIATE
+            # serializa as escritas concorrentes (como a criação das tasks de importação),
+            # que esperam até `timeout` segundos em vez de falhar com "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Banco de testes em arquivo: o banco em memória compartilhado entre threads
+        # não respeita o timeout e os testes de concorrência falhariam com "locked"
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -129,12 +145,155 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-profile')
+CORS_EXPOSE_HEADERS = ['X-Profile-Id']
 ALLOWED_HOSTS = ['*']  # Only for development
 # backend/config/settings.py - Adicionar ao final do arquivo existente
 
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Os arquivos de mídia não são públicos: o Django autoriza e o nginx entrega via X-Accel-Redirect
+MEDIA_X_ACCEL_REDIRECT = os.environ.get('MEDIA_X_ACCEL_REDIRECT', '0') == '1'
+MEDIA_X_ACCEL_PREFIX = '/protected-media/'
+# Validade (segundos) das URLs assinadas de download
+MEDIA_URL_VALIDADE_SEGUNDOS = int(os.environ.get('MEDIA_URL_VALIDADE_SEGUNDOS', 6 * 3600))
+
+# `manage.py test`
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Cache das listagens da API (api/cache.py). O padrão em arquivo é compartilhado entre os
+# workers e o task_processor (mesmo diretório); com CACHE_REDIS_URL usa Redis (pacote redis).
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+elif TESTING:
+    # Os testes não escrevem no cache em disco compartilhado com os processos em execução
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
+# Validade (segundos) das respostas em cache; menor que a das URLs assinadas que elas contêm
+API_CACHE_TTL = min(int(os.environ.get('API_CACHE_TTL', 300)), MEDIA_URL_VALIDADE_SEGUNDOS // 2)
+
+# Automação do portal da Equatorial
+# Limite de sessões do navegador (cada uma com login próprio) por cliente
+EQUATORIAL_MAX_SESSOES_POR_CLIENTE = int(os.environ.get('EQUATORIAL_MAX_SESSOES_POR_CLIENTE', 3))
+# Quantidade mínima de UCs que justifica abrir mais uma sessão
+EQUATORIAL_MIN_UCS_POR_SESSAO = int(os.environ.get('EQUATORIAL_MIN_UCS_POR_SESSAO', 4))
+# Intervalo (segundos) entre os logins das sessões paralelas
+EQUATORIAL_INTERVALO_ENTRE_SESSOES = float(os.environ.get('EQUATORIAL_INTERVALO_ENTRE_SESSOES', 10))
+# Limitador de taxa (token bucket) para navegações e downloads no portal
+EQUATORIAL_REQUISICOES_POR_SEGUNDO = float(os.environ.get('EQUATORIAL_REQUISICOES_POR_SEGUNDO', 0.5))
+EQUATORIAL_RAJADA_REQUISICOES = int(os.environ.get('EQUATORIAL_RAJADA_REQUISICOES', 3))
+# Sessões simultâneas do navegador no processo, ajustadas por AIMD entre o mínimo e o máximo
+EQUATORIAL_SESSOES_INICIAL = int(os.environ.get('EQUATORIAL_SESSOES_INICIAL', 2))
+EQUATORIAL_SESSOES_MIN = int(os.environ.get('EQUATORIAL_SESSOES_MIN', 1))
+EQUATORIAL_SESSOES_MAX = int(os.environ.get('EQUATORIAL_SESSOES_MAX', 6))
+# Vagas de sessão que as varreduras em lote deixam livres para importações disparadas pelo usuário
+EQUATORIAL_SESSOES_RESERVADAS_INTERATIVAS = int(os.environ.get('EQUATORIAL_SESSOES_RESERVADAS_INTERATIVAS', 1))
+# Latência (segundos) acima da qual uma navegação é tratada como sinal de sobrecarga
+EQUATORIAL_LATENCIA_ALVO = float(os.environ.get('EQUATORIAL_LATENCIA_ALVO', 20))
+# Circuit breaker: falhas consecutivas para abrir e pausa (segundos) antes de testar de novo
+EQUATORIAL_CIRCUITO_LIMIAR_FALHAS = int(os.environ.get('EQUATORIAL_CIRCUITO_LIMIAR_FALHAS', 5))
+EQUATORIAL_CIRCUITO_PAUSA = float(os.environ.get('EQUATORIAL_CIRCUITO_PAUSA', 120))
+EQUATORIAL_CIRCUITO_PAUSA_MAXIMA = float(os.environ.get('EQUATORIAL_CIRCUITO_PAUSA_MAXIMA', 900))
+# Quantas vezes um job pode ser pausado pelo circuito antes de desistir
+EQUATORIAL_MAX_PAUSAS_POR_JOB = int(os.environ.get('EQUATORIAL_MAX_PAUSAS_POR_JOB', 5))
+# Por quanto tempo (segundos) as UCs lidas do dropdown do portal ficam em cache por titular
+EQUATORIAL_UCS_PORTAL_TTL = int(os.environ.get('EQUATORIAL_UCS_PORTAL_TTL', 6 * 3600))
+# Retentativas automáticas das UCs que falharam em um job (backoff exponencial com jitter)
+FATURA_RETRY_MAX_TENTATIVAS = int(os.environ.get('FATURA_RETRY_MAX_TENTATIVAS', 3))
+FATURA_RETRY_BASE_SEGUNDOS = float(os.environ.get('FATURA_RETRY_BASE_SEGUNDOS', 30))
+FATURA_RETRY_MAX_SEGUNDOS = float(os.environ.get('FATURA_RETRY_MAX_SEGUNDOS', 600))
+# Prazos rígidos (segundos) de um job de importação e de cada UC dentro dele
+FATURA_JOB_TIMEOUT_SEGUNDOS = float(os.environ.get('FATURA_JOB_TIMEOUT_SEGUNDOS', 3600))
+FATURA_UC_TIMEOUT_SEGUNDOS = float(os.environ.get('FATURA_UC_TIMEOUT_SEGUNDOS', 600))
+
+# Serviço de automação (task_processor)
+TASK_PROCESSOR_URL = os.environ.get('TASK_PROCESSOR_URL', 'http://host.docker.internal:5001')
+# Identidade desta instância do task_processor quando há várias coordenadas pelo banco
+PROCESSADOR_NOME = os.environ.get('PROCESSADOR_NOME', socket.gethostname())
+# URL pela qual o backend alcança esta instância. Vazia (padrão): a instância não anuncia URL e
+# recebe os jobs por TASK_PROCESSOR_URL, como no processador único rodando fora do Docker
+PROCESSADOR_URL = os.environ.get('PROCESSADOR_URL', '')
+# Sessões de navegador anunciadas pela instância (peso no hashing consistente dos clientes)
+PROCESSADOR_CAPACIDADE = int(os.environ.get('PROCESSADOR_CAPACIDADE', EQUATORIAL_SESSOES_MAX))
+# Intervalo do heartbeat e prazo (segundos) após o qual a instância é dada como morta
+PROCESSADOR_HEARTBEAT_SEGUNDOS = float(os.environ.get('PROCESSADOR_HEARTBEAT_SEGUNDOS', 15))
+PROCESSADOR_HEARTBEAT_TIMEOUT = float(os.environ.get('PROCESSADOR_HEARTBEAT_TIMEOUT', 60))
+# Por quanto tempo (horas) uma Idempotency-Key de importação devolve a resposta original
+IDEMPOTENCY_KEY_VALIDADE_HORAS = int(os.environ.get('IDEMPOTENCY_KEY_VALIDADE_HORAS', 24))
+
+# Logs do task_processor (JSON, com rotação por tamanho)
+TASK_PROCESSOR_LOG_ARQUIVO = os.environ.get('TASK_PROCESSOR_LOG_ARQUIVO', 'task_processor.log')
+TASK_PROCESSOR_LOG_MAX_BYTES = int(os.environ.get('TASK_PROCESSOR_LOG_MAX_BYTES', 10 * 1024 * 1024))
+TASK_PROCESSOR_LOG_BACKUPS = int(os.environ.get('TASK_PROCESSOR_LOG_BACKUPS', 5))
+# Snapshots de falha do scraper (screenshot, DOM e console), fora de MEDIA_ROOT
+ARTEFATOS_DIR = os.environ.get('ARTEFATOS_DIR', os.path.join(BASE_DIR, 'artefatos'))
+# Retenção dos snapshots: idade máxima (dias) e espaço total em disco (bytes)
+SNAPSHOTS_MAX_DIAS = int(os.environ.get('SNAPSHOTS_MAX_DIAS', 14))
+SNAPSHOTS_MAX_BYTES = int(os.environ.get('SNAPSHOTS_MAX_BYTES', 500 * 1024 * 1024))
+
+# Profiling opcional de jobs e requisições (pilhas "folded" para flame graph e SQL)
+PROFILING_DIR = os.environ.get('PROFILING_DIR', os.path.join(BASE_DIR, 'profiling'))
+# Intervalo (segundos) entre amostras das pilhas
+PROFILING_INTERVALO = float(os.environ.get('PROFILING_INTERVALO', 0.01))
+# Fração das requisições perfiladas por sorteio (0 desativa)
+PROFILING_TAXA_AMOSTRAGEM = float(os.environ.get('PROFILING_TAXA_AMOSTRAGEM', 0))
+# Aceita o header X-Profile nas requisições
+PROFILING_HEADER_HABILITADO = os.environ.get('PROFILING_HEADER_HABILITADO', '1' if DEBUG else '0') == '1'
+
+# Agendador periódico de importações (manage.py agendar_importacoes)
+# Cadência das varreduras e janela pela qual os disparos de cada varredura são espalhados
+AGENDADOR_INTERVALO_SEGUNDOS = float(os.environ.get('AGENDADOR_INTERVALO_SEGUNDOS', 24 * 3600))
+AGENDADOR_JANELA_SEGUNDOS = float(os.environ.get('AGENDADOR_JANELA_SEGUNDOS', 6 * 3600))
+# Deslocamento aleatório de cada disparo, como fração do espaçamento entre eles
+AGENDADOR_JITTER = float(os.environ.get('AGENDADOR_JITTER', 0.5))
+# Mês de referência esperado: 0 = mês corrente, 1 = mês anterior
+AGENDADOR_MESES_ATRAS = int(os.environ.get('AGENDADOR_MESES_ATRAS', 0))
+
+# Retenção do histórico de importações (FaturaTask, FaturaLog e FaturaResultado)
+HISTORICO_RETENCAO_DIAS = int(os.environ.get('HISTORICO_RETENCAO_DIAS', 180))
+# Registros mais recentes de cada cliente que nunca são removidos, qualquer que seja a idade
+HISTORICO_MANTER_POR_CLIENTE = int(os.environ.get('HISTORICO_MANTER_POR_CLIENTE', 10))
+# Linhas removidas por transação e pausa (segundos) entre lotes, para não travar as gravações do scraper
+HISTORICO_PURGA_LOTE = int(os.environ.get('HISTORICO_PURGA_LOTE', 500))
+HISTORICO_PURGA_PAUSA = float(os.environ.get('HISTORICO_PURGA_PAUSA', 0.2))
+# Arquivos JSONL comprimidos com o histórico removido (fora de MEDIA_ROOT)
+HISTORICO_ARQUIVO_DIR = os.environ.get('HISTORICO_ARQUIVO_DIR', os.path.join(BASE_DIR, 'arquivo_historico'))
+
+# Relatório consolidado do cliente em PDF (cache em MEDIA_ROOT/relatorios)
+# Processos que montam os relatórios e quanto tempo (segundos) a requisição aguarda antes de responder 202
+RELATORIOS_PROCESSOS = int(os.environ.get('RELATORIOS_PROCESSOS', 2))
+RELATORIO_ESPERA_SEGUNDOS = float(os.environ.get('RELATORIO_ESPERA_SEGUNDOS', 20))
+
+# Reconciliação do armazenamento (manage.py reconciliar_arquivos)
+# Arquivos por consulta ao banco e idade mínima (segundos) de um arquivo para ser removido:
+# maior que FATURA_JOB_TIMEOUT_SEGUNDOS, para não apagar downloads em andamento
+RECONCILIACAO_LOTE = int(os.environ.get('RECONCILIACAO_LOTE', 1000))
+RECONCILIACAO_CARENCIA_SEGUNDOS = float(os.environ.get('RECONCILIACAO_CARENCIA_SEGUNDOS', 6 * 3600))
+
+# Verificação de integridade dos PDFs (manage.py verificar_faturas)
+# Limites de tamanho (bytes) de um PDF de fatura aceitável
+INTEGRIDADE_TAMANHO_MINIMO = int(os.environ.get('INTEGRIDADE_TAMANHO_MINIMO', 1024))
+INTEGRIDADE_TAMANHO_MAXIMO = int(os.environ.get('INTEGRIDADE_TAMANHO_MAXIMO', 20 * 1024 * 1024))
+# Depois de quantos dias uma fatura já verificada é verificada de novo
+INTEGRIDADE_REVERIFICAR_DIAS = int(os.environ.get('INTEGRIDADE_REVERIFICAR_DIAS', 30))
 
 # Logging configuration - Simplificado para evitar erros
 LOGGING = {
@@ -1,14 +1,11 @@
 # backend/config/urls.py
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Os arquivos de mídia não são servidos publicamente, nem em desenvolvimento:
+# os PDFs são entregues pelo endpoint protegido api/faturas/<id>/arquivo/
\ No newline at end of file
@@ -5,6 +5,10 @@ import os
 import django
 import threading
 import logging
+import time
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 from flask import Flask, request, jsonify
 
 # --- Configuração do Django ---
@@ -13,42 +17,191 @@ django.setup()
 # --- Fim da Configuração do Django ---
 
 # Importa o serviço APÓS o setup do Django
-from api.services.equatorial_service_improved import EquatorialService # Usando a versão melhorada
-
-# Configuração de logging para o task_processor
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='task_processor.log',
-    filemode='a'
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from api.models import Customer, FaturaTask
+from api.services.equatorial_service_improved import ( # Usando a versão melhorada
+    processar_faturas_em_paralelo, criar_fatura_log, calcular_backoff
+)
+from api.services.controle_portal import get_controle_portal, PortalIndisponivelError
+from api.services import processadores
+from api.services.seletores import get_registro_seletores
+from api.services.cancelamento import registrar_job, encerrar_job, cancelar_jobs, ImportacaoCancelada
+from api.logs import configurar_logs_assincronos, contexto_log
+from api import profiling
+
+# Logs em JSON via fila: as threads de scraping não esperam pela escrita em disco
+configurar_logs_assincronos(
+    settings.TASK_PROCESSOR_LOG_ARQUIVO,
+    max_bytes=settings.TASK_PROCESSOR_LOG_MAX_BYTES,
+    backups=settings.TASK_PROCESSOR_LOG_BACKUPS
 )
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-def run_scraping_task(customer_id):
+def executar_com_pausas(customer_id, fatura_log, cancelamento):
+    """
+    Executa uma rodada do job. Se o portal ficar indisponível, o job é pausado até
+    o circuito fechar. Retorna False se o job for abandonado.
+    """
+    controle = get_controle_portal()
+    for pausa in range(settings.EQUATORIAL_MAX_PAUSAS_POR_JOB + 1):
+        # Com o circuito aberto o job fica parado aqui, sem consumir tentativas de login
+        while not controle.aguardar_portal(timeout=5):
+            cancelamento.verificar()
+        try:
+            # Executa o fluxo completo de automação, dividindo as UCs entre sessões paralelas
+            # quando o cliente tem muitas UCs. Cada sessão gerencia setup, login, processamento e fechamento.
+            processar_faturas_em_paralelo(customer_id, fatura_log=fatura_log, cancelamento=cancelamento)
+            return True
+        except PortalIndisponivelError as e:
+            logger.warning(f"Job do cliente {customer_id} pausado ({pausa + 1}): {e}")
+
+    FaturaTask.objects.filter(customer_id=customer_id, status='pending').update(
+        status='failed',
+        error_message="Portal da Equatorial indisponível após várias tentativas"
+    )
+    logger.error(f"Job do cliente {customer_id} abandonado: portal indisponível")
+    return False
+
+def run_scraping_task(customer_id, perfilar=False):
     """
     Função que executa o serviço da Equatorial em uma thread separada.
+    UCs que falharem são repetidas com backoff exponencial, retomando do checkpoint.
+    Com `perfilar`, as pilhas da thread do job e das sessões e o SQL são gravados em PROFILING_DIR.
     """
-    logger.info(f"Iniciando tarefa de scraping para o cliente ID: {customer_id}")
-    service = None
-    try:
-        # Instancia o serviço
-        service = EquatorialService(customer_id=customer_id)
-        
-        # Executa o fluxo completo de automação
-        # O próprio serviço agora gerencia o setup, login, processamento e fechamento.
-        service.processar_todas_faturas() 
-
-        logger.info(f"Tarefa de scraping para o cliente ID: {customer_id} concluída.")
-
-    except Exception as e:
-        logger.error(f"Erro CRÍTICO ao executar a tarefa de scraping para o cliente ID: {customer_id}", exc_info=True)
-        # A lógica de falha da task agora é tratada dentro do próprio serviço
-    finally:
-        if service and service.driver:
-            logger.info(f"Fechando driver para cliente {customer_id}.")
-            service.close()
+    job_id = uuid.uuid4().hex[:8]
+    perfil = nullcontext()
+    if perfilar:
+        ident = threading.get_ident()
+        prefixo_sessoes = f"equatorial-{customer_id}_"
+        perfil = profiling.perfilar(
+            f"job-{job_id}",
+            filtro_threads=lambda thread: thread.ident == ident or thread.name.startswith(prefixo_sessoes),
+            job=job_id,
+            customer=customer_id,
+        )
+    # Contexto dos logs do job: vale também para as sessões paralelas do scraper
+    with contexto_log(job=job_id, customer=customer_id), perfil as perfil_job:
+        logger.info(f"Iniciando tarefa de scraping para o cliente ID: {customer_id}")
+        # Token de cancelamento do job, com o prazo rígido total
+        cancelamento = registrar_job(customer_id, prazo=settings.FATURA_JOB_TIMEOUT_SEGUNDOS)
+        job_task_ids = []
+        inicio_job = datetime.now()
+        try:
+            customer = Customer.objects.get(pk=customer_id)
+            # As tasks deste job são as que estão pendentes no momento em que ele começa
+            job_task_ids = list(
+                FaturaTask.objects.filter(customer=customer, status='pending').values_list('id', flat=True)
+            )
+            if not job_task_ids:
+                logger.info(f"Nenhuma task pendente para o cliente {customer_id}.")
+                return
+            # Registra esta instância como dona do job (também quando ele chegou pela URL padrão)
+            FaturaTask.objects.filter(id__in=job_task_ids).update(processador=settings.PROCESSADOR_NOME)
+            if perfil_job is not None:
+                perfil_job.dados['task_ids'] = job_task_ids
+            fatura_log = criar_fatura_log(customer)
+
+            for tentativa in range(settings.FATURA_RETRY_MAX_TENTATIVAS + 1):
+                processadores.verificar_posse(FaturaTask.objects.filter(id__in=job_task_ids), settings.PROCESSADOR_NOME)
+                if not executar_com_pausas(customer_id, fatura_log, cancelamento):
+                    return
+                # UCs descobertas no portal durante a rodada passam a fazer parte do job
+                job_task_ids += FaturaTask.objects.filter(
+                    customer=customer, created_at__gte=inicio_job
+                ).exclude(id__in=job_task_ids).values_list('id', flat=True)
+
+                # UCs que falharam ou que ficaram pendentes (ex.: sessão encerrada pelo prazo da UC)
+                falhas = FaturaTask.objects.filter(id__in=job_task_ids, status__in=['failed', 'pending'])
+                if tentativa == settings.FATURA_RETRY_MAX_TENTATIVAS or not falhas.exists():
+                    break
+
+                # Apenas essas UCs voltam para a fila; as concluídas não são refeitas
+                processadores.verificar_posse(falhas, settings.PROCESSADOR_NOME)
+                atraso = calcular_backoff(tentativa)
+                falhas.update(
+                    status='pending',
+                    tentativas=F('tentativas') + 1,
+                    proxima_tentativa_em=datetime.now() + timedelta(seconds=atraso)
+                )
+                logger.warning(f"Cliente {customer_id}: repetindo UCs com falha em {atraso:.0f}s (tentativa {tentativa + 1})")
+                cancelamento.aguardar(atraso)
+
+            # Sobras pendentes após a última rodada não podem ficar presas na fila
+            FaturaTask.objects.filter(id__in=job_task_ids, status='pending').filter(
+                Q(processador=settings.PROCESSADOR_NOME) | Q(processador__isnull=True)
+            ).update(
+                status='failed',
+                error_message="UC não processada após todas as tentativas"
+            )
+            logger.info(f"Tarefa de scraping para o cliente ID: {customer_id} concluída.")
+
+        except processadores.JobAssumidoError as e:
+            # As tasks já são da outra instância: nada é alterado
+            logger.warning(f"Job do cliente {customer_id} abandonado por esta instância: {e}")
+        except ImportacaoCancelada as e:
+            logger.warning(f"Job do cliente {customer_id} interrompido: {e}")
+            FaturaTask.objects.filter(id__in=job_task_ids, status__in=['pending', 'processing']).update(
+                status=e.status,
+                error_message=str(e),
+                completed_at=datetime.now()
+            )
+        except Exception as e:
+            logger.error(f"Erro CRÍTICO ao executar a tarefa de scraping para o cliente ID: {customer_id}", exc_info=True)
+            # O serviço trata as falhas por UC; um erro fora dele não pode deixar tasks presas na fila
+            FaturaTask.objects.filter(id__in=job_task_ids, status__in=['pending', 'processing']).filter(
+                Q(processador=settings.PROCESSADOR_NOME) | Q(processador__isnull=True)
+            ).update(
+                status='failed',
+                error_message=f"Erro inesperado no job: {e}",
+                completed_at=datetime.now()
+            )
+        finally:
+            encerrar_job(customer_id, cancelamento)
+            connection.close()
+
+def recuperar_tasks_interrompidas():
+    """
+    Tasks que ficaram em 'processing' quando este processador caiu voltam para a fila,
+    mantendo o checkpoint, e os jobs dos clientes afetados são retomados, assim como
+    os jobs que estavam na fila ('pending') sem terem começado. As tasks de outras
+    instâncias ativas não são tocadas.
+    """
+    interrompidas = FaturaTask.objects.filter(status__in=['pending', 'processing']).filter(
+        Q(processador=settings.PROCESSADOR_NOME) | Q(processador__isnull=True)
+    )
+    # Jobs interativos retomam primeiro; a faixa de cada sessão vem da prioridade das tasks
+    customer_ids = list(dict.fromkeys(
+        interrompidas.order_by('prioridade').values_list('customer_id', flat=True)
+    ))
+    interrompidas.filter(status='processing').update(status='pending')
+    for customer_id in customer_ids:
+        logger.info(f"Retomando job interrompido do cliente {customer_id}")
+        threading.Thread(target=run_scraping_task, args=(customer_id,)).start()
+
+def manter_heartbeat():
+    """
+    Renova o registro desta instância e assume os jobs das instâncias que
+    pararam de enviar heartbeat e cujos clientes agora são dela.
+    """
+    while True:
+        try:
+            processadores.registrar_heartbeat(
+                settings.PROCESSADOR_NOME,
+                settings.PROCESSADOR_URL,
+                settings.PROCESSADOR_CAPACIDADE,
+                sessoes_em_uso=get_controle_portal().concorrencia.em_uso
+            )
+            for customer_id in processadores.assumir_jobs_orfaos(settings.PROCESSADOR_NOME):
+                threading.Thread(target=run_scraping_task, args=(customer_id,)).start()
+        except Exception as e:
+            logger.error(f"Erro no heartbeat do processador {settings.PROCESSADOR_NOME}: {e}", exc_info=True)
+        finally:
+            connection.close()
+        time.sleep(settings.PROCESSADOR_HEARTBEAT_SEGUNDOS)
 
 @app.route('/process-task', methods=['POST'])
 def process_task():
@@ -64,13 +217,43 @@ def process_task():
     logger.info(f"Requisição recebida para iniciar tarefa para o cliente {customer_id}")
     
     # Inicia a tarefa de scraping em uma nova thread para não bloquear a requisição
-    task_thread = threading.Thread(target=run_scraping_task, args=(customer_id,))
+    task_thread = threading.Thread(target=run_scraping_task, args=(customer_id, bool(data.get('profile'))))
     task_thread.start()
     
     return jsonify({"message": f"Tarefa para o cliente {customer_id} iniciada em segundo plano."}), 202
 
+@app.route('/cancel-task', methods=['POST'])
+def cancel_task():
+    """
+    Cancela os jobs em execução do cliente. Os navegadores são fechados na hora,
+    liberando as vagas de sessão.
+    """
+    data = request.get_json()
+    if not data or 'customer_id' not in data:
+        return jsonify({"error": "customer_id não fornecido"}), 400
+
+    customer_id = data['customer_id']
+    cancelados = cancelar_jobs(customer_id)
+    logger.info(f"Cancelamento solicitado para o cliente {customer_id}: {cancelados} job(s) interrompido(s)")
+    return jsonify({"cancelados": cancelados}), 200
+
+@app.route('/portal-status', methods=['GET'])
+def portal_status():
+    """
+    Estado do circuit breaker e do limite adaptativo de sessões do portal, com
+    as sessões em uso, em espera e o tempo de espera por faixa (interativa e lote)
+    """
+    return jsonify(get_controle_portal().status()), 200
+
+@app.route('/seletores-status', methods=['GET'])
+def seletores_status():
+    """Seletor em uso, latência das buscas e alertas de seletor primário por elemento do portal"""
+    return jsonify(get_registro_seletores().status()), 200
+
 if __name__ == '__main__':
-    print("Servidor de tarefas (Flask) rodando em http://127.0.0.1:5001")
+    print(f"Servidor de tarefas (Flask) {settings.PROCESSADOR_NOME} rodando em {settings.PROCESSADOR_URL or settings.TASK_PROCESSOR_URL}")
+    recuperar_tasks_interrompidas()
+    threading.Thread(target=manter_heartbeat, name='processador-heartbeat', daemon=True).start()
     # Usar host '0.0.0.0' para ser acessível de fora do container (do host)
     # É importante desativar o modo debug ao usar threads para evitar problemas com o reloader do Flask.
     app.run(host='0.0.0.0', port=5001, debug=False)
@@ -1,7 +1,8 @@
 // frontend/src/components/FaturaImport.jsx
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import ActionButton from './ActionButton';
 import EmptyState from './EmptyState';
+import { generateUUID } from '../utils/idUtils';
 
 const FaturaImport = ({ customerId }) => {
   const [tasks, setTasks] = useState([]);
@@ -10,6 +11,8 @@ const FaturaImport = ({ customerId }) => {
   const [loading, setLoading] = useState(false);
   const [importing, setImporting] = useState(false);
   const [activeTab, setActiveTab] = useState('faturas');
+  // Idempotency-Key da tentativa de importação atual, reutilizada ao repetir o envio
+  const idempotencyKeyRef = useRef(null);
 
   // Busca tarefas em andamento
   const fetchTasks = async () => {
@@ -56,6 +59,11 @@ const FaturaImport = ({ customerId }) => {
     }
   };
 
+  useEffect(() => {
+    // Outro cliente, outra importação
+    idempotencyKeyRef.current = null;
+  }, [customerId]);
+
   useEffect(() => {
     fetchTasks();
     fetchFaturas();
@@ -73,15 +81,30 @@ const FaturaImport = ({ customerId }) => {
   }, [customerId, importing]);
 
   const handleStartImport = async () => {
+    if (loading) {
+      return;
+    }
     setLoading(true);
+    // Uma chave por tentativa de importação: repetir o clique após um erro de rede,
+    // timeout ou erro do servidor reenvia a mesma chave, e o servidor agrupa o reenvio
+    if (!idempotencyKeyRef.current) {
+      idempotencyKeyRef.current = generateUUID();
+    }
     try {
       const response = await fetch(`/api/customers/${customerId}/faturas/import/`, {
-        method: 'POST'
+        method: 'POST',
+        headers: { 'Idempotency-Key': idempotencyKeyRef.current }
       });
-      
+
+      // Resposta definitiva: a próxima importação usa uma chave nova. Com 409 a requisição
+      // original ainda está em processamento e com 5xx ela pode ser repetida com a mesma chave.
+      if (response.status !== 409 && response.status < 500) {
+        idempotencyKeyRef.current = null;
+      }
+
       if (response.ok) {
         const data = await response.json();
-        alert('Importação iniciada com sucesso!');
+        alert(data.coalesced ? 'Já existe uma importação em andamento para este cliente.' : 'Importação iniciada com sucesso!');
         setImporting(true);
         fetchTasks();
       } else {
@@ -96,6 +119,31 @@ const FaturaImport = ({ customerId }) => {
     }
   };
 
+  const handleCancelImport = async () => {
+    if (!window.confirm('Deseja cancelar a importação em andamento?')) {
+      return;
+    }
+    setLoading(true);
+    try {
+      const response = await fetch(`/api/customers/${customerId}/faturas/import/cancel/`, {
+        method: 'POST'
+      });
+
+      if (response.ok) {
+        setImporting(false);
+        fetchTasks();
+      } else {
+        const error = await response.json();
+        alert(`Erro: ${error.error || 'Não foi possível cancelar a importação'}`);
+      }
+    } catch (error) {
+      console.error('Erro ao cancelar importação:', error);
+      alert('Erro ao cancelar importação');
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'pending':
@@ -106,6 +154,8 @@ const FaturaImport = ({ customerId }) => {
         return 'bg-green-100 text-green-800';
       case 'failed':
         return 'bg-red-100 text-red-800';
+      case 'cancelled':
+        return 'bg-gray-200 text-gray-700';
       default:
         return 'bg-gray-100 text-gray-800';
     }
@@ -121,6 +171,8 @@ const FaturaImport = ({ customerId }) => {
         return 'Concluída';
       case 'failed':
         return 'Falhou';
+      case 'cancelled':
+        return 'Cancelada';
       default:
         return status;
     }
@@ -271,13 +323,25 @@ const FaturaImport = ({ customerId }) => {
         <h3 className="text-lg font-semibold text-gray-800">
           Gerenciamento de Faturas
         </h3>
-        <ActionButton
-          icon="file-import"
-          onClick={handleStartImport}
-          disabled={loading || importing}
-        >
-          {importing ? 'Importação em andamento...' : 'Importar Faturas em aberto'}
-        </ActionButton>
+        <div className="flex items-center gap-2">
+          {importing && (
+            <ActionButton
+              icon="stop"
+              variant="danger"
+              onClick={handleCancelImport}
+              disabled={loading}
+            >
+              Cancelar
+            </ActionButton>
+          )}
+          <ActionButton
+            icon="file-import"
+            onClick={handleStartImport}
+            disabled={loading || importing}
+          >
+            {importing ? 'Importação em andamento...' : 'Importar Faturas em aberto'}
+          </ActionButton>
+        </div>
       </div>
 
       {/* Tabs */}
@@ -12,10 +12,6 @@ export default defineConfig({
         target: 'http://backend:8000',
         changeOrigin: true,
       },
-      '/media': {
-        target: 'http://backend:8000',
-        changeOrigin: true,
-      },
     },
   },
   build: {